@@ -1,31 +1,78 @@
 from typing import List
+import asyncio
 import json
+import time
 import os
 import logging
-import redis
+import openai
 import copy
+import hashlib
+from contextlib import aclosing
 
 from xrx_agent_framework.xrx_agent_framework import observability_decorator
-from xrx_agent_framework.xrx_agent_framework import initialize_llm_client
+from xrx_agent_framework.xrx_agent_framework import initialize_async_llm_client
 from .context_manager import set_session, session_var
+from .tracing import (
+    TurnTimings,
+    record_cache,
+    record_span,
+    record_tokens,
+    span,
+    traced_turn,
+)
 from .utils.stock_utils import (
     get_stock_fundamentals,
-    get_stock_financials,
     initialize_polygon_client,
+    compact_fundamentals_text,
+)
+from .utils.cache_utils import get_cached_data, set_cached_data
+from .utils.prewarm_utils import record_ticker_requests
+from .utils.symbol_utils import load_symbol_matcher, normalize_utterance
+from .utils.stream_utils import BufferedStream, ResponseStreamParser
+from .utils.json_utils import repair_json, validate_agent_response
+from .utils.history_utils import compact_history, estimate_tokens
+from .utils.prompt_utils import PromptBuilder, prefix_reuse
+from .utils.market_cache_utils import find_market_response, store_market_response
+from .utils.widget_utils import WidgetHydrator
+from .utils.snapshot_utils import market_summary_text
+from .utils.cancel_utils import (
+    CancellationToken,
+    TurnCancelled,
+    close_token,
+    open_token,
 )
 
 
-# set up the redis client
-redis_host = os.getenv("REDIS_HOST", "localhost")
-redis_client = redis.asyncio.Redis(host=redis_host, port=6379, db=0)
-
 # set up the LLM
-client = initialize_llm_client()
+client = initialize_async_llm_client()
 MODEL = os.environ["LLM_MODEL_ID"]
 
 # set up polygon
 polygon_client = initialize_polygon_client()
 
+# seconds to wait for a single ticker's data before answering without it
+STOCK_FETCH_TIMEOUT = float(os.getenv("STOCK_FETCH_TIMEOUT", "3"))
+
+# fetches that outlived their deadline, referenced here so they can finish
+background_fetches = set()
+
+# resolves plain ticker and company mentions without the context LLM call
+symbol_matcher = load_symbol_matcher()
+SYMBOL_CACHE_TTL = int(os.getenv("SYMBOL_CACHE_TTL", "86400"))
+
+# answer from the previous turn's stocks while the symbol extraction call runs
+SPECULATIVE_RESPONSE = os.getenv("SPECULATIVE_RESPONSE", "true").lower() == "true"
+
+# above this many tokens each ticker's data is cut down to its essential fields
+STOCK_CONTEXT_TOKEN_BUDGET = int(os.getenv("STOCK_CONTEXT_TOKEN_BUDGET", "1500"))
+
+# seconds a response is reused for an identical prompt; the prompt carries the live
+# price, so keep this within SNAPSHOT_CACHE_TTL (0 disables the response cache)
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+# stream the main LLM response and send widgets and sentences as they complete
+STREAM_RESPONSE = os.getenv("STREAM_RESPONSE", "true").lower() == "true"
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(message)s")
 
 SYSTEM_PROMPT = """You are a stock market assistant named Alice. You are responsible for retrieving stock market visualizations for a user. You do not have access to the data, but you can show live interfaces to the user.
@@ -320,6 +367,24 @@ Assistant: {
 * Only provide the symbols JSON. You are not the other assistant, do not provide widgets or response, only the stock symbols (aka Ticker Symbols).
 """
 
+JSON_FIXER_SYSTEM_PROMPT = """You fix the output of a stock market assistant that must be perfectly formatted JSON with the following structure
+
+{
+    "widgets": [
+        {
+        "type":"showStockPrice",
+        "parameters": { "symbol": "AAPL" }
+        }
+    ],
+    "response": "your response to the analyst"
+}
+
+You are given the assistant's output and what is wrong with it. Return only the corrected JSON, keeping the assistant's widgets and response wherever possible.
+"""
+
+# spoken when the response can't be recovered at all
+FALLBACK_RESPONSE = "Sorry, I had trouble putting that answer together. Could you ask me again?"
+
 
 @observability_decorator(name="run_agent")
 async def run_agent(input_dict: dict):
@@ -341,8 +406,8 @@ async def run_agent(input_dict: dict):
         logging.exception(f"An error occurred: {e}")
 
 
-def context_gathering_agent(messages: List[dict], task_id: str):
-    # Gathers context regarding stocks the user is asking about.
+async def extract_symbols_with_llm(messages: List[dict]):
+    # Asks the LLM which stocks the user just asked about.
 
     messages = copy.deepcopy(messages)
 
@@ -352,25 +417,102 @@ def context_gathering_agent(messages: List[dict], task_id: str):
     messages.insert(0, system_prompt)
 
     # call the language model
-    response = client.chat.completions.create(
-        model=os.environ["LLM_MODEL_ID"],
-        messages=messages,
-        max_tokens=4096,
-        response_format={"type": "json_object"},
-    )
+    with span("llm.symbol_extraction"):
+        response = await client.chat.completions.create(
+            model=os.environ["LLM_MODEL_ID"],
+            messages=messages,
+            max_tokens=4096,
+            response_format={"type": "json_object"},
+        )
+    record_usage("symbol_extraction", response)
 
     response_message = response.choices[0].message.content
 
     # parse the response
     response_message_dict = json.loads(response_message)
-    context_response = response_message_dict["symbols"]
+    return response_message_dict["symbols"]
+
+
+def record_usage(call: str, response):
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        record_tokens(call, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+
+def latest_utterance(messages: List[dict]):
+    user_messages = [m for m in messages if m["role"] == "user"]
+    return user_messages[-1]["content"] if user_messages else ""
+
+
+def previous_reply(messages: List[dict]):
+    """The assistant message the latest utterance answers, if any"""
+    user_indexes = [i for i, m in enumerate(messages) if m["role"] == "user"]
+    earlier = messages[: user_indexes[-1]] if user_indexes else []
+    replies = [m for m in earlier if m["role"] == "assistant"]
+    return replies[-1]["content"] if replies else ""
+
+
+async def resolve_symbols(
+    messages: List[dict], previous_symbols: List[str], token: CancellationToken
+):
+    # Resolves the symbols the local matcher could not, memoized per utterance.
+
+    # follow-ups depend on what was discussed, so memoize on the previous symbols too
+    utterance = latest_utterance(messages)
+    memo_key = "symbols_" + hashlib.sha256(
+        f"{normalize_utterance(utterance)}|{','.join(previous_symbols)}".encode()
+    ).hexdigest()
+    symbols = await get_cached_data(memo_key)
+    record_cache("symbols", "miss" if symbols is None else "hit")
+    if symbols is not None:
+        return symbols
+
+    symbols = await token.run(extract_symbols_with_llm(messages), "llm_call")
+    await set_cached_data(memo_key, symbols, SYMBOL_CACHE_TTL)
+    return symbols
+
+
+def start_fundamentals_fetches(
+    tickers: List[str], token: CancellationToken, prefetched: dict = None
+):
+    # one task per ticker, reusing any fetch that was started speculatively; a
+    # cancelled turn stops waiting on them, and cache misses no other turn shares
+    # make no further Polygon requests (one already sent still completes)
+    prefetched = prefetched or {}
+    return {
+        ticker: prefetched.get(ticker)
+        or token.track(
+            asyncio.create_task(get_stock_fundamentals(ticker, polygon_client)),
+            "polygon_fetch",
+        )
+        for ticker in dict.fromkeys(tickers)
+    }
 
-    logging.info(f"Stocks to Retrieve: {str(context_response)}")
 
+async def build_stock_context(tasks: dict):
     stock_context = ""
 
-    for ticker in context_response:
-        text, _ = get_stock_fundamentals(ticker, polygon_client)
+    # every ticker is fetched at once; a ticker that misses the deadline keeps
+    # loading in the background (warming the cache) but is reported as unavailable
+    if tasks:
+        with span("stock_data"):
+            await asyncio.wait(tasks.values(), timeout=STOCK_FETCH_TIMEOUT)
+
+    texts = []
+    for ticker, task in tasks.items():
+        if task.done() and not task.cancelled() and task.exception() is None:
+            text, _ = task.result()
+        else:
+            logging.warning(f"Fundamentals for {ticker} not ready in time")
+            text = f"Data unavailable for {ticker}"
+            if not task.done():
+                background_fetches.add(task)
+                task.add_done_callback(background_fetches.discard)
+        texts.append(text)
+
+    if sum(estimate_tokens(text) for text in texts) > STOCK_CONTEXT_TOKEN_BUDGET:
+        texts = [compact_fundamentals_text(text) for text in texts]
+    for text in texts:
         stock_context += text + "\n" * 2
 
     if len(stock_context) > 0:
@@ -379,95 +521,444 @@ def context_gathering_agent(messages: List[dict], task_id: str):
     return stock_context
 
 
-async def single_turn_agent(messages: List[dict], task_id: str):
+async def context_gathering_agent(
+    messages: List[dict], token: CancellationToken, symbols=None, prefetched: dict = None
+):
+    # Gathers context regarding stocks the user is asking about.
 
-    # get context
-    stock_context = context_gathering_agent(messages, task_id)
+    session_data = session_var.get()
+    if symbols is None:
+        symbols = await resolve_symbols(
+            messages, session_data.get("stock-symbols", []), token
+        )
+    session_data["stock-symbols"] = symbols
 
-    # set up the base messages
-    system_prompt = {
-        "role": "system",
-        "content": stock_context + "\n# Instructions\n" + SYSTEM_PROMPT,
-    }
-    first_assistant_message = {
-        "role": "assistant",
-        "content": "Hello! I am Alice, your financial assistant that can provide stock market visualizations.",
-    }
-    messages.insert(0, system_prompt)
-    messages.insert(1, first_assistant_message)
+    logging.info(f"Stocks to Retrieve: {str(symbols)}")
+    record_ticker_requests(symbols)
+
+    tasks = start_fundamentals_fetches(symbols, token, prefetched)
+
+    # speculative fetches for tickers the user moved away from are not needed
+    for ticker, task in (prefetched or {}).items():
+        if ticker not in tasks:
+            task.cancel()
+
+    stock_context = await build_stock_context(tasks)
+    if not symbols:
+        # market-wide questions get the day's breadth and movers from the bulk snapshot
+        stock_context += await market_summary_text(polygon_client)
+    return stock_context
+
+
+def build_prompt(messages: List[dict], stock_context: str):
+    # the instructions come first so every call shares them as a cacheable prefix
+    prompt = PromptBuilder().add_static(
+        {"role": "system", "content": "# Instructions\n" + SYSTEM_PROMPT},
+        {
+            "role": "assistant",
+            "content": "Hello! I am Alice, your financial assistant that can provide stock market visualizations.",
+        },
+    )
+
+    # the stock data goes right before the question it was fetched for, so the
+    # history up to there is the same prefix the previous turn sent
+    prompt.add(*messages[:-1])
+    if stock_context:
+        prompt.add({"role": "system", "content": stock_context})
+    prompt.add(*messages[-1:])
+    return prompt
+
+
+def report_prompt_reuse(prompt: PromptBuilder, timings: TurnTimings):
+    session_data = session_var.get()
+    reused, total, session_data["prompt-prefix"] = prefix_reuse(
+        prompt.build(), session_data.get("prompt-prefix")
+    )
+    timings.prompt["prompt_tokens"] = total
+    timings.prompt["static_prefix_tokens"] = prefix_reuse(prompt.static)[1]
+    timings.prompt["reused_prompt_tokens"] = reused
 
-    # TODO: Improve this logic. This retries to ideally fix if there is a JSON error. Either except should be specific to JSON error or another model should fix the JSON.
+
+async def get_cached_response(prompt: PromptBuilder):
+    if RESPONSE_CACHE_TTL <= 0:
+        return None
+    response_message = await get_cached_data(prompt.cache_key("response"))
+    record_cache("response", "miss" if response_message is None else "hit")
+    return response_message
+
+
+async def cache_response(prompt: PromptBuilder, response_message: str):
+    if RESPONSE_CACHE_TTL > 0:
+        await set_cached_data(
+            prompt.cache_key("response"), response_message, RESPONSE_CACHE_TTL
+        )
+
+
+def failed_generation(error: Exception):
+    # in JSON mode the API rejects output that isn't valid JSON, but still returns it
+    body = getattr(error, "body", None)
+    if isinstance(body, dict):
+        body = body.get("error", body)
+        if isinstance(body, dict):
+            return body.get("failed_generation")
+    return None
+
+
+async def generate_response(messages: List[dict], timings: TurnTimings):
+    # Runs the main LLM call and returns the raw JSON response.
+
+    # invalid JSON is repaired from the rejected output rather than generated again;
+    # transient API errors are already retried by the client
     try:
-        response = client.chat.completions.create(
+        with span("llm.response"):
+            response = await client.chat.completions.create(
+                model=os.environ["LLM_MODEL_ID"],
+                messages=messages,
+                max_tokens=4096,
+                response_format={"type": "json_object"},
+            )
+    except openai.BadRequestError as e:
+        generation = failed_generation(e)
+        if generation is None:
+            raise
+        logging.warning(f"LLM output failed JSON validation: {str(e)}")
+        timings.count("failed_generations")
+        return generation
+
+    record_usage("response", response)
+
+    # providers that cache prompt prefixes report how much of the prompt they reused
+    details = getattr(getattr(response, "usage", None), "prompt_tokens_details", None)
+    if getattr(details, "cached_tokens", None) is not None:
+        timings.prompt["provider_cached_tokens"] = details.cached_tokens
+
+    return response.choices[0].message.content
+
+
+async def stream_response(messages: List[dict], timings: TurnTimings):
+    # Yields the main LLM response text as it is generated.
+    if not STREAM_RESPONSE:
+        yield await generate_response(messages, timings)
+        return
+
+    started = time.perf_counter()
+    try:
+        stream = await client.chat.completions.create(
             model=os.environ["LLM_MODEL_ID"],
             messages=messages,
             max_tokens=4096,
             response_format={"type": "json_object"},
+            stream=True,
         )
-    except:  # TODO: show output from last model to help this one fix JSON...
-        response = client.chat.completions.create(
-            model=os.environ["LLM_MODEL_ID"],
-            messages=messages,
-            max_tokens=4096,
+    except Exception as e:
+        generation = failed_generation(e)
+        if generation is not None:
+            timings.count("failed_generations")
+            yield generation
+            return
+        # nothing was generated yet, so fall back to the blocking call
+        logging.error(f"Streaming completion failed to start: {str(e)}")
+        timings.count("llm_retries")
+        yield await generate_response(messages, timings)
+        return
+
+    streamed, usage = "", None
+    try:
+        async for chunk in stream:
+            # providers that report usage while streaming send it with the last chunk
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not streamed:
+                    record_span("llm.first_token", time.perf_counter() - started)
+                streamed += chunk.choices[0].delta.content
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        # keep what was generated; the JSON repair step closes a truncated output
+        logging.error(f"Streaming completion interrupted: {str(e)}")
+        timings.count("interrupted_streams")
+        generation = failed_generation(e)
+        if generation is not None and generation.startswith(streamed):
+            yield generation[len(streamed) :]
+    finally:
+        # a stream left early (e.g. a cancelled turn) drops its connection, which
+        # stops the generation
+        if hasattr(stream, "close"):
+            await stream.close()
+        if usage is not None:
+            record_tokens("response", usage.prompt_tokens or 0, usage.completion_tokens or 0)
+        else:
+            # estimated like the history budget, for providers that don't report it
+            record_tokens(
+                "response",
+                sum(estimate_tokens(message["content"]) for message in messages),
+                estimate_tokens(streamed) if streamed else 0,
+            )
+
+
+async def as_stream(text: str):
+    yield text
+
+
+async def speculative_response(
+    messages: List[dict], prefetched: dict, timings: TurnTimings
+):
+    # Streams an answer as if the user is still asking about the previous turn's stocks.
+    prompt = build_prompt(messages, await build_stock_context(prefetched))
+    timings.mark("speculative_generation_start")
+    response_message = await get_cached_response(prompt)
+    if response_message is not None:
+        yield response_message
+    else:
+        async for chunk in stream_response(prompt.build(), timings):
+            yield chunk
+    timings.mark("speculative_generation_end")
+
+
+async def fix_response_json(response_message: str, problems: List[str]):
+    # Asks a model to fix the main agent's output instead of generating it again.
+    problem_list = "\n".join(f"- {problem}" for problem in problems)
+    with span("llm.json_fixer"):
+        response = await client.chat.completions.create(
+            model=os.getenv("LLM_MODEL_ID_JSON_FIXER", MODEL),
+            messages=[
+                {"role": "system", "content": JSON_FIXER_SYSTEM_PROMPT},
+                {
+                    "role": "user",
+                    "content": f"Problems:\n{problem_list}\n\nOutput:\n{response_message}",
+                },
+            ],
+            max_tokens=2048,
             response_format={"type": "json_object"},
         )
+    record_usage("json_fixer", response)
+    return response.choices[0].message.content
 
-    # save the message
-    response_message = response.choices[0].message.content
-    messages.append({"role": "assistant", "content": response_message})
-
-    # log the response message
-    logging.info(f"LLM Response: {response_message}")
 
-    # parse the response
-    response_message_dict = json.loads(response_message)
-    human_response = response_message_dict["response"]
-
-    # get old session information
-    session_data = session_var.get()
-
-    # get stock widgets
-    if "widgets" in response_message_dict:
-        stock_widgets = response_message_dict["widgets"]
+async def parse_response(response_message: str, timings: TurnTimings):
+    # Parses the main agent's output, repairing it locally when possible and with
+    # a fix-up call otherwise. Always returns a usable {"widgets", "response"} dict.
+    try:
+        response_message_dict = json.loads(response_message)
+    except ValueError:
+        response_message_dict = repair_json(response_message)
+        if response_message_dict is not None:
+            logging.info("Repaired malformed JSON in the LLM response")
+            timings.count("json_repairs")
+
+    parsed, problems = validate_agent_response(response_message_dict)
+    if not problems:
+        return parsed
+
+    logging.warning(f"LLM response needs fixing: {'; '.join(problems)}")
+    timings.count("json_fixup_calls")
+    try:
+        fixed_message = await fix_response_json(response_message, problems)
+        fixed, fixed_problems = validate_agent_response(repair_json(fixed_message))
+    except Exception as e:
+        fixed, fixed_problems = None, [str(e)]
+    if not fixed_problems:
+        return fixed
 
-        # Check if get_stock_financials is needed, aka the showSpreadsheet widget was invoked. Add the appropriate data to the parameters if that is the case.
-        for widget in stock_widgets:
-            if widget["type"] == "showSpreadsheet":
-                processed_financials = get_stock_financials(
-                    widget["parameters"]["symbol"], polygon_client
-                )
-                for column, data in processed_financials.items():
-                    if column == widget["parameters"]["metric"]:
-                        widget["data"] = data
-    else:
-        stock_widgets = []
-    logging.info(f"Rendering widgets: {stock_widgets}")
-    stock_widgets_json = json.dumps(stock_widgets)
-    session_data["stock-widgets"] = stock_widgets_json
-    session_var.set(session_data)
+    # keep whatever parts of the original output were usable
+    logging.error(f"Could not fix the LLM response: {'; '.join(fixed_problems)}")
+    timings.count("json_fixup_failures")
+    parsed = parsed or {"widgets": [], "response": None}
+    if not isinstance(parsed["response"], str) or not parsed["response"].strip():
+        parsed["response"] = FALLBACK_RESPONSE
+    return parsed
 
-    # check if the task has been canceled
-    redis_status = await redis_client.get("task-" + task_id)
-    logging.info(f"Task {task_id} has status {redis_status}")
-    if redis_status == b"cancelled":
-        return
 
+def widget_output(message: dict, stock_widgets: List[dict]):
     # now yield the widget information
     widget_output = {
         "type": "widget-information",
-        "details": stock_widgets_json,
+        "details": json.dumps(stock_widgets),
     }
-    out = {
-        "messages": [messages[-1]],
+    return {
+        "messages": [message],
         "node": "Widget",
         "output": widget_output,
     }
-    yield out
 
+
+def response_output(message: dict, human_response: str):
     # use the "node" and "output" fields to ensure a response is sent to the front end through the xrx orchestrator
-    out = {
-        "messages": [messages[-1]],
+    return {
+        "messages": [message],
         "node": "CustomerResponse",
         "output": human_response,
     }
-    yield out
+
+
+async def single_turn_agent(messages: List[dict], task_id: str):
+    timings = TurnTimings(task_id)
+    token = await open_token(task_id)
+    turn = answer_turn(messages, token, timings)
+    # everything the turn starts is attributed to it in its timings record
+    with traced_turn(timings):
+        try:
+            # nothing more is sent once the task is cancelled, and the work still in
+            # flight (LLM calls, Polygon fetches) is cancelled with it
+            async for output in turn:
+                await token.checkpoint()
+                yield output
+        except TurnCancelled:
+            logging.info(f"Task {task_id} has been cancelled")
+            timings.cancelled(token.work_saved())
+            timings.log()
+        finally:
+            await turn.aclose()
+            close_token(token)
+
+
+async def answer_turn(
+    messages: List[dict], token: CancellationToken, timings: TurnTimings
+):
+    session_data = session_var.get()
+    previous_symbols = session_data.get("stock-symbols", [])
+    utterance = latest_utterance(messages)
+    symbols = symbol_matcher.match(utterance)
+
+    # market-wide questions ("how's the market today") get the same answer for a
+    # while, so a similar enough question after the same reply skips both LLM calls
+    reply = previous_reply(messages)
+    active_widgets = sorted(
+        widget["type"] for widget in json.loads(session_data.get("stock-widgets", "[]"))
+    )
+    if symbols is None:
+        market_response = await find_market_response(utterance, active_widgets, reply)
+        record_cache("market_response", "miss" if market_response is None else "hit")
+        if market_response is not None:
+            timings.count("market_cache_hits")
+            message = {"role": "assistant", "content": json.dumps(market_response)}
+            messages.append(message)
+            session_data["stock-symbols"] = []
+            session_data["stock-widgets"] = json.dumps(market_response["widgets"])
+            timings.log()
+            yield widget_output(message, market_response["widgets"])
+            yield response_output(message, market_response["response"])
+            return
+
+    # both LLM calls get the history cut down to its token budget; the summaries
+    # of older turns are kept in the session so each turn only adds its own
+    history, session_data["history-compaction"] = compact_history(
+        messages, session_data.get("history-compaction")
+    )
+
+    # the symbol extraction call is the slow part of gathering context; while it
+    # runs, fetch data for the previous turn's stocks and stream an answer from it
+    # into a buffer, keeping that work only if the user turns out to still be
+    # asking about the same stocks
+    prefetched, speculation = {}, None
+    if symbols is not None:
+        logging.info(f"Resolved symbols without the LLM: {symbols}")
+    elif previous_symbols:
+        prefetched = start_fundamentals_fetches(previous_symbols, token)
+        if SPECULATIVE_RESPONSE:
+            speculation = BufferedStream(
+                speculative_response(history, prefetched, timings)
+            )
+            token.track(speculation.task, "llm_call")
+
+    # get context
+    stock_context = await context_gathering_agent(history, token, symbols, prefetched)
+    await token.checkpoint()
+    timings.mark("context")
+
+    prompt = build_prompt(history, stock_context)
+    report_prompt_reuse(prompt, timings)
+
+    response_stream, cached = None, False
+    if speculation and set(session_data["stock-symbols"]) == set(previous_symbols):
+        logging.info("Speculative response matches the resolved symbols")
+        # what was generated so far is replayed, then the rest as it streams
+        if await token.run(speculation.wait_started(), "llm_call"):
+            response_stream = speculation.replay()
+            timings.speculation = "hit"
+        else:
+            logging.error(f"Speculative response failed: {str(speculation.error)}")
+    elif speculation:
+        speculation.task.cancel()
+        timings.speculation = "miss"
+    if response_stream is None:
+        # an identical prompt (same data, history and question) gets the same answer
+        response_message = await get_cached_response(prompt)
+        if response_message is not None:
+            logging.info("Serving the response from the response cache")
+            response_stream, cached = as_stream(response_message), True
+            timings.count("response_cache_hits")
+        else:
+            response_stream = stream_response(prompt.build(), timings)
+
+    # save the message, filling it in as the response streams
+    message = {"role": "assistant", "content": ""}
+    messages.append(message)
+
+    # widgets are sent as soon as each one is complete and the spoken response a
+    # sentence at a time, so text-to-speech can start before generation ends. The
+    # last sentence is held back until the stream ends so it carries the full message.
+    parser = ResponseStreamParser()
+    hydrator = WidgetHydrator(polygon_client)
+    stock_widgets, sent_widgets = [], None
+    pending_sentence = None
+    async with aclosing(token.stream(response_stream, "llm_stream")) as chunks:
+        async for chunk in chunks:
+            message["content"] += chunk
+            for kind, value in parser.feed(chunk):
+                if kind == "widget":
+                    hydrator.add(value)
+                    stock_widgets.append(value)
+                else:
+                    if pending_sentence is not None:
+                        timings.mark_first("first_sentence")
+                        yield response_output(message, pending_sentence)
+                    pending_sentence = value
+
+            # widgets still waiting for their data are sent once it is in
+            ready_widgets = hydrator.ready(stock_widgets)
+            if ready_widgets and len(ready_widgets) != len(sent_widgets or []):
+                sent_widgets = ready_widgets
+                timings.mark_first("first_widget")
+                yield widget_output(message, sent_widgets)
+    pending_sentences = [value for _, value in parser.finish()]
+    timings.mark("response")
+
+    # log the response message
+    logging.info(f"LLM Response: {message['content']}")
+
+    # parse the response, storing the repaired version so later turns see valid JSON
+    with span("json_parse"):
+        response_message_dict = await parse_response(message["content"], timings)
+    message["content"] = json.dumps(response_message_dict)
+    if not cached and "json_fixup_failures" not in timings.counts:
+        await cache_response(prompt, message["content"])
+        if not session_data["stock-symbols"]:
+            await store_market_response(
+                utterance, active_widgets, response_message_dict, reply
+            )
+
+    # widgets the stream parser could not pick up are sent now; like before, a
+    # turn without widgets still sends an empty list to clear the previous ones
+    if not stock_widgets:
+        stock_widgets = response_message_dict.get("widgets") or []
+        for widget in stock_widgets:
+            hydrator.add(widget)
+    with span("widget_hydration"):
+        await token.run(hydrator.wait(), "widget_hydration")
+    if sent_widgets is None or len(sent_widgets) != len(stock_widgets):
+        yield widget_output(message, stock_widgets)
+    timings.mark("widgets")
+
+    logging.info(f"Rendering widgets: {stock_widgets}")
+    session_data["stock-widgets"] = json.dumps(stock_widgets)
+    session_var.set(session_data)
+
+    if pending_sentence is not None:
+        pending_sentences.insert(0, pending_sentence)
+    elif not pending_sentences:
+        pending_sentences = [response_message_dict["response"]]
+    timings.log()
+
+    for sentence in pending_sentences:
+        timings.mark_first("first_sentence")
+        yield response_output(message, sentence)
@@ -0,0 +1,72 @@
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .utils.cache_utils import local_cache
+from .utils.cancel_utils import cancel_stats
+from .utils import polygon_utils
+from .utils.polygon_utils import polygon_stats, rate_limit_stats
+
+
+class StatsCollector:
+    """Exports the counters the utils keep for themselves (Polygon requests,
+    cancellations, the in-process cache) when the metrics are scraped"""
+
+    def collect(self):
+        polygon = CounterMetricFamily(
+            "reasoning_polygon_requests",
+            "Polygon requests by endpoint: calls made, calls that waited on the rate limit, retries and failures",
+            labels=["endpoint", "outcome"],
+        )
+        for endpoint, stats in list(polygon_stats.items()):
+            for outcome, count in stats.items():
+                polygon.add_metric([endpoint, outcome], count)
+        yield polygon
+
+        rate_limit = CounterMetricFamily(
+            "reasoning_polygon_rate_limit",
+            "Rate limit checks against the shared Redis bucket and against the local fallback, and times the shared bucket was lost",
+            labels=["kind"],
+        )
+        for kind, count in rate_limit_stats.items():
+            rate_limit.add_metric([kind], count)
+        yield rate_limit
+        yield GaugeMetricFamily(
+            "reasoning_polygon_shared_rate_limit_up",
+            "1 while the shared Polygon rate limit is reachable, 0 while this replica limits itself",
+            int(polygon_utils.shared_limit_lost_at is None),
+        )
+
+        cancellations = CounterMetricFamily(
+            "reasoning_cancellations",
+            "Cancelled turns and the work they stopped",
+            labels=["kind"],
+        )
+        for kind, count in cancel_stats.items():
+            cancellations.add_metric([kind], count)
+        yield cancellations
+
+        stats = local_cache.stats()
+        cache_events = CounterMetricFamily(
+            "reasoning_local_cache_events",
+            "Reads and removals of the in-process cache in front of Redis",
+            labels=["event"],
+        )
+        for event in ("hits", "misses", "evictions", "invalidations"):
+            cache_events.add_metric([event], stats[event])
+        yield cache_events
+        yield GaugeMetricFamily(
+            "reasoning_local_cache_entries", "Entries in the in-process cache", stats["entries"]
+        )
+        yield GaugeMetricFamily(
+            "reasoning_local_cache_bytes", "Size of the in-process cache", stats["bytes"]
+        )
+
+
+REGISTRY.register(StatsCollector())
+
+
+async def metrics(request: Request):
+    """Prometheus scrape endpoint"""
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
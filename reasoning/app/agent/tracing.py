@@ -0,0 +1,194 @@
+import json
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram
+
+# the stages a full turn goes through, in order
+STAGES = ("context", "response", "widgets")
+
+# the turn being answered; work it starts (Polygon fetches, cache reads) inherits
+# it and is attributed to it, work outside a turn only goes to the metrics
+current_turn = contextvars.ContextVar("current_turn", default=None)
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+TURNS = Counter("reasoning_turns_total", "Turns answered, by how they ended", ["outcome"])
+TURN_SECONDS = Histogram(
+    "reasoning_turn_seconds", "Time to answer a turn", ["outcome"], buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "reasoning_stage_seconds",
+    "Time from the start of a turn to the end of each of its stages",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+SPAN_SECONDS = Histogram(
+    "reasoning_span_seconds",
+    "Duration of the operations a turn waits on (LLM calls, Polygon requests, cache layers)",
+    ["span"],
+    buckets=LATENCY_BUCKETS,
+)
+TURN_EVENTS = Counter(
+    "reasoning_turn_events_total", "Recovery and cache events of turns", ["event"]
+)
+CACHE_READS = Counter(
+    "reasoning_cache_reads_total", "Cache reads, by cache and outcome", ["cache", "outcome"]
+)
+LLM_TOKENS = Counter(
+    "reasoning_llm_tokens_total", "LLM tokens, by call and kind", ["call", "kind"]
+)
+
+
+class TurnTimings:
+    """Elapsed time at the end of each stage of a turn and counts of recovery
+    events (JSON repairs, retries), logged once per turn"""
+
+    def __init__(self, task_id: str = ""):
+        self.task_id = task_id
+        self.start = time.perf_counter()
+        self.marks = {}
+        self.speculation = "none"
+        self.counts = {}
+        self.prompt = {}
+        self.cancel = None
+        # what the turn spent its time on, the cache reads it made, the Polygon
+        # requests it caused and the LLM tokens it used
+        self.spans = {}
+        self.cache = {}
+        self.upstream = {}
+        self.tokens = {}
+        self.logged = False
+
+    def mark(self, stage: str):
+        self.marks[stage] = time.perf_counter() - self.start
+
+    def mark_first(self, stage: str):
+        if stage not in self.marks:
+            self.mark(stage)
+
+    def count(self, event: str):
+        self.counts[event] = self.counts.get(event, 0) + 1
+
+    def cancelled(self, work_saved: dict):
+        """Record where a cancelled turn stopped and the work it didn't do"""
+        self.mark("cancelled")
+        self.cancel = {
+            "stages_skipped": [stage for stage in STAGES if stage not in self.marks],
+            **work_saved,
+        }
+
+    def critical_path_saved(self):
+        """Seconds the speculative response took off the turn, if it was used"""
+        if self.speculation != "hit":
+            return 0.0
+        context = self.marks["context"]
+        generation_start = self.marks["speculative_generation_start"]
+        generation_end = self.marks["speculative_generation_end"]
+        sequential_end = context + (generation_end - generation_start)
+        return max(0.0, sequential_end - max(context, generation_end))
+
+    def outcome(self):
+        if self.cancel is not None:
+            return "cancelled"
+        if "market_cache_hits" in self.counts:
+            return "market_cache"
+        if "json_fixup_failures" in self.counts:
+            return "fallback"
+        return "answered"
+
+    def observe(self, outcome: str, total: float):
+        TURNS.labels(outcome).inc()
+        TURN_SECONDS.labels(outcome).observe(total)
+        for stage in STAGES:
+            if stage in self.marks:
+                STAGE_SECONDS.labels(stage).observe(self.marks[stage])
+        for event, count in self.counts.items():
+            TURN_EVENTS.labels(event).inc(count)
+
+    def log(self):
+        # a turn cancelled after it was logged was already answered
+        if self.logged:
+            return
+        self.logged = True
+        total = time.perf_counter() - self.start
+        outcome = self.outcome()
+        self.observe(outcome, total)
+        record = {
+            "task_id": self.task_id,
+            "outcome": outcome,
+            "total_ms": round(total * 1000, 1),
+            "stages_ms": {
+                stage: round(seconds * 1000, 1) for stage, seconds in self.marks.items()
+            },
+            "speculation": self.speculation,
+            "critical_path_saved_ms": round(self.critical_path_saved() * 1000, 1),
+            "events": self.counts,
+            "prompt": self.prompt,
+            "spans": {
+                name: {"count": span["count"], "ms": round(span["ms"], 1)}
+                for name, span in self.spans.items()
+            },
+            "cache": self.cache,
+            "upstream_calls": self.upstream,
+            "tokens": self.tokens,
+        }
+        if self.cancel is not None:
+            record["cancel"] = self.cancel
+        logging.info(f"Turn timings: {json.dumps(record)}")
+
+
+@contextmanager
+def traced_turn(timings: TurnTimings):
+    token = current_turn.set(timings)
+    try:
+        yield timings
+    finally:
+        current_turn.reset(token)
+
+
+def record_span(name: str, seconds: float):
+    SPAN_SECONDS.labels(name).observe(seconds)
+    turn = current_turn.get()
+    if turn is not None:
+        span = turn.spans.setdefault(name, {"count": 0, "ms": 0.0})
+        span["count"] += 1
+        span["ms"] += seconds * 1000
+
+
+@contextmanager
+def span(name: str):
+    """Time the block as `name`, for the metrics and the current turn's record"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+def record_cache(cache: str, outcome: str):
+    """Count a read of `cache` as a hit, a miss, stale (served while refreshed) or
+    cancelled (a miss whose fetch was stopped as nobody waited on it any more)"""
+    CACHE_READS.labels(cache, outcome).inc()
+    turn = current_turn.get()
+    if turn is not None:
+        counts = turn.cache.setdefault(cache, {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+
+
+def record_upstream(endpoint: str):
+    turn = current_turn.get()
+    if turn is not None:
+        turn.upstream[endpoint] = turn.upstream.get(endpoint, 0) + 1
+
+
+def record_tokens(call: str, prompt_tokens: int, completion_tokens: int):
+    LLM_TOKENS.labels(call, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(call, "completion").inc(completion_tokens)
+    turn = current_turn.get()
+    if turn is not None:
+        tokens = turn.tokens.setdefault(call, {"prompt": 0, "completion": 0})
+        tokens["prompt"] += prompt_tokens
+        tokens["completion"] += completion_tokens
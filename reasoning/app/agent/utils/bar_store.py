@@ -0,0 +1,180 @@
+import os
+import re
+import struct
+import asyncio
+import logging
+import tempfile
+from datetime import datetime, timedelta
+from polygon import RESTClient
+
+from .bar_utils import DailyBars, to_timestamp
+from .polygon_utils import polygon_request
+
+# one file per ticker of fixed-size (epoch ms, close) records, only ever appended to,
+# next to a marker of the date the store was built from: Polygon had no bars
+# between that date and the first stored one (e.g. the ticker listed later)
+BAR_STORE_DIR = os.getenv(
+    "BAR_STORE_DIR", os.path.join(tempfile.gettempdir(), "stockbot-bars")
+)
+RECORD = struct.Struct("<qd")
+
+# a daily bar can still change until its session (including after hours) is over
+SETTLE_MS = 24 * 60 * 60 * 1000
+
+# the first trading day of a range can fall a few days after its start date
+COVERAGE_SLACK = timedelta(days=7)
+
+ticker_locks = {}
+
+
+def bar_path(ticker: str):
+    if not re.fullmatch(r"[A-Za-z0-9.\-:]+", ticker):
+        raise ValueError(f"Invalid ticker for bar store: {ticker!r}")
+    return os.path.join(BAR_STORE_DIR, f"{ticker.upper()}.bars")
+
+
+def coverage_path(ticker: str):
+    return bar_path(ticker)[: -len(".bars")] + ".from"
+
+
+def load_coverage(ticker: str):
+    """Epoch ms the store is complete from, or None if unknown"""
+    try:
+        with open(coverage_path(ticker)) as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_coverage(ticker: str, start_date: datetime):
+    os.makedirs(BAR_STORE_DIR, exist_ok=True)
+    path = coverage_path(ticker)
+    with tempfile.NamedTemporaryFile("w", dir=BAR_STORE_DIR, delete=False) as f:
+        f.write(str(to_timestamp(start_date)))
+    os.replace(f.name, path)
+
+
+def load_bars(ticker: str):
+    """Read every stored bar of a ticker"""
+    bars = DailyBars()
+    try:
+        with open(bar_path(ticker), "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return bars
+
+    # ignore a torn record at the end and any duplicate left by a racing writer
+    usable = len(raw) - len(raw) % RECORD.size
+    for timestamp, close in RECORD.iter_unpack(raw[:usable]):
+        if bars.timestamps and timestamp <= bars.timestamps[-1]:
+            continue
+        bars.timestamps.append(timestamp)
+        bars.closes.append(close)
+    return bars
+
+
+def append_bars(ticker: str, bars: DailyBars):
+    if not len(bars):
+        return
+    os.makedirs(BAR_STORE_DIR, exist_ok=True)
+    with open(bar_path(ticker), "ab") as f:
+        f.write(
+            b"".join(
+                RECORD.pack(timestamp, close)
+                for timestamp, close in zip(bars.timestamps, bars.closes)
+            )
+        )
+
+
+def reset_bars(ticker: str):
+    for path in (coverage_path(ticker), bar_path(ticker)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def is_covered(stored: DailyBars, covered_from, start_date: datetime):
+    """Whether the store has every bar from `start_date` on, up to its last one"""
+    if not len(stored):
+        return False
+    if covered_from is not None and covered_from <= to_timestamp(start_date):
+        return True
+    return stored.timestamps[0] <= to_timestamp(start_date + COVERAGE_SLACK)
+
+
+def split_settled(bars: DailyBars, now: datetime):
+    """Split fetched bars into ones that can be persisted and ones still trading"""
+    cutoff = to_timestamp(now) - SETTLE_MS
+    settled, live = DailyBars(), DailyBars()
+    for timestamp, close in zip(bars.timestamps, bars.closes):
+        target = settled if timestamp <= cutoff else live
+        target.timestamps.append(timestamp)
+        target.closes.append(close)
+    return settled, live
+
+
+def slice_bars(bars: DailyBars, start_date: datetime, end_date: datetime):
+    start, end = to_timestamp(start_date), to_timestamp(end_date)
+    return DailyBars(
+        *zip(
+            *(
+                (timestamp, close)
+                for timestamp, close in zip(bars.timestamps, bars.closes)
+                if start <= timestamp <= end
+            )
+        )
+    )
+
+
+async def get_daily_bars(
+    ticker: str, client: RESTClient, start_date: datetime, end_date: datetime
+):
+    """Daily bars for a ticker, asking Polygon only for bars newer than the store"""
+    lock = ticker_locks.setdefault(ticker, asyncio.Lock())
+    async with lock:
+        stored = await asyncio.to_thread(load_bars, ticker)
+        covered_from = await asyncio.to_thread(load_coverage, ticker)
+
+        rebuild = not is_covered(stored, covered_from, start_date)
+        if rebuild:
+            # cold (or too short) store: rebuild it from the full range
+            stored = DailyBars()
+            fetch_from = start_date
+            await asyncio.to_thread(reset_bars, ticker)
+        else:
+            last = datetime.fromtimestamp(stored.timestamps[-1] / 1000)
+            fetch_from = last + timedelta(days=1)
+
+        aggs = await polygon_request(
+            "get_aggs",
+            client.get_aggs,
+            ticker,
+            1,
+            "day",
+            fetch_from,
+            end_date,
+            limit=50000,
+        )
+        fetched = DailyBars.from_aggs(aggs)
+        if len(stored):
+            fetched = slice_bars(
+                fetched,
+                datetime.fromtimestamp(stored.timestamps[-1] / 1000 + 0.001),
+                end_date,
+            )
+
+        settled, live = split_settled(fetched, datetime.now())
+        await asyncio.to_thread(append_bars, ticker, settled)
+        if rebuild and len(settled):
+            # bars Polygon didn't return before the first one don't exist
+            await asyncio.to_thread(save_coverage, ticker, start_date)
+        logging.info(
+            f"Bar store for {ticker}: {len(stored)} stored, {len(settled)} appended, {len(live)} live"
+        )
+
+    combined = DailyBars(
+        stored.timestamps + settled.timestamps + live.timestamps,
+        stored.closes + settled.closes + live.closes,
+    )
+    return slice_bars(combined, start_date, end_date)
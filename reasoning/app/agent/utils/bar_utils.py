@@ -0,0 +1,69 @@
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+# (label, start of the window given its end) for every historical change we report.
+# The daily bars are fetched once for the longest window, so adding a window here
+# (e.g. ("year to date", lambda end: end.replace(month=1, day=1))) costs no requests.
+HISTORICAL_WINDOWS = [
+    ("1 week", lambda end: end - timedelta(days=7)),
+    ("1 month", lambda end: end - timedelta(days=30)),
+    ("3 months", lambda end: end - timedelta(days=90)),
+    ("6 months", lambda end: end - timedelta(days=180)),
+    ("1 year", lambda end: end - timedelta(days=365)),
+    ("2 years", lambda end: end - timedelta(days=730)),
+]
+
+
+def history_start(end_date: datetime) -> datetime:
+    """Earliest date any historical window needs"""
+    return min(start(end_date) for _, start in HISTORICAL_WINDOWS)
+
+
+def to_timestamp(date: datetime) -> int:
+    return int(date.timestamp() * 1000)
+
+
+class DailyBars:
+    """Daily closing prices of one ticker, stored as two parallel columns
+    (epoch milliseconds and close) sorted by time."""
+
+    def __init__(self, timestamps=(), closes=()):
+        self.timestamps = array("q", timestamps)
+        self.closes = array("d", closes)
+
+    @classmethod
+    def from_aggs(cls, aggs):
+        bars = cls()
+        for agg in aggs or []:
+            if agg.timestamp is None or agg.close is None:
+                continue
+            bars.timestamps.append(agg.timestamp)
+            bars.closes.append(agg.close)
+        return bars
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def change_between(self, start_date: datetime, end_date: datetime):
+        """Percent change from the first to the last close inside the window"""
+        first = bisect_left(self.timestamps, to_timestamp(start_date))
+        last = bisect_left(self.timestamps, to_timestamp(end_date) + 1) - 1
+        if first > last or self.closes[first] == 0:
+            return None
+        start_price, end_price = self.closes[first], self.closes[last]
+        return round((end_price - start_price) / start_price * 100, 2)
+
+
+def compute_historical_changes(bars: DailyBars, end_date: datetime):
+    results = {}
+    for label, start in HISTORICAL_WINDOWS:
+        start_date = start(end_date)
+        change = bars.change_between(start_date, end_date)
+        if change is not None:
+            results[label] = {
+                "change": change,
+                "start_date": start_date.strftime("%Y-%m-%d"),
+                "end_date": end_date.strftime("%Y-%m-%d"),
+            }
+    return results
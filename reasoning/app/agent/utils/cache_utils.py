@@ -0,0 +1,301 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+import redis
+
+from .codec_utils import decode_value, encode_value
+from ..tracing import record_cache
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(message)s")
+
+# set up the redis client
+redis_host = os.getenv("REDIS_HOST", "localhost")
+redis_client = redis.asyncio.Redis(
+    host=redis_host, port=6379, db=0, decode_responses=False
+)
+
+# in-process cache in front of redis; entries never outlive L1_CACHE_TTL so a
+# replica that missed an invalidation message still converges quickly
+L1_CACHE_MAX_ENTRIES = int(os.getenv("L1_CACHE_MAX_ENTRIES", "1024"))
+L1_CACHE_MAX_BYTES = int(os.getenv("L1_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+L1_CACHE_TTL = int(os.getenv("L1_CACHE_TTL", "30"))
+
+# replicas announce every cache write here so the others drop their L1 copy
+INVALIDATION_CHANNEL = "stock-cache-invalidate"
+instance_id = uuid.uuid4().hex
+
+# concurrent misses for one key share a single upstream fetch; across replicas the
+# fetch is guarded by a redis lock held for at most FETCH_LOCK_TIMEOUT seconds
+FETCH_LOCK_TIMEOUT = float(os.getenv("FETCH_LOCK_TIMEOUT", "15"))
+FETCH_LOCK_POLL = float(os.getenv("FETCH_LOCK_POLL", "0.05"))
+in_flight = {}
+# callers waiting on each fetch started for a cache miss; the fetch is cancelled
+# when all of them give up, unless a background refresh has come to need it too
+miss_waiters = {}
+
+# how long past its TTL an entry may still be served while it is refreshed
+STALE_CACHE_MAX_AGE = int(os.getenv("STALE_CACHE_MAX_AGE", "600"))
+
+
+class LocalCache:
+    """Bounded LRU of decoded cache values with per-entry expiry"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (expires_at, size, value)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self.discard(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, key: str, value, size: int, ttl: float):
+        self.discard(key)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        self.entries[key] = (time.monotonic() + ttl, size, value)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def discard(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def invalidate(self, key: str):
+        if key in self.entries:
+            self.discard(key)
+            self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+local_cache = LocalCache(L1_CACHE_MAX_ENTRIES, L1_CACHE_MAX_BYTES)
+invalidation_listener = None
+
+
+async def listen_for_invalidations():
+    """Drop L1 entries written by other replicas"""
+    while True:
+        try:
+            pubsub = redis_client.pubsub()
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                sender, _, key = message["data"].decode().partition(":")
+                if sender != instance_id:
+                    local_cache.invalidate(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # entries written meanwhile may be stale for up to L1_CACHE_TTL
+            logging.error(f"Cache invalidation listener failed: {str(e)}")
+            local_cache.clear()
+            await asyncio.sleep(1)
+
+
+def ensure_invalidation_listener():
+    global invalidation_listener
+    if invalidation_listener is None or invalidation_listener.done():
+        invalidation_listener = asyncio.get_running_loop().create_task(
+            listen_for_invalidations()
+        )
+
+
+async def get_cached_data(key: str):
+    """Get data from the local cache, falling back to Redis"""
+    ensure_invalidation_listener()
+    data = local_cache.get(key)
+    if data is not None:
+        return data
+
+    try:
+        cached_data = await redis_client.get(key)
+        if cached_data:
+            try:
+                data = decode_value(cached_data)
+            except ValueError as e:
+                # written by an older release or an unknown codec, refetch it
+                logging.warning(f"Ignoring unreadable cache value for {key}: {str(e)}")
+                return None
+            logging.info(f"Cache hit for {key}")
+            local_cache.set(key, data, len(cached_data), L1_CACHE_TTL)
+            return data
+        return None
+    except Exception as e:
+        logging.error(f"Error reading from cache: {str(e)}")
+        return None
+
+
+async def set_cached_data(key: str, data, cache_duration: int):
+    """Set data in Redis cache with expiration"""
+    try:
+        encoded_data = encode_value(data)
+        logging.info(f"Cache write for {key}")
+        local_cache.set(key, data, len(encoded_data), min(cache_duration, L1_CACHE_TTL))
+        await redis_client.setex(key, cache_duration, encoded_data)
+        await redis_client.publish(INVALIDATION_CHANNEL, f"{instance_id}:{key}")
+    except Exception as e:
+        logging.error(f"Error writing to cache: {str(e)}")
+
+
+async def release_fetch_lock(lock_key: str, token: str):
+    try:
+        if await redis_client.get(lock_key) == token.encode():
+            await redis_client.delete(lock_key)
+    except Exception as e:
+        logging.error(f"Error releasing {lock_key}: {str(e)}")
+
+
+def is_fresh(entry: dict, cache_duration: int):
+    return time.time() - entry["fetched_at"] <= cache_duration
+
+
+async def store_entry(key: str, data, cache_duration: int):
+    entry = {"fetched_at": time.time(), "data": data}
+    # empty results are usually a failed upstream call, so don't pin them
+    if data:
+        await set_cached_data(key, entry, cache_duration + STALE_CACHE_MAX_AGE)
+    return entry
+
+
+async def fetch_once(key: str, cache_duration: int, fetch):
+    """Run `fetch` unless another replica already is, then wait for its result"""
+    lock_key = f"{key}_lock"
+    token = uuid.uuid4().hex
+    while True:
+        try:
+            acquired = await redis_client.set(
+                lock_key, token, nx=True, px=int(FETCH_LOCK_TIMEOUT * 1000)
+            )
+        except Exception as e:
+            # without redis there is nothing to coordinate with, fetch directly
+            logging.error(f"Error acquiring {lock_key}: {str(e)}")
+            token = None
+            break
+        if acquired:
+            break
+
+        # the lock expires on its own if its holder dies, so this loop always ends
+        await asyncio.sleep(FETCH_LOCK_POLL)
+        entry = await get_cached_data(key)
+        if entry is not None and is_fresh(entry, cache_duration):
+            return entry
+
+    try:
+        return await store_entry(key, await fetch(), cache_duration)
+    finally:
+        if token:
+            await release_fetch_lock(lock_key, token)
+
+
+def start_fetch(key: str, cache_duration: int, fetch):
+    """The running fetch of `key`, or a new one; a fetch joined here runs to the
+    end even if the misses waiting on it give up"""
+    flight = in_flight.get(key)
+    if flight is None:
+        flight = asyncio.ensure_future(fetch_once(key, cache_duration, fetch))
+        in_flight[key] = flight
+        flight.add_done_callback(lambda _: in_flight.pop(key, None))
+    else:
+        miss_waiters.pop(flight, None)
+    return flight
+
+
+async def wait_for_miss(key: str, cache_duration: int, fetch, name: str = None):
+    """Wait for the fetch filling a missing `key`, shared with other misses of it.
+
+    A caller giving up (a cancelled turn, a deadline) doesn't cancel a fetch
+    others wait on, but a fetch nobody waits on any more is cancelled so it makes
+    no further Polygon requests. A request already sent still runs to the end in
+    its worker thread.
+    """
+    flight = in_flight.get(key)
+    if flight is None:
+        flight = start_fetch(key, cache_duration, fetch)
+        miss_waiters[flight] = 0
+        flight.add_done_callback(lambda done: miss_waiters.pop(done, None))
+    if flight not in miss_waiters:
+        return await asyncio.shield(flight)
+
+    miss_waiters[flight] += 1
+    try:
+        return await asyncio.shield(flight)
+    except asyncio.CancelledError:
+        if miss_waiters.get(flight) == 1 and not flight.done():
+            flight.cancel()
+            if name:
+                record_cache(name, "cancelled")
+        raise
+    finally:
+        if flight in miss_waiters:
+            miss_waiters[flight] -= 1
+
+
+def log_refresh_failure(key: str, flight: asyncio.Future):
+    if not flight.cancelled() and flight.exception() is not None:
+        logging.error(f"Background refresh of {key} failed: {flight.exception()}")
+
+
+async def get_or_fetch_entry(key: str, cache_duration: int, fetch, name: str = None):
+    """Read a cache layer as {"fetched_at", "data"}, filling it from `fetch` on a miss.
+
+    Concurrent misses for the same key share one fetch: callers in this process
+    await the same task and other replicas wait on a Redis lock. An entry past
+    `cache_duration` but within STALE_CACHE_MAX_AGE is returned immediately while
+    it is refreshed in the background. Reads are counted in the metrics under
+    `name`, the layer rather than the key.
+    """
+    entry = await get_cached_data(key)
+    if entry is not None:
+        if not is_fresh(entry, cache_duration):
+            logging.info(f"Serving stale {key} while refreshing it")
+            flight = start_fetch(key, cache_duration, fetch)
+            flight.add_done_callback(lambda done: log_refresh_failure(key, done))
+            if name:
+                record_cache(name, "stale")
+        elif name:
+            record_cache(name, "hit")
+        return entry
+
+    if name:
+        record_cache(name, "miss")
+    return await wait_for_miss(key, cache_duration, fetch, name)
+
+
+async def get_or_fetch(key: str, cache_duration: int, fetch, name: str = None):
+    """Read a cache layer, filling it from `fetch` on a miss"""
+    entry = await get_or_fetch_entry(key, cache_duration, fetch, name)
+    return entry["data"]
@@ -0,0 +1,252 @@
+import os
+import asyncio
+import logging
+
+from . import cache_utils
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(message)s")
+
+# the cancel endpoint marks a task by setting "task-<id>" to "cancelled", which
+# turns read at their stage boundaries; a task id published on CANCEL_CHANNEL
+# cancels its turn at once. Where the server already has keyspace notifications
+# on, Redis pushes the write to every replica and turns needn't read the key
+TASK_KEY_PREFIX = "task-"
+CANCELLED = b"cancelled"
+CANCEL_CHANNEL = "task-cancel"
+KEYSPACE_PREFIX = "__keyspace@0__:"
+
+# "auto" uses keyspace notifications if CONFIG GET shows they are on, "true"
+# also trusts they are when CONFIG is denied (e.g. turned on in a managed Redis's
+# console) and "false" never uses them. The server config is never changed
+CANCEL_KEYSPACE_EVENTS = os.getenv("CANCEL_KEYSPACE_EVENTS", "auto").lower()
+# without keyspace notifications turns read their task key themselves, at each
+# stage boundary, every CANCEL_POLL_CHUNKS chunks of a stream and every
+# CANCEL_POLL_INTERVAL seconds of waiting on a slow call
+CANCEL_POLL_CHUNKS = int(os.getenv("CANCEL_POLL_CHUNKS", "8"))
+CANCEL_POLL_INTERVAL = float(os.getenv("CANCEL_POLL_INTERVAL", "0.25"))
+
+tokens = {}  # task id -> token of the running turn
+cancel_listener = None
+# whether the listener is hearing keyspace events, so turns needn't poll
+keyspace_events = False
+
+# totals across turns of the work cancellations stopped
+cancel_stats = {"cancels": 0, "tasks_cancelled": 0, "streams_aborted": 0}
+
+
+class TurnCancelled(Exception):
+    """Raised at a stage boundary of a turn whose task was cancelled"""
+
+
+class CancellationToken:
+    """Cancellation state of one turn, set from Redis pub/sub.
+
+    Work started for the turn (Polygon fetches, LLM calls) is tracked and
+    cancelled along with it, and awaiting through `run` or `stream` returns
+    control as soon as the cancel arrives rather than when the work ends.
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.event = asyncio.Event()
+        self.tasks = {}  # task -> label
+        self.tasks_cancelled = {}  # label -> count
+        self.streams_aborted = 0
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        logging.info(f"Task {self.task_id} cancelled, stopping its work")
+        self.event.set()
+        for task, label in list(self.tasks.items()):
+            if not task.done():
+                task.cancel()
+                self.tasks_cancelled[label] = self.tasks_cancelled.get(label, 0) + 1
+        cancel_stats["cancels"] += 1
+        cancel_stats["tasks_cancelled"] += sum(self.tasks_cancelled.values())
+
+    def track(self, task: asyncio.Future, label: str):
+        """Cancel `task` if the turn is cancelled before it ends"""
+        if self.cancelled:
+            task.cancel()
+            return task
+        self.tasks[task] = label
+        task.add_done_callback(lambda done: self.tasks.pop(done, None))
+        return task
+
+    def check(self):
+        if self.cancelled:
+            raise TurnCancelled(self.task_id)
+
+    async def poll(self):
+        """Read the task key when no keyspace event would bring the cancel"""
+        if keyspace_events or self.cancelled or not self.task_id:
+            return
+        try:
+            if await is_marked_cancelled(self.task_id):
+                self.cancel()
+        except Exception as e:
+            logging.error(f"Error reading cancellation of task {self.task_id}: {str(e)}")
+
+    async def checkpoint(self):
+        """Stage boundary: raise TurnCancelled if the task was cancelled"""
+        await self.poll()
+        self.check()
+
+    async def run(self, awaitable, label: str):
+        """Await `awaitable` as tracked work, raising TurnCancelled on a cancel"""
+        await self.checkpoint()
+        task = self.track(asyncio.ensure_future(awaitable), label)
+        waiter = asyncio.ensure_future(self.event.wait())
+        try:
+            while not task.done() and not self.cancelled:
+                polling = not keyspace_events and self.task_id
+                await asyncio.wait(
+                    {task, waiter},
+                    timeout=CANCEL_POLL_INTERVAL if polling else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not task.done():
+                    await self.poll()
+        finally:
+            waiter.cancel()
+        if self.cancelled:
+            # let the cancelled work unwind before its caller cleans up after it
+            await asyncio.wait({task})
+        self.check()
+        return task.result()
+
+    async def stream(self, chunks, label: str):
+        """Iterate `chunks`, abandoning the stream when the turn is cancelled"""
+        iterator = aiter(chunks)
+        streamed = 0
+        try:
+            while True:
+                try:
+                    chunk = await self.run(anext(iterator), label)
+                except StopAsyncIteration:
+                    return
+                yield chunk
+                streamed += 1
+                if streamed % CANCEL_POLL_CHUNKS == 0:
+                    await self.checkpoint()
+        except TurnCancelled:
+            self.streams_aborted += 1
+            cancel_stats["streams_aborted"] += 1
+            raise
+        finally:
+            # closing the stream ends its request, so the LLM stops generating
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+
+    def work_saved(self):
+        return {
+            "tasks_cancelled": self.tasks_cancelled,
+            "streams_aborted": self.streams_aborted,
+        }
+
+
+async def is_marked_cancelled(task_id: str):
+    return await cache_utils.redis_client.get(TASK_KEY_PREFIX + task_id) == CANCELLED
+
+
+async def use_keyspace_events():
+    """Whether the server sends keyspace notifications for SET, going by
+    CANCEL_KEYSPACE_EVENTS; only reads the config"""
+    if CANCEL_KEYSPACE_EVENTS == "false":
+        return False
+    try:
+        config = await cache_utils.redis_client.config_get("notify-keyspace-events")
+    except Exception as e:
+        if CANCEL_KEYSPACE_EVENTS == "true":
+            return True
+        logging.info(f"Can't tell if keyspace notifications are on: {str(e)}")
+        return False
+    flags = next(iter(config.values()), b"")
+    flags = flags.decode() if isinstance(flags, bytes) else flags
+    # "K" publishes keyspace events, "$" (or "A", all types) covers SET
+    if "K" in flags and ("$" in flags or "A" in flags):
+        return True
+    if CANCEL_KEYSPACE_EVENTS == "true":
+        logging.warning(
+            "CANCEL_KEYSPACE_EVENTS is on but the server's notify-keyspace-events "
+            f"is {flags!r}, turns read their task key instead"
+        )
+    return False
+
+
+def cancelled_task_id(message: dict):
+    """Task id a pub/sub message cancels, or None"""
+    channel = message.get("channel")
+    channel = channel.decode() if isinstance(channel, bytes) else channel
+    data = message.get("data")
+    data = data.decode() if isinstance(data, bytes) else data
+    if message.get("type") == "message" and channel == CANCEL_CHANNEL:
+        return data
+    if message.get("type") == "pmessage" and data == "set":
+        return channel[len(KEYSPACE_PREFIX + TASK_KEY_PREFIX) :]
+    return None
+
+
+async def listen_for_cancellations():
+    global keyspace_events
+    while True:
+        try:
+            pubsub = cache_utils.redis_client.pubsub()
+            await pubsub.subscribe(CANCEL_CHANNEL)
+            if await use_keyspace_events():
+                await pubsub.psubscribe(f"{KEYSPACE_PREFIX}{TASK_KEY_PREFIX}*")
+                keyspace_events = True
+
+            # cancels sent before the subscription was up would otherwise be missed
+            for task_id, token in list(tokens.items()):
+                if await is_marked_cancelled(task_id):
+                    token.cancel()
+
+            async for message in pubsub.listen():
+                task_id = cancelled_task_id(message)
+                token = tokens.get(task_id)
+                if token is None:
+                    continue
+                # a keyspace event only says the key was written, not to what
+                if message["type"] == "message" or await is_marked_cancelled(task_id):
+                    token.cancel()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            keyspace_events = False
+            logging.error(f"Cancellation listener failed: {str(e)}")
+            await asyncio.sleep(1)
+
+
+def ensure_cancel_listener():
+    global cancel_listener
+    if cancel_listener is None or cancel_listener.done():
+        cancel_listener = asyncio.get_running_loop().create_task(
+            listen_for_cancellations()
+        )
+
+
+async def open_token(task_id: str):
+    """Register the cancellation token of a starting turn"""
+    token = CancellationToken(task_id)
+    if not task_id:
+        return token
+    ensure_cancel_listener()
+    tokens[task_id] = token
+    try:
+        if await is_marked_cancelled(task_id):
+            token.cancel()
+    except Exception as e:
+        logging.error(f"Error reading cancellation of task {task_id}: {str(e)}")
+    return token
+
+
+def close_token(token: CancellationToken):
+    if tokens.get(token.task_id) is token:
+        del tokens[token.task_id]
@@ -0,0 +1,152 @@
+import os
+import json
+import zlib
+import struct
+import logging
+
+# optional accelerators; the codec falls back to the standard library without them
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(message)s")
+
+# every encoded value starts with a header naming how it was written, so readers
+# decode whatever format a replica used and anything else (e.g. an old pickled
+# value) is rejected instead of unpickled
+CODEC_MAGIC = b"\xc5"
+CODEC_VERSION = 1
+HEADER_SIZE = 4  # magic, version, format id, compression id
+
+FORMAT_IDS = {"json": 1, "msgpack": 2}
+COMPRESSION_IDS = {"none": 0, "zlib": 1, "zstd": 2, "lz4": 3}
+
+# JSON can't hold bytes (e.g. serialized quarterly financials), so they are
+# appended raw after the document, which refers to them as {BYTES_KEY: [offset, length]}
+BYTES_KEY = "__bytes__"
+JSON_LENGTH = struct.Struct("<I")
+
+
+def json_dumps(value):
+    blobs, size = [], 0
+
+    def default(item):
+        nonlocal size
+        if isinstance(item, (bytes, bytearray, memoryview)):
+            blobs.append(item)
+            size += len(item)
+            return {BYTES_KEY: [size - len(item), len(item)]}
+        raise TypeError(f"Type is not JSON serializable: {type(item).__name__}")
+
+    if orjson is not None:
+        document = orjson.dumps(value, default=default)
+    else:
+        document = json.dumps(value, default=default, separators=(",", ":")).encode()
+    return JSON_LENGTH.pack(len(document)) + document + b"".join(blobs)
+
+
+def restore_bytes(value, blobs: bytes):
+    if isinstance(value, dict):
+        if len(value) == 1 and BYTES_KEY in value:
+            offset, length = value[BYTES_KEY]
+            return blobs[offset : offset + length]
+        return {key: restore_bytes(item, blobs) for key, item in value.items()}
+    if isinstance(value, list):
+        return [restore_bytes(item, blobs) for item in value]
+    return value
+
+
+def json_loads(raw: bytes):
+    (length,) = JSON_LENGTH.unpack_from(raw)
+    end = JSON_LENGTH.size + length
+    document = raw[JSON_LENGTH.size : end]
+    value = orjson.loads(document) if orjson is not None else json.loads(document)
+    # only walk the value when it holds bytes
+    return restore_bytes(value, raw[end:]) if end < len(raw) else value
+
+
+def msgpack_dumps(value):
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def msgpack_loads(raw: bytes):
+    return msgpack.unpackb(raw, raw=False)
+
+
+# name -> (dumps, loads) of the formats and compressions importable here
+FORMATS = {"json": (json_dumps, json_loads)}
+if msgpack is not None:
+    FORMATS["msgpack"] = (msgpack_dumps, msgpack_loads)
+
+COMPRESSIONS = {
+    "none": (lambda raw: raw, lambda raw: raw),
+    "zlib": (lambda raw: zlib.compress(raw, 1), zlib.decompress),
+}
+if zstandard is not None:
+    COMPRESSIONS["zstd"] = (
+        zstandard.ZstdCompressor(level=3).compress,
+        zstandard.ZstdDecompressor().decompress,
+    )
+if lz4 is not None:
+    COMPRESSIONS["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+
+
+def configured(name: str, variable: str, available: dict, default: str):
+    if name in available:
+        return name
+    logging.warning(f"{variable}={name} is not available here, using {default}")
+    return default
+
+
+CACHE_CODEC = configured(os.getenv("CACHE_CODEC", "json"), "CACHE_CODEC", FORMATS, "json")
+CACHE_COMPRESSION = configured(
+    os.getenv("CACHE_COMPRESSION", "none"), "CACHE_COMPRESSION", COMPRESSIONS, "none"
+)
+# smaller values are stored uncompressed, compressing them saves next to nothing
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+
+NAMES_BY_FORMAT_ID = {format_id: name for name, format_id in FORMAT_IDS.items()}
+NAMES_BY_COMPRESSION_ID = {
+    compression_id: name for name, compression_id in COMPRESSION_IDS.items()
+}
+
+
+def encode_value(value, codec: str = None, compression: str = None):
+    """Serialize a cache value as header + (possibly compressed) payload"""
+    codec = codec or CACHE_CODEC
+    compression = compression or CACHE_COMPRESSION
+    payload = FORMATS[codec][0](value)
+    if compression != "none" and len(payload) >= CACHE_COMPRESS_MIN_BYTES:
+        payload = COMPRESSIONS[compression][0](payload)
+    else:
+        compression = "none"
+    header = CODEC_MAGIC + bytes(
+        (CODEC_VERSION, FORMAT_IDS[codec], COMPRESSION_IDS[compression])
+    )
+    return header + payload
+
+
+def decode_value(raw: bytes):
+    """Inverse of encode_value; raises ValueError for anything it didn't write"""
+    if len(raw) < HEADER_SIZE or raw[:1] != CODEC_MAGIC or raw[1] != CODEC_VERSION:
+        raise ValueError("Not a cache codec value")
+    codec = NAMES_BY_FORMAT_ID.get(raw[2])
+    compression = NAMES_BY_COMPRESSION_ID.get(raw[3])
+    if codec not in FORMATS or compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported cache codec {codec or raw[2]}/{compression or raw[3]}")
+    payload = COMPRESSIONS[compression][1](raw[HEADER_SIZE:])
+    return FORMATS[codec][1](payload)
@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import time
+import zlib
+import asyncio
+import logging
+import tempfile
+from polygon import RESTClient
+
+from .polygon_utils import polygon_request
+
+# one file per ticker holding every quarterly filing as end date -> metrics
+FINANCIALS_STORE_DIR = os.getenv(
+    "FINANCIALS_STORE_DIR", os.path.join(tempfile.gettempdir(), "stockbot-financials")
+)
+# filings only change once a quarter, so Polygon is asked for new ones at most
+# this often per ticker
+FINANCIALS_STORE_TTL = int(os.getenv("FINANCIALS_STORE_TTL", str(24 * 60 * 60)))
+STORE_VERSION = 1
+
+# the largest page Polygon serves, so a full history takes as few requests as possible
+FINANCIALS_PAGE_LIMIT = 100
+
+ticker_locks = {}
+
+
+def financials_path(ticker: str):
+    if not re.fullmatch(r"[A-Za-z0-9.\-:]+", ticker):
+        raise ValueError(f"Invalid ticker for financials store: {ticker!r}")
+    return os.path.join(FINANCIALS_STORE_DIR, f"{ticker.upper()}.financials")
+
+
+def filing_metrics(item):
+    """The metrics of one Polygon filing, in statement order"""
+    metrics = {}
+
+    # process balance sheet
+    if item.financials.balance_sheet:
+        for key, datapoint in item.financials.balance_sheet.items():
+            metrics[key] = datapoint.value
+
+    # process income statement
+    if item.financials.income_statement:
+        for key, value in item.financials.income_statement.__dict__.items():
+            if hasattr(value, "value"):
+                metrics[key] = value.value
+
+    # process cash flow statement
+    cash_flow_statement = item.financials.cash_flow_statement
+    if cash_flow_statement and cash_flow_statement.net_cash_flow:
+        metrics["net_cash_flow"] = cash_flow_statement.net_cash_flow.value
+    if (
+        cash_flow_statement
+        and cash_flow_statement.net_cash_flow_from_financing_activities
+    ):
+        metrics["net_cash_flow_from_financing_activities"] = (
+            cash_flow_statement.net_cash_flow_from_financing_activities.value
+        )
+
+    return metrics
+
+
+def encode_filings(filings: dict, checked_at: float):
+    # metric names are stored once and referenced by index from every filing
+    names = sorted({name for metrics in filings.values() for name in metrics})
+    index = {name: position for position, name in enumerate(names)}
+    payload = {
+        "version": STORE_VERSION,
+        "checked_at": checked_at,
+        "metrics": names,
+        "filings": [
+            [end_date, [[index[name], value] for name, value in metrics.items()]]
+            for end_date, metrics in filings.items()
+        ],
+    }
+    return zlib.compress(json.dumps(payload, separators=(",", ":")).encode())
+
+
+def decode_filings(raw: bytes):
+    payload = json.loads(zlib.decompress(raw))
+    if payload.get("version") != STORE_VERSION:
+        raise ValueError(f"Unsupported financials store version {payload.get('version')}")
+    names = payload["metrics"]
+    filings = {
+        end_date: {names[position]: value for position, value in metrics}
+        for end_date, metrics in payload["filings"]
+    }
+    return filings, payload["checked_at"]
+
+
+def load_filings(ticker: str):
+    """Every stored filing of a ticker and when Polygon was last checked"""
+    try:
+        with open(financials_path(ticker), "rb") as f:
+            return decode_filings(f.read())
+    except FileNotFoundError:
+        return {}, 0.0
+    except Exception as e:
+        # a corrupt or outdated file is rebuilt from Polygon
+        logging.error(f"Error reading financials store for {ticker}: {str(e)}")
+        return {}, 0.0
+
+
+def save_filings(ticker: str, filings: dict, checked_at: float):
+    os.makedirs(FINANCIALS_STORE_DIR, exist_ok=True)
+    path = financials_path(ticker)
+    # readers never see a partly written file
+    with tempfile.NamedTemporaryFile(dir=FINANCIALS_STORE_DIR, delete=False) as f:
+        f.write(encode_filings(filings, checked_at))
+    os.replace(f.name, path)
+
+
+def list_stock_financials(ticker: str, client: RESTClient, after: str = None):
+    # the polygon client pages lazily, so drain the iterator inside the worker thread
+    params = {"period_of_report_date_gt": after} if after else {}
+    return list(
+        client.vx.list_stock_financials(
+            ticker, timeframe="quarterly", limit=FINANCIALS_PAGE_LIMIT, **params
+        )
+    )
+
+
+async def get_quarterly_filings(ticker: str, client: RESTClient):
+    """Quarterly filings of a ticker as end date -> metrics, newest first, asking
+    Polygon only for filings newer than the store"""
+    lock = ticker_locks.setdefault(ticker, asyncio.Lock())
+    async with lock:
+        filings, checked_at = await asyncio.to_thread(load_filings, ticker)
+        if time.time() - checked_at < FINANCIALS_STORE_TTL:
+            return filings
+
+        latest = max(filings) if filings else None
+        try:
+            items = await polygon_request(
+                "list_stock_financials", list_stock_financials, ticker, client, latest
+            )
+        except Exception as e:
+            if not filings:
+                raise
+            logging.error(f"Error refreshing financials for {ticker}: {str(e)}")
+            return filings
+
+        # amendments repeat a period; the first (latest) filing of a period wins
+        new_filings = {}
+        for item in items:
+            if item.end_date and (latest is None or item.end_date > latest):
+                new_filings.setdefault(item.end_date, filing_metrics(item))
+        filings = dict(
+            sorted({**filings, **new_filings}.items(), reverse=True)
+        )
+        await asyncio.to_thread(save_filings, ticker, filings, time.time())
+        logging.info(
+            f"Financials store for {ticker}: {len(filings) - len(new_filings)} stored, {len(new_filings)} new"
+        )
+
+    return filings
@@ -0,0 +1,139 @@
+import sys
+import json
+import math
+import struct
+from array import array
+from collections import deque
+
+NAN = float("nan")
+
+# serialized layout: magic, header length, JSON header (dates and metric names),
+# then one little-endian float64 column per metric
+SERIAL_MAGIC = b"QFIN1"
+HEADER_LENGTH = struct.Struct("<I")
+
+
+class QuarterlyFinancials:
+    """Quarterly filings of one ticker as columns: a date index (newest first)
+    shared by one float column per metric, with NaN where a filing lacks it.
+
+    Year-over-year and quarter-over-quarter changes assume consecutive entries
+    are consecutive quarters; trailing sums skip filings that lack the metric.
+    """
+
+    def __init__(self, dates=(), metrics=None):
+        self.dates = list(dates)
+        self.metrics = metrics or {}
+
+    @classmethod
+    def from_filings(cls, filings: dict):
+        """Build the columns in one pass over end date -> metrics, newest first"""
+        financials = cls(filings)
+        count = len(financials.dates)
+        for position, metrics in enumerate(filings.values()):
+            for name, value in metrics.items():
+                column = financials.metrics.get(name)
+                if column is None:
+                    column = financials.metrics[name] = array("d", [NAN]) * count
+                if value is not None:
+                    column[position] = value
+        return financials
+
+    def __len__(self):
+        return len(self.dates)
+
+    def series(self, metric: str):
+        """The widget payload of a metric: [{"date", "value"}], newest first"""
+        column = self.metrics.get(metric)
+        if column is None:
+            return []
+        return [
+            {"date": date, "value": value}
+            for date, value in zip(self.dates, column)
+            if not math.isnan(value)
+        ]
+
+    def to_dict(self):
+        return {metric: self.series(metric) for metric in self.metrics}
+
+    def latest_position(self, metric: str):
+        """Position of the newest filing that has the metric, or None"""
+        for position, value in enumerate(self.metrics.get(metric, ())):
+            if not math.isnan(value):
+                return position
+        return None
+
+    def trailing(self, metric: str, periods: int = 4):
+        """Sum of each quarter's value and the periods - 1 values filed before it.
+
+        Filings without the metric are skipped rather than ending the window, and
+        the oldest quarters sum what there is, as the TTM figures always did.
+        Quarters without the metric are NaN.
+        """
+        count = len(self.dates)
+        result = array("d", [NAN]) * count
+        column = self.metrics.get(metric)
+        if column is None:
+            return result
+
+        # one pass from the oldest quarter to the newest over the values present
+        window = deque(maxlen=periods)
+        for position in range(count - 1, -1, -1):
+            value = column[position]
+            if math.isnan(value):
+                continue
+            window.append(value)
+            result[position] = sum(window)
+        return result
+
+    def change(self, metric: str, lag: int):
+        """Relative change of each quarter against the quarter lag places earlier"""
+        count = len(self.dates)
+        result = array("d", [NAN]) * count
+        column = self.metrics.get(metric)
+        if column is None:
+            return result
+        for position in range(count - lag):
+            before = column[position + lag]
+            if before:  # NaN - x is NaN already, only zero needs a guard
+                result[position] = (column[position] - before) / abs(before)
+        return result
+
+    def year_over_year(self, metric: str):
+        return self.change(metric, 4)
+
+    def quarter_over_quarter(self, metric: str):
+        return self.change(metric, 1)
+
+    def to_bytes(self):
+        header = json.dumps(
+            {"dates": self.dates, "metrics": list(self.metrics)}, separators=(",", ":")
+        ).encode()
+        columns = []
+        for column in self.metrics.values():
+            if sys.byteorder != "little":
+                column = array("d", column)
+                column.byteswap()
+            columns.append(column.tobytes())
+        return SERIAL_MAGIC + HEADER_LENGTH.pack(len(header)) + header + b"".join(columns)
+
+    @classmethod
+    def from_bytes(cls, raw: bytes):
+        if not raw.startswith(SERIAL_MAGIC):
+            raise ValueError("Not serialized quarterly financials")
+        offset = len(SERIAL_MAGIC)
+        (header_length,) = HEADER_LENGTH.unpack_from(raw, offset)
+        offset += HEADER_LENGTH.size
+        header = json.loads(raw[offset : offset + header_length])
+        offset += header_length
+
+        width = 8 * len(header["dates"])
+        metrics = {}
+        for name in header["metrics"]:
+            column = array("d")
+            column.frombytes(raw[offset : offset + width])
+            if sys.byteorder != "little":
+                column.byteswap()
+            metrics[name] = column
+            offset += width
+        return cls(header["dates"], metrics)
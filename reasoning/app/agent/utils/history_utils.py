@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+from typing import List
+
+# token budget for the conversation history sent with each LLM call; the last
+# HISTORY_KEEP_TURNS turns are always sent verbatim
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000"))
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+
+
+def estimate_tokens(text: str):
+    # about four characters per token for English text, without loading a tokenizer
+    return len(text) // 4 + 1
+
+
+def split_turns(messages: List[dict]):
+    """Group messages into turns, each starting with a user message"""
+    turns = []
+    for message in messages:
+        if message["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def turn_fingerprint(turn: List[dict]):
+    return hashlib.sha256(json.dumps(turn, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def summarize_turn(turn: List[dict]):
+    """One line per message: what the user asked and what the assistant said,
+    with the widget JSON reduced to the widgets' names and symbols"""
+    lines = []
+    for message in turn:
+        if message["role"] != "assistant":
+            lines.append(f"{message['role'].capitalize()}: {message['content']}")
+            continue
+        try:
+            content = json.loads(message["content"])
+            widgets = [
+                f"{widget['type']} {widget.get('parameters', {}).get('symbol', '')}".strip()
+                for widget in content.get("widgets") or []
+            ]
+            line = f"Assistant: {content['response']}"
+            if widgets:
+                line += f" (showed {', '.join(widgets)})"
+        except Exception:
+            line = f"Assistant: {message['content']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def compact_history(messages: List[dict], compacted: dict = None):
+    """Fit the conversation into HISTORY_TOKEN_BUDGET.
+
+    Turns before the last HISTORY_KEEP_TURNS are replaced by a short summary
+    each, and the oldest summaries are dropped once they no longer fit.
+    `compacted` is the state returned for the previous turn of the session, so
+    only turns that aged out since then are summarized. Returns the messages to
+    send and the state to keep for the next turn.
+    """
+    total = sum(estimate_tokens(message["content"]) for message in messages)
+    if total <= HISTORY_TOKEN_BUDGET:
+        return messages, compacted
+
+    turns = split_turns(messages)
+    split = max(0, len(turns) - HISTORY_KEEP_TURNS)
+    older, recent = turns[:split], turns[split:]
+
+    # reuse the summaries of the previous turn if the history only grew since
+    compacted = compacted or {}
+    summarized = compacted.get("turns", 0)
+    if not 0 < summarized <= len(older) or compacted.get(
+        "fingerprint"
+    ) != turn_fingerprint(older[summarized - 1]):
+        summarized, compacted = 0, {}
+    summaries = compacted.get("summaries", []) + [
+        summarize_turn(turn) for turn in older[summarized:]
+    ]
+
+    recent_messages = [message for turn in recent for message in turn]
+    budget = HISTORY_TOKEN_BUDGET - sum(
+        estimate_tokens(message["content"]) for message in recent_messages
+    )
+    kept = []
+    for summary in reversed(summaries):
+        budget -= estimate_tokens(summary)
+        if budget < 0:
+            break
+        kept.insert(0, summary)
+
+    compacted = {
+        "turns": len(older),
+        "fingerprint": turn_fingerprint(older[-1]) if older else None,
+        "summaries": kept,
+    }
+    if not kept:
+        return recent_messages, compacted
+
+    summary_message = {
+        "role": "system",
+        "content": "Summary of the earlier conversation:\n\n" + "\n\n".join(kept),
+    }
+    return [summary_message] + recent_messages, compacted
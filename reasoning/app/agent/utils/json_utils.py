@@ -0,0 +1,120 @@
+import json
+
+
+def drop_trailing_comma(chars: list):
+    index = len(chars) - 1
+    while index >= 0 and chars[index].isspace():
+        index -= 1
+    if index >= 0 and chars[index] == ",":
+        del chars[index]
+
+
+def repair_json(text: str):
+    """Parse a model's JSON output, fixing the usual ways it goes wrong.
+
+    Prose or code fences around the object, trailing commas and a truncated
+    ending (an open string, array or object) are repaired. Returns None if the
+    text still isn't valid JSON.
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    chars, closers = [], []
+    in_string, escape = False, False
+    for char in text[start:]:
+        if in_string:
+            chars.append(char)
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char in "}]":
+            drop_trailing_comma(chars)
+            chars.append(char)
+            if closers:
+                closers.pop()
+            if not closers:
+                # the object is complete, anything after it is prose
+                break
+            continue
+
+        chars.append(char)
+        if char == '"':
+            in_string = True
+        elif char == "{":
+            closers.append("}")
+        elif char == "[":
+            closers.append("]")
+
+    # close whatever a truncated output left open
+    if in_string:
+        if escape:
+            chars.pop()
+        chars.append('"')
+    repaired = "".join(chars).rstrip()
+    if repaired.endswith(":"):
+        repaired += " null"
+    chars = list(repaired)
+    drop_trailing_comma(chars)
+    repaired = "".join(chars) + "".join(reversed(closers))
+
+    try:
+        return json.loads(repaired)
+    except ValueError:
+        return None
+
+
+def validate_widget(widget):
+    """The widget as {"type", "parameters"}, or None if it isn't usable"""
+    if (
+        isinstance(widget, dict)
+        and isinstance(widget.get("type"), str)
+        and isinstance(widget.setdefault("parameters", {}), dict)
+    ):
+        return widget
+    return None
+
+
+def validate_agent_response(data):
+    """Check the main agent's output against its {"widgets", "response"} schema.
+
+    Returns the output with widgets normalized to a list of {"type", "parameters"}
+    objects, and a list of problems that is empty when the output is usable.
+    """
+    if not isinstance(data, dict):
+        return None, ["the output is not a JSON object"]
+
+    problems = []
+    widgets = data.get("widgets", [])
+    if isinstance(widgets, dict):
+        # the {"showStockPrice": {"parameters": {...}}} form
+        widgets = [
+            {"type": widget_type, **(widget if isinstance(widget, dict) else {})}
+            for widget_type, widget in widgets.items()
+        ]
+    if not isinstance(widgets, list):
+        problems.append('"widgets" must be a list')
+        widgets = []
+
+    valid_widgets = []
+    for widget in widgets:
+        if validate_widget(widget) is not None:
+            valid_widgets.append(widget)
+        else:
+            problems.append(f"invalid widget {json.dumps(widget)}")
+
+    response = data.get("response")
+    if not isinstance(response, str) or not response.strip():
+        problems.append('"response" must be a non-empty string')
+
+    return {"widgets": valid_widgets, "response": response}, problems
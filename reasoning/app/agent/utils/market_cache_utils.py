@@ -0,0 +1,185 @@
+import os
+import time
+import hashlib
+import logging
+from typing import List
+
+from . import cache_utils
+from .codec_utils import decode_value, encode_value
+from .symbol_utils import normalize_utterance
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(message)s")
+
+# widgets without parameters show the same market-wide data to everyone, so
+# answers made only of these can be shared between sessions
+MARKET_WIDGETS = {
+    "showStockScreener",
+    "showMarketOverview",
+    "showMarketHeatmap",
+    "showETFHeatmap",
+    "showTrendingStocks",
+}
+
+# a hash of entry id -> entry, so replicas storing answers at the same time
+# each write their own field instead of overwriting one shared index
+MARKET_RESPONSES_KEY = "market_responses"
+MARKET_RESPONSE_HITS_KEY = "market_response_hits"
+
+MARKET_RESPONSE_TTL = int(os.getenv("MARKET_RESPONSE_TTL", "120"))
+# Jaccard similarity of the word uni- and bigrams needed to reuse an answer
+MARKET_RESPONSE_SIMILARITY = float(os.getenv("MARKET_RESPONSE_SIMILARITY", "0.75"))
+MARKET_RESPONSE_MAX_ENTRIES = int(os.getenv("MARKET_RESPONSE_MAX_ENTRIES", "200"))
+
+# words that don't change what is being asked
+FILLER_WORDS = {
+    "a",
+    "alice",
+    "are",
+    "can",
+    "could",
+    "hey",
+    "hi",
+    "is",
+    "me",
+    "ok",
+    "okay",
+    "please",
+    "so",
+    "the",
+    "uh",
+    "um",
+    "you",
+}
+
+
+def utterance_ngrams(utterance: str):
+    tokens = [
+        token
+        for token in normalize_utterance(utterance).split()
+        if token not in FILLER_WORDS
+    ]
+    return set(tokens) | {f"{a} {b}" for a, b in zip(tokens, tokens[1:])}
+
+
+def jaccard(a: set, b: set):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def context_id(previous_reply: str):
+    """Short follow-ups ("yes", "show me more") mean whatever the assistant just
+    offered, so answers are only shared after the same previous reply"""
+    return hashlib.sha256((previous_reply or "").encode()).hexdigest()[:16]
+
+
+def entry_id(ngrams: set, active_widgets: List[str], context: str):
+    key = "|".join(sorted(ngrams)) + "#" + ",".join(active_widgets) + "#" + context
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def is_live(entry: dict):
+    return time.time() - entry["stored_at"] <= MARKET_RESPONSE_TTL
+
+
+async def market_entries():
+    """Every stored entry by id, live or not"""
+    try:
+        fields = await cache_utils.redis_client.hgetall(MARKET_RESPONSES_KEY)
+    except Exception as e:
+        logging.error(f"Error reading market responses: {str(e)}")
+        return {}
+    entries = {}
+    for key, raw in fields.items():
+        try:
+            entries[key.decode()] = decode_value(raw)
+        except ValueError as e:
+            logging.warning(f"Ignoring unreadable market response {key}: {str(e)}")
+    return entries
+
+
+async def find_market_response(
+    utterance: str, active_widgets: List[str], previous_reply: str = ""
+):
+    """The cached answer to a market-wide question close enough to `utterance`
+    asked with the same widgets on screen after the same assistant reply, as
+    {"widgets", "response"}"""
+    if MARKET_RESPONSE_TTL <= 0:
+        return None
+
+    ngrams = utterance_ngrams(utterance)
+    context = context_id(previous_reply)
+    best_id, best_entry, best_similarity = None, None, MARKET_RESPONSE_SIMILARITY
+    for key, entry in (await market_entries()).items():
+        if (
+            not is_live(entry)
+            or entry["active_widgets"] != active_widgets
+            or entry.get("context") != context
+        ):
+            continue
+        similarity = jaccard(ngrams, set(entry["ngrams"]))
+        if similarity >= best_similarity:
+            best_id, best_entry, best_similarity = key, entry, similarity
+    if best_entry is None:
+        return None
+
+    logging.info(f"Market response cache hit {best_id} ({best_similarity:.2f})")
+    try:
+        await cache_utils.redis_client.hincrby(MARKET_RESPONSE_HITS_KEY, best_id, 1)
+        await cache_utils.redis_client.expire(MARKET_RESPONSE_HITS_KEY, 24 * 60 * 60)
+    except Exception as e:
+        logging.error(f"Error recording market response hit: {str(e)}")
+    return {"widgets": best_entry["widgets"], "response": best_entry["response"]}
+
+
+async def store_market_response(
+    utterance: str, active_widgets: List[str], response: dict, previous_reply: str = ""
+):
+    """Remember an answer made only of market-wide widgets"""
+    widgets = response["widgets"]
+    if MARKET_RESPONSE_TTL <= 0 or not widgets:
+        return
+    if any(widget["type"] not in MARKET_WIDGETS for widget in widgets):
+        return
+
+    ngrams = utterance_ngrams(utterance)
+    context = context_id(previous_reply)
+    key = entry_id(ngrams, active_widgets, context)
+    entry = {
+        "ngrams": sorted(ngrams),
+        "active_widgets": active_widgets,
+        "context": context,
+        "widgets": widgets,
+        "response": response["response"],
+        "stored_at": time.time(),
+    }
+    # only this entry's field is written, and only fields that were already
+    # expired or pushed out when read are removed, so concurrent stores from
+    # other replicas are never lost
+    index = {
+        other: stored
+        for other, stored in (await market_entries()).items()
+        if other != key
+    }
+    live = sorted(
+        (other for other in index if is_live(index[other])),
+        key=lambda other: index[other]["stored_at"],
+    )
+    keep = set(live[max(0, len(live) - MARKET_RESPONSE_MAX_ENTRIES + 1) :])
+    doomed = [other for other in index if other not in keep]
+    try:
+        pipe = cache_utils.redis_client.pipeline()
+        pipe.hset(MARKET_RESPONSES_KEY, key, encode_value(entry))
+        if doomed:
+            pipe.hdel(MARKET_RESPONSES_KEY, *doomed)
+        pipe.expire(MARKET_RESPONSES_KEY, MARKET_RESPONSE_TTL)
+        await pipe.execute()
+    except Exception as e:
+        logging.error(f"Error storing market response: {str(e)}")
+
+
+async def market_response_hits():
+    """Hits per cached market response id"""
+    hits = await cache_utils.redis_client.hgetall(MARKET_RESPONSE_HITS_KEY)
+    return {key.decode(): int(value) for key, value in hits.items()}
@@ -0,0 +1,262 @@
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import contextvars
+from collections import defaultdict
+
+# urllib3 comes with the Polygon client
+try:
+    from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+    from urllib3.exceptions import TimeoutError as HTTPTimeoutError
+except ImportError:
+    MaxRetryError = NewConnectionError = ProtocolError = HTTPTimeoutError = None
+
+from . import cache_utils
+from ..tracing import record_upstream, span
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(message)s")
+
+# token bucket shared by every replica, sized to the Polygon plan: calls refill at
+# POLYGON_CALLS_PER_MINUTE up to POLYGON_BURST (0 turns the limiter off)
+POLYGON_CALLS_PER_MINUTE = float(os.getenv("POLYGON_CALLS_PER_MINUTE", "300"))
+POLYGON_BURST = int(os.getenv("POLYGON_BURST", "20"))
+# share of the bucket only live turns may use, so background work can't drain it
+POLYGON_LIVE_RESERVE = float(os.getenv("POLYGON_LIVE_RESERVE", "0.25"))
+RATE_LIMIT_KEY = "polygon_rate_limit"
+
+# 429s and 5xx responses are retried with full jitter backoff
+POLYGON_MAX_RETRIES = int(os.getenv("POLYGON_MAX_RETRIES", "3"))
+POLYGON_RETRY_BASE = float(os.getenv("POLYGON_RETRY_BASE", "0.25"))
+POLYGON_RETRY_MAX = float(os.getenv("POLYGON_RETRY_MAX", "4"))
+
+# connections kept open to Polygon, enough for every worker thread calling it
+POLYGON_POOL_SIZE = int(os.getenv("POLYGON_POOL_SIZE", "32"))
+
+# live turns go ahead of the prewarmer and batch jobs, which run in the
+# "background" lane; a task's lane is inherited by everything it starts
+LIVE, BACKGROUND = "live", "background"
+polygon_lane = contextvars.ContextVar("polygon_lane", default=LIVE)
+live_waiting = 0
+LANE_POLL = 0.02
+
+# calls, throttled (waited on the limiter), retried and failed calls per endpoint
+polygon_stats = defaultdict(
+    lambda: {"calls": 0, "throttled": 0, "retried": 0, "failed": 0}
+)
+# calls made from each lane, retries included; the prewarmer charges its budget
+# from the background lane's
+lane_calls = {LIVE: 0, BACKGROUND: 0}
+
+# rate limit checks against the shared bucket and the local fallback, and the times
+# the shared bucket was lost; while it is, every replica allows the full rate
+rate_limit_stats = {"shared": 0, "local": 0, "fallbacks": 0}
+# when the shared bucket became unavailable and was last warned about, if it is
+shared_limit_lost_at = None
+shared_limit_warned_at = None
+RATE_LIMIT_WARNING_INTERVAL = 60
+
+# tokens left and seconds to wait for one, with the time taken from Redis so the
+# replicas' clocks don't matter
+TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 + reserve then
+    tokens = tokens - 1
+else
+    wait = (1 + reserve - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """In-process bucket used while Redis is unreachable"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, reserve: float):
+        """Take a token, or return the seconds until one is free beyond `reserve`"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1 + reserve:
+            self.tokens -= 1
+            return 0.0
+        return (1 + reserve - self.tokens) / self.rate
+
+
+local_bucket = TokenBucket(POLYGON_CALLS_PER_MINUTE / 60, POLYGON_BURST)
+# the Redis client and TAKE_TOKEN_SCRIPT registered with it, so each call sends
+# the script's SHA instead of its source
+take_token_script = (None, None)
+
+
+def registered_take_token_script():
+    global take_token_script
+    redis_client, script = take_token_script
+    if script is None or redis_client is not cache_utils.redis_client:
+        redis_client = cache_utils.redis_client
+        script = redis_client.register_script(TAKE_TOKEN_SCRIPT)
+        take_token_script = (redis_client, script)
+    return script
+
+
+def shared_limit_lost(error: Exception):
+    global shared_limit_lost_at, shared_limit_warned_at
+    now = time.monotonic()
+    if shared_limit_lost_at is None:
+        shared_limit_lost_at = shared_limit_warned_at = now
+        rate_limit_stats["fallbacks"] += 1
+        logging.warning(
+            f"Shared Polygon rate limit unavailable, limiting this replica on its "
+            f"own at the full rate: {str(error)}"
+        )
+    elif now - shared_limit_warned_at >= RATE_LIMIT_WARNING_INTERVAL:
+        shared_limit_warned_at = now
+        logging.warning(
+            f"Shared Polygon rate limit still unavailable after "
+            f"{now - shared_limit_lost_at:.0f}s: {str(error)}"
+        )
+
+
+def shared_limit_restored():
+    global shared_limit_lost_at, shared_limit_warned_at
+    if shared_limit_lost_at is not None:
+        logging.info(
+            f"Shared Polygon rate limit back after "
+            f"{time.monotonic() - shared_limit_lost_at:.0f}s"
+        )
+        shared_limit_lost_at = shared_limit_warned_at = None
+
+
+async def take_token(reserve: float):
+    try:
+        script = registered_take_token_script()
+        wait = float(
+            await script(
+                keys=[RATE_LIMIT_KEY],
+                args=[POLYGON_CALLS_PER_MINUTE / 60, POLYGON_BURST, reserve],
+            )
+        )
+    except Exception as e:
+        # each replica then limits itself to the full rate
+        shared_limit_lost(e)
+        rate_limit_stats["local"] += 1
+        return local_bucket.take(reserve)
+    shared_limit_restored()
+    rate_limit_stats["shared"] += 1
+    return wait
+
+
+async def acquire(lane: str):
+    """Wait for a call token; True if the call had to wait"""
+    global live_waiting
+    if POLYGON_CALLS_PER_MINUTE <= 0:
+        return False
+
+    waited = False
+    # a full bucket must still let background calls through
+    reserve = 0.0
+    if lane != LIVE:
+        reserve = min(POLYGON_BURST * POLYGON_LIVE_RESERVE, POLYGON_BURST - 1)
+    if lane == LIVE:
+        live_waiting += 1
+    try:
+        while True:
+            if lane != LIVE and live_waiting:
+                waited = True
+                await asyncio.sleep(LANE_POLL)
+                continue
+            wait = await take_token(reserve)
+            if wait <= 0:
+                return waited
+            waited = True
+            await asyncio.sleep(min(wait, 1.0))
+    finally:
+        if lane == LIVE:
+            live_waiting -= 1
+
+
+def error_status(error: Exception):
+    """HTTP status of a failed Polygon call, if it can be told"""
+    status = getattr(error, "status", None)
+    if isinstance(status, int):
+        return status
+    # with its own retries off, urllib3 reports "too many 429 error responses"
+    match = re.search(r"too many (\d{3}) error responses", str(error))
+    return int(match.group(1)) if match else None
+
+
+# dropped connections and timeouts, which urllib3 used to retry itself
+CONNECTION_ERRORS = tuple(
+    error
+    for error in (
+        ConnectionError,
+        TimeoutError,
+        NewConnectionError,
+        ProtocolError,
+        HTTPTimeoutError,
+    )
+    if error is not None
+)
+
+
+def is_connection_error(error: Exception):
+    # with its own retries off, urllib3 wraps the cause in a MaxRetryError
+    if MaxRetryError is not None and isinstance(error, MaxRetryError):
+        error = error.reason
+    return isinstance(error, CONNECTION_ERRORS)
+
+
+def is_retryable(error: Exception):
+    if is_connection_error(error):
+        return True
+    status = error_status(error)
+    return status is not None and (status == 429 or status >= 500)
+
+
+async def polygon_request(endpoint: str, func, *args, **kwargs):
+    """Run a blocking Polygon client call in a worker thread, within the shared
+    rate limit and retrying throttled and failed responses"""
+    stats = polygon_stats[endpoint]
+    lane = polygon_lane.get()
+    with span(f"polygon.{endpoint}"):
+        for attempt in range(POLYGON_MAX_RETRIES + 1):
+            if await acquire(lane):
+                stats["throttled"] += 1
+            stats["calls"] += 1
+            lane_calls[lane] += 1
+            record_upstream(endpoint)
+            try:
+                return await asyncio.to_thread(func, *args, **kwargs)
+            except Exception as e:
+                if attempt == POLYGON_MAX_RETRIES or not is_retryable(e):
+                    stats["failed"] += 1
+                    raise
+                stats["retried"] += 1
+                delay = random.uniform(
+                    0, min(POLYGON_RETRY_MAX, POLYGON_RETRY_BASE * 2**attempt)
+                )
+                reason = error_status(e) or type(e).__name__
+                logging.warning(
+                    f"Polygon {endpoint} failed with {reason}, retrying in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
@@ -0,0 +1,207 @@
+import os
+import time
+import asyncio
+import logging
+from functools import partial
+from polygon import RESTClient
+
+from . import cache_utils
+from .stock_utils import (
+    FINANCIALS_CACHE_TTL,
+    FUNDAMENTALS_LAYERS,
+    fetch_financials,
+    layer_key,
+)
+from .polygon_utils import BACKGROUND, lane_calls, polygon_lane
+from .snapshot_utils import (
+    BULK_SNAPSHOT_TTL,
+    MARKET_SNAPSHOT_KEY,
+    refresh_market_snapshot,
+)
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(message)s")
+
+# decayed request counts per ticker, shared by all replicas
+POPULARITY_KEY = "ticker_popularity"
+PREWARM_LEADER_KEY = "prewarm_leader"
+
+# keep the PREWARM_TOP_N most requested tickers warm (0 disables the prewarmer)
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "30"))
+PREWARM_INTERVAL = int(os.getenv("PREWARM_INTERVAL", "60"))
+# a request's weight halves every PREWARM_HALF_LIFE seconds
+PREWARM_HALF_LIFE = int(os.getenv("PREWARM_HALF_LIFE", "3600"))
+# upstream budget of the prewarmer, kept well under the Polygon plan's rate limit
+PREWARM_MAX_CALLS_PER_MINUTE = int(os.getenv("PREWARM_MAX_CALLS_PER_MINUTE", "30"))
+# the leader key outlives a cycle and the pause after it, so the leader renews it
+# before it expires; a leader that stops renewing hands over within this long
+PREWARM_LEADER_TTL = 3 * PREWARM_INTERVAL
+
+# extend or delete the leader key only while it still holds this replica's id
+RENEW_LEADER_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("EXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEADER_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+# refresh a layer once less than this fraction of its TTL is left
+PREWARM_REFRESH_MARGIN = float(os.getenv("PREWARM_REFRESH_MARGIN", "0.2"))
+
+# every cached layer of a ticker: the processed financials the spreadsheet widgets
+# read (refreshed first, the trailing figures are computed from them) and the
+# fundamentals layers
+PREWARM_LAYERS = {
+    "financials": (FINANCIALS_CACHE_TTL, fetch_financials),
+    **FUNDAMENTALS_LAYERS,
+}
+
+popularity_updates = set()
+
+
+def record_ticker_requests(tickers):
+    """Count a request for each ticker towards its popularity, in the background
+    so the bookkeeping adds nothing to the turn"""
+    if not tickers:
+        return None
+    task = asyncio.ensure_future(update_popularity(tickers))
+    popularity_updates.add(task)
+    task.add_done_callback(popularity_updates.discard)
+    return task
+
+
+async def update_popularity(tickers):
+    try:
+        pipeline = cache_utils.redis_client.pipeline(transaction=False)
+        for ticker in tickers:
+            pipeline.zincrby(POPULARITY_KEY, 1, ticker)
+        await pipeline.execute()
+    except Exception as e:
+        logging.error(f"Error recording ticker popularity: {str(e)}")
+
+
+async def decay_popularity():
+    factor = 0.5 ** (PREWARM_INTERVAL / PREWARM_HALF_LIFE)
+    await cache_utils.redis_client.zunionstore(POPULARITY_KEY, {POPULARITY_KEY: factor})
+    # forget tickers nobody has asked about for many half lives
+    await cache_utils.redis_client.zremrangebyscore(POPULARITY_KEY, 0, 0.01)
+
+
+async def hottest_tickers(count: int):
+    members = await cache_utils.redis_client.zrevrange(POPULARITY_KEY, 0, count - 1)
+    return [member.decode() for member in members]
+
+
+async def is_due(key: str, cache_duration: int):
+    """Whether a cache entry is missing or close to expiring"""
+    entry = await cache_utils.get_cached_data(key)
+    return entry is None or time.time() - entry["fetched_at"] > cache_duration * (
+        1 - PREWARM_REFRESH_MARGIN
+    )
+
+
+async def layers_due(ticker: str):
+    """Layers of a ticker that are missing or close to expiring"""
+    due = []
+    for layer, (cache_duration, _) in PREWARM_LAYERS.items():
+        if await is_due(layer_key(layer, ticker), cache_duration):
+            due.append(layer)
+    return due
+
+
+async def prewarm_cycle(client: RESTClient):
+    """Refresh the due layers of the hottest tickers within one interval's budget
+    of Polygon calls; returns the layers refreshed and the calls they made"""
+    await decay_popularity()
+
+    budget = max(1, PREWARM_MAX_CALLS_PER_MINUTE * PREWARM_INTERVAL // 60)
+    spacing = 60 / PREWARM_MAX_CALLS_PER_MINUTE
+    start_calls = lane_calls[BACKGROUND]
+    refreshed = 0
+
+    async def pace(calls_before: int):
+        # a refresh makes as many calls as its layer needs (pages, retries, none
+        # when it joins a running fetch), so wait in proportion to them
+        await asyncio.sleep(spacing * (lane_calls[BACKGROUND] - calls_before))
+
+    # one bulk call keeps every ticker's snapshot layer from needing a call
+    if BULK_SNAPSHOT_TTL > 0 and await is_due(MARKET_SNAPSHOT_KEY, BULK_SNAPSHOT_TTL):
+        calls_before = lane_calls[BACKGROUND]
+        try:
+            await refresh_market_snapshot(client)
+        except Exception as e:
+            logging.error(f"Error prewarming the bulk snapshot: {str(e)}")
+        refreshed += 1
+        await pace(calls_before)
+    for ticker in await hottest_tickers(PREWARM_TOP_N):
+        for layer in await layers_due(ticker):
+            if lane_calls[BACKGROUND] - start_calls >= budget:
+                return refreshed, lane_calls[BACKGROUND] - start_calls
+            cache_duration, fetch = PREWARM_LAYERS[layer]
+            calls_before = lane_calls[BACKGROUND]
+            try:
+                await cache_utils.start_fetch(
+                    layer_key(layer, ticker),
+                    cache_duration,
+                    partial(fetch, ticker, client),
+                )
+            except Exception as e:
+                logging.error(f"Error prewarming {layer} for {ticker}: {str(e)}")
+            refreshed += 1
+            await pace(calls_before)
+    return refreshed, lane_calls[BACKGROUND] - start_calls
+
+
+async def claim_leadership():
+    """Whether this replica runs the next cycle: it takes the leader key when it is
+    free and renews it while it still holds it"""
+    redis_client = cache_utils.redis_client
+    if await redis_client.set(
+        PREWARM_LEADER_KEY, cache_utils.instance_id, nx=True, ex=PREWARM_LEADER_TTL
+    ):
+        return True
+    renew = redis_client.register_script(RENEW_LEADER_SCRIPT)
+    renewed = await renew(
+        keys=[PREWARM_LEADER_KEY], args=[cache_utils.instance_id, PREWARM_LEADER_TTL]
+    )
+    return bool(renewed)
+
+
+async def release_leadership():
+    """Hand the leader key over right away, if this replica holds it"""
+    try:
+        release = cache_utils.redis_client.register_script(RELEASE_LEADER_SCRIPT)
+        await release(keys=[PREWARM_LEADER_KEY], args=[cache_utils.instance_id])
+    except Exception as e:
+        logging.error(f"Error releasing {PREWARM_LEADER_KEY}: {str(e)}")
+
+
+async def run_prewarmer(client: RESTClient):
+    """Keep the most requested tickers cached; one replica runs each cycle"""
+    if PREWARM_TOP_N <= 0 or PREWARM_MAX_CALLS_PER_MINUTE <= 0:
+        return
+
+    # refreshes started from here wait behind the Polygon calls of live turns
+    polygon_lane.set(BACKGROUND)
+
+    logging.info(f"Prewarming the top {PREWARM_TOP_N} tickers.")
+    try:
+        while True:
+            try:
+                if await claim_leadership():
+                    refreshed, calls = await prewarm_cycle(client)
+                    logging.info(
+                        f"Prewarmed {refreshed} cache layers with {calls} Polygon calls"
+                    )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Prewarm cycle failed: {str(e)}")
+            await asyncio.sleep(PREWARM_INTERVAL)
+    finally:
+        await release_leadership()
@@ -0,0 +1,57 @@
+import json
+import hashlib
+from typing import List
+
+from .history_utils import estimate_tokens
+
+
+def digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+class PromptBuilder:
+    """Assembles the messages of an LLM call in layers, most stable first.
+
+    Static layers are the same for every call, so a provider's prompt cache can
+    reuse them across sessions. Everything added after them follows; per-turn
+    data should come last so it doesn't break the prefix shared with the
+    previous turn of the session.
+    """
+
+    def __init__(self):
+        self.static = []
+        self.dynamic = []
+
+    def add_static(self, *messages: dict):
+        self.static.extend(messages)
+        return self
+
+    def add(self, *messages: dict):
+        self.dynamic.extend(messages)
+        return self
+
+    def build(self):
+        return self.static + self.dynamic
+
+    def cache_key(self, prefix: str):
+        # a change to the static layers alone invalidates every cached response
+        return f"{prefix}_{digest(self.static)[:16]}_{digest(self.dynamic)}"
+
+
+def prefix_reuse(messages: List[dict], previous: List[list] = None):
+    """Estimate how many prompt tokens repeat the previous prompt's prefix.
+
+    `previous` is the [fingerprint, tokens] list returned for the previous
+    prompt. Returns (reused tokens, total tokens, list for the next prompt).
+    """
+    fingerprints = [
+        [digest(message)[:16], estimate_tokens(message["content"])]
+        for message in messages
+    ]
+    reused = 0
+    for current, before in zip(fingerprints, previous or []):
+        if current[0] != before[0]:
+            break
+        reused += current[1]
+    total = sum(tokens for _, tokens in fingerprints)
+    return reused, total, fingerprints
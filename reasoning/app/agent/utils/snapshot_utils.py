@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import math
+import struct
+import logging
+from array import array
+from functools import partial
+from polygon import RESTClient
+
+from . import cache_utils
+from .polygon_utils import polygon_request
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(message)s")
+
+# the whole market's snapshot (or a watchlist's) comes from one bulk call and
+# is refreshed every BULK_SNAPSHOT_TTL seconds (0 fetches every ticker on its own)
+BULK_SNAPSHOT_TTL = int(os.getenv("BULK_SNAPSHOT_TTL", "60"))
+BULK_SNAPSHOT_TICKERS = [
+    ticker.strip().upper()
+    for ticker in os.getenv("BULK_SNAPSHOT_TICKERS", "").split(",")
+    if ticker.strip()
+]
+MARKET_SNAPSHOT_KEY = "market_snapshot"
+
+# movers are picked among tickers trading at least this much, leaving out
+# illiquid listings whose price jumps on a handful of trades
+MOVERS_MIN_VOLUME = 1_000_000
+MOVERS_COUNT = 5
+# broad market ETFs quoted at the top of the market summary
+MARKET_BENCHMARKS = ("SPY", "QQQ", "DIA", "IWM")
+
+SERIAL_MAGIC = b"SNAP1"
+HEADER_LENGTH = struct.Struct("<I")
+NAN = float("nan")
+
+
+class SnapshotTable:
+    """Snapshot of many tickers as one float column per field, with a symbol
+    index for constant time lookups"""
+
+    COLUMNS = ("close", "todays_change", "todays_change_percent", "volume")
+
+    def __init__(self, symbols=(), columns=None):
+        self.symbols = list(symbols)
+        self.index = {symbol: position for position, symbol in enumerate(self.symbols)}
+        self.columns = columns or {name: array("d") for name in self.COLUMNS}
+
+    @classmethod
+    def from_snapshots(cls, snapshots):
+        table = cls()
+        for snapshot in snapshots or []:
+            if not snapshot.ticker or snapshot.ticker in table.index:
+                continue
+            day = snapshot.day
+            values = (
+                day.close if day else None,
+                snapshot.todays_change,
+                snapshot.todays_change_percent,
+                day.volume if day else None,
+            )
+            table.index[snapshot.ticker] = len(table.symbols)
+            table.symbols.append(snapshot.ticker)
+            for name, value in zip(cls.COLUMNS, values):
+                table.columns[name].append(NAN if value is None else value)
+        return table
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, ticker: str):
+        return ticker in self.index
+
+    def value(self, name: str, position: int):
+        value = self.columns[name][position]
+        return None if math.isnan(value) else value
+
+    def get(self, ticker: str):
+        """The snapshot fields of the fundamentals, like fetch_snapshot returns"""
+        position = self.index.get(ticker)
+        if position is None:
+            return None
+        close = self.value("close", position)
+        return {
+            # round since number is approx due to 15 minute delay
+            "live_price": round(close) if close else None,
+            "todays_change": self.value("todays_change", position),
+            "todays_change_percent": self.value("todays_change_percent", position),
+        }
+
+    def breadth(self):
+        """Number of advancing and declining tickers"""
+        changes = self.columns["todays_change"]
+        return sum(1 for change in changes if change > 0), sum(
+            1 for change in changes if change < 0
+        )
+
+    def movers(self, count: int, gainers: bool = True):
+        """Tickers with the largest percent change either way, liquid ones only"""
+        percents, volumes = self.columns["todays_change_percent"], self.columns["volume"]
+        liquid = [
+            position
+            for position, volume in enumerate(volumes)
+            if volume >= MOVERS_MIN_VOLUME and not math.isnan(percents[position])
+        ]
+        liquid.sort(key=lambda position: percents[position], reverse=gainers)
+        return [(self.symbols[position], percents[position]) for position in liquid[:count]]
+
+    def to_bytes(self):
+        header = json.dumps(
+            {"symbols": self.symbols, "columns": list(self.columns)}, separators=(",", ":")
+        ).encode()
+        columns = []
+        for column in self.columns.values():
+            if sys.byteorder != "little":
+                column = array("d", column)
+                column.byteswap()
+            columns.append(column.tobytes())
+        return SERIAL_MAGIC + HEADER_LENGTH.pack(len(header)) + header + b"".join(columns)
+
+    @classmethod
+    def from_bytes(cls, raw: bytes):
+        if not raw.startswith(SERIAL_MAGIC):
+            raise ValueError("Not a serialized snapshot table")
+        offset = len(SERIAL_MAGIC)
+        (header_length,) = HEADER_LENGTH.unpack_from(raw, offset)
+        offset += HEADER_LENGTH.size
+        header = json.loads(raw[offset : offset + header_length])
+        offset += header_length
+
+        width = 8 * len(header["symbols"])
+        columns = {}
+        for name in header["columns"]:
+            column = array("d")
+            column.frombytes(raw[offset : offset + width])
+            if sys.byteorder != "little":
+                column.byteswap()
+            columns[name] = column
+            offset += width
+        return cls(header["symbols"], columns)
+
+
+async def fetch_market_snapshot(client: RESTClient):
+    snapshots = await polygon_request(
+        "get_snapshot_all",
+        client.get_snapshot_all,
+        "stocks",
+        tickers=BULK_SNAPSHOT_TICKERS or None,
+    )
+    table = SnapshotTable.from_snapshots(snapshots)
+    logging.info(f"Bulk snapshot of {len(table)} tickers")
+    return table.to_bytes() if len(table) else None
+
+
+# the table decoded from the cached entry, reused until the entry is refreshed
+decoded = {"fetched_at": None, "table": None}
+
+
+def log_refresh_failure(flight):
+    if not flight.cancelled() and flight.exception() is not None:
+        logging.error(f"Bulk snapshot refresh failed: {flight.exception()}")
+
+
+def refresh_market_snapshot(client: RESTClient):
+    flight = cache_utils.start_fetch(
+        MARKET_SNAPSHOT_KEY, BULK_SNAPSHOT_TTL, partial(fetch_market_snapshot, client)
+    )
+    flight.add_done_callback(log_refresh_failure)
+    return flight
+
+
+async def get_market_snapshot(client: RESTClient):
+    """The bulk snapshot table, or None while it is first fetched.
+
+    Never waits on Polygon: a missing or expired table is refreshed in the
+    background and callers fall back to per-ticker snapshots meanwhile.
+    """
+    if BULK_SNAPSHOT_TTL <= 0:
+        return None
+    entry = await cache_utils.get_cached_data(MARKET_SNAPSHOT_KEY)
+    if entry is None or not cache_utils.is_fresh(entry, BULK_SNAPSHOT_TTL):
+        refresh_market_snapshot(client)
+    if entry is None:
+        return None
+
+    if decoded["fetched_at"] != entry["fetched_at"]:
+        decoded["table"] = SnapshotTable.from_bytes(entry["data"])
+        decoded["fetched_at"] = entry["fetched_at"]
+    return decoded["table"]
+
+
+def format_percent(value: float):
+    return f"{value:+.2f}%"
+
+
+async def market_summary_text(client: RESTClient):
+    """Breadth, benchmarks and movers of the market from the bulk snapshot, for
+    market-wide questions; empty until the snapshot is available"""
+    try:
+        table = await get_market_snapshot(client)
+    except Exception as e:
+        logging.error(f"Error reading the bulk snapshot: {str(e)}")
+        return ""
+    if not table:
+        return ""
+
+    lines = []
+    for ticker in MARKET_BENCHMARKS:
+        snapshot = table.get(ticker)
+        if snapshot and snapshot["todays_change_percent"] is not None:
+            lines.append(
+                f"{ticker}: {snapshot['live_price']} ({format_percent(snapshot['todays_change_percent'])})"
+            )
+    advancing, declining = table.breadth()
+    lines.append(f"Advancing: {advancing}, declining: {declining}")
+    for label, gainers in (("Top gainers", True), ("Top losers", False)):
+        movers = table.movers(MOVERS_COUNT, gainers)
+        if movers:
+            lines.append(
+                f"{label}: "
+                + ", ".join(f"{ticker} {format_percent(percent)}" for ticker, percent in movers)
+            )
+    return "### Market Snapshot\n" + "\n".join(lines) + "\n\n"
@@ -1,40 +1,29 @@
 import os
+import re
 import logging
+import asyncio
 from polygon import RESTClient
-import json
-from datetime import datetime, timedelta
-import redis
-import pickle
+import time
+from datetime import datetime
+from functools import partial
 
-
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(message)s")
-
-# set up the redis client
-redis_host = os.getenv("REDIS_HOST", "localhost")
-redis_client = redis.Redis(host=redis_host, port=6379, db=0, decode_responses=False)
+from .cache_utils import get_or_fetch, get_or_fetch_entry
+from .bar_store import get_daily_bars
+from .bar_utils import compute_historical_changes, history_start
+from .financials_store import get_quarterly_filings
+from .financials_utils import QuarterlyFinancials
+from .polygon_utils import POLYGON_POOL_SIZE, polygon_request
+from .snapshot_utils import get_market_snapshot
+from ..tracing import span
 
 
-def get_cached_data(key: str):
-    """Get data from Redis cache"""
-    try:
-        cached_data = redis_client.get(key)
-        if cached_data:
-            logging.info(f"Cache hit for {key}")
-            return pickle.loads(cached_data)
-        return None
-    except Exception as e:
-        logging.error(f"Error reading from cache: {str(e)}")
-        return None
-
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(message)s")
 
-def set_cached_data(key: str, data, cache_duration: int):
-    """Set data in Redis cache with expiration"""
-    try:
-        pickled_data = pickle.dumps(data)
-        logging.info(f"Cache write for {key}")
-        redis_client.setex(key, cache_duration, pickled_data)
-    except Exception as e:
-        logging.error(f"Error writing to cache: {str(e)}")
+# cache lifetimes (seconds) of the fundamentals layers, from least to most volatile
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", str(24 * 60 * 60)))
+FINANCIALS_CACHE_TTL = int(os.getenv("FINANCIALS_CACHE_TTL", str(12 * 60 * 60)))
+HISTORY_CACHE_TTL = int(os.getenv("HISTORY_CACHE_TTL", "3600"))
+SNAPSHOT_CACHE_TTL = int(os.getenv("SNAPSHOT_CACHE_TTL", "300"))
 
 
 def initialize_polygon_client():
@@ -48,233 +37,283 @@ def initialize_polygon_client():
     else:
         logging.info("POLYGON_API_KEY : ***************")
 
-    polygon_client = RESTClient(api_key=POLYGON_API_KEY)
+    # failed calls are retried by polygon_request with jittered backoff instead of
+    # right away, and the pool keeps a connection per worker thread rather than
+    # one per host, which concurrent fetches would keep reopening
+    polygon_client = RESTClient(api_key=POLYGON_API_KEY, retries=0)
+    pool_manager = getattr(polygon_client, "client", None)
+    pool_settings = getattr(pool_manager, "connection_pool_kw", None)
+    if pool_settings is not None:
+        pool_settings["maxsize"] = POLYGON_POOL_SIZE
 
     return polygon_client
 
 
-def get_historical_data(ticker: str, client: RESTClient):
+async def get_historical_data(ticker: str, client: RESTClient):
+    # only bars missing from the bar store are requested; changes are computed locally
     end_date = datetime.now()
-    intervals = [
-        ("1 week", timedelta(days=7)),
-        ("1 month", timedelta(days=30)),
-        ("3 months", timedelta(days=90)),
-        ("6 months", timedelta(days=180)),
-        ("1 year", timedelta(days=365)),
-        ("2 years", timedelta(days=730)),
-    ]
-
-    results = {}
-    for label, delta in intervals:
-        start_date = end_date - delta
-        try:
-            data = client.get_aggs(ticker, 1, "day", start_date, end_date)
-            if data:
-                start_price = data[0].close
-                end_price = data[-1].close
-                change = round((end_price - start_price) / start_price * 100, 2)
-                results[label] = {
-                    "change": change,
-                    "start_date": start_date.strftime("%Y-%m-%d"),
-                    "end_date": end_date.strftime("%Y-%m-%d"),
-                }
-        except Exception as e:
-            logging.error(f"Error fetching {label} data for {ticker}: {str(e)}")
-
-    return results
-
-
-def get_stock_fundamentals(ticker: str, client: RESTClient):
-    cache_key = f"stock_fundamentals_{ticker}"
-    cache_key_text = cache_key + "_text"
-    cache_key_json = cache_key + "_json"
-
-    # Try to get from cache
-    cached_data_text = get_cached_data(cache_key_text)
-    cached_data_json = get_cached_data(cache_key_json)
-    if cached_data_text and cached_data_json:
-        return cached_data_text, cached_data_json
-
     try:
-        # fetch fundamentals
-        fundamentals = client.get_ticker_details(ticker)
-
-        # extract all information except branding and phone
-        relevant_info = {
-            "address": {
-                "address1": (
-                    fundamentals.address.address1 if fundamentals.address else None
-                ),
-                "address2": (
-                    fundamentals.address.address2 if fundamentals.address else None
-                ),
-                "city": fundamentals.address.city if fundamentals.address else None,
-                "state": fundamentals.address.state if fundamentals.address else None,
-                "country": (
-                    fundamentals.address.country if fundamentals.address else None
-                ),
-                "postal_code": (
-                    fundamentals.address.postal_code if fundamentals.address else None
-                ),
-            },
-            "cik": fundamentals.cik,
-            "currency_name": fundamentals.currency_name,
-            "description": fundamentals.description,
-            "homepage_url": fundamentals.homepage_url,
-            "list_date": fundamentals.list_date,
-            "locale": fundamentals.locale,
-            "market_cap": fundamentals.market_cap,
-            "name": fundamentals.name,
-            "primary_exchange": fundamentals.primary_exchange,
-            "share_class_shares_outstanding": fundamentals.share_class_shares_outstanding,
-            "sic_description": fundamentals.sic_description,
-            "ticker": fundamentals.ticker,
-            "total_employees": fundamentals.total_employees,
-            "weighted_shares_outstanding": fundamentals.weighted_shares_outstanding,
-        }
-
-        for key, value in relevant_info.items():
-            if key == "address":
-                for addr_key, addr_value in value.items():
-                    if addr_value is None:
-                        # logging.error(f"⚠️ WARNING: Missing {key}.{addr_key} for {ticker}")
-                        relevant_info[key][addr_key] = "not available"
-            elif value is None:
-                # logging.error(f"⚠️ WARNING: Missing {key} for {ticker}")
-                relevant_info[key] = "not available"
-
-        # fetch live price and historical data
-        snapshot = client.get_snapshot_ticker(
-            "stocks", ticker
-        )  # TODO: Prompt AI to use ETFs instead of indicies until expand this functionality. QQQ/SPY.
-        logging.info(f"Snapshot for {ticker}: {snapshot}")
+        bars = await get_daily_bars(ticker, client, history_start(end_date), end_date)
+    except Exception as e:
+        logging.error(f"Error fetching historical data for {ticker}: {str(e)}")
+        return {}
+
+    return compute_historical_changes(bars, end_date)
+
+
+async def fetch_profile(ticker: str, client: RESTClient):
+    fundamentals = await polygon_request(
+        "get_ticker_details", client.get_ticker_details, ticker
+    )
+
+    # extract all information except branding and phone
+    relevant_info = {
+        "address": {
+            "address1": (
+                fundamentals.address.address1 if fundamentals.address else None
+            ),
+            "address2": (
+                fundamentals.address.address2 if fundamentals.address else None
+            ),
+            "city": fundamentals.address.city if fundamentals.address else None,
+            "state": fundamentals.address.state if fundamentals.address else None,
+            "country": (
+                fundamentals.address.country if fundamentals.address else None
+            ),
+            "postal_code": (
+                fundamentals.address.postal_code if fundamentals.address else None
+            ),
+        },
+        "cik": fundamentals.cik,
+        "currency_name": fundamentals.currency_name,
+        "description": fundamentals.description,
+        "homepage_url": fundamentals.homepage_url,
+        "list_date": fundamentals.list_date,
+        "locale": fundamentals.locale,
+        "market_cap": fundamentals.market_cap,
+        "name": fundamentals.name,
+        "primary_exchange": fundamentals.primary_exchange,
+        "share_class_shares_outstanding": fundamentals.share_class_shares_outstanding,
+        "sic_description": fundamentals.sic_description,
+        "ticker": fundamentals.ticker,
+        "total_employees": fundamentals.total_employees,
+        "weighted_shares_outstanding": fundamentals.weighted_shares_outstanding,
+    }
+
+    for key, value in relevant_info.items():
+        if key == "address":
+            for addr_key, addr_value in value.items():
+                if addr_value is None:
+                    relevant_info[key][addr_key] = "not available"
+        elif value is None:
+            relevant_info[key] = "not available"
+
+    return relevant_info
+
+
+async def fetch_snapshot(ticker: str, client: RESTClient):
+    # most tickers are in the bulk snapshot, which costs no call of its own
+    try:
+        table = await get_market_snapshot(client)
+    except Exception as e:
+        logging.error(f"Error reading the bulk snapshot: {str(e)}")
+        table = None
+    if table is not None and ticker in table:
+        return table.get(ticker)
+
+    snapshot = await polygon_request(
+        "get_snapshot_ticker", client.get_snapshot_ticker, "stocks", ticker
+    )  # TODO: Prompt AI to use ETFs instead of indicies until expand this functionality. QQQ/SPY.
+    logging.info(f"Snapshot for {ticker}: {snapshot}")
+    if not snapshot:
+        return None
 
+    return {
         # round since number is approx due to 15 minute delay
-        live_price = round(snapshot.day.close) if snapshot and snapshot.day else None
-        historical_data = get_historical_data(ticker, client)
+        "live_price": round(snapshot.day.close) if snapshot.day else None,
+        "todays_change": snapshot.todays_change,
+        "todays_change_percent": snapshot.todays_change_percent,
+    }
 
-        # get fundamental financials information
-        financials = get_stock_financials(ticker, client)
 
-        revenue_eps_str = ""
+async def fetch_trailing_financials(ticker: str, client: RESTClient):
+    financials = await get_cached_financials(ticker, client)
+    if not financials:
+        return None
 
-        if (
-            len(financials["revenues"]) >= 4
-            and len(financials["basic_earnings_per_share"]) >= 4
-        ):
-            # sum last 4 quarters of revenue
-            trailing_revenue = sum(rev["value"] for rev in financials["revenues"][:4])
-            latest_revenue_date = financials["revenues"][0]["date"]
+    # sum last 4 quarters of revenue and EPS
+    revenue = financials.latest_position("revenues")
+    eps = financials.latest_position("basic_earnings_per_share")
+    if revenue is None or eps is None:
+        return None
+    trailing_revenue = financials.trailing("revenues")[revenue]
+    trailing_eps = financials.trailing("basic_earnings_per_share")[eps]
 
-            # sum last 4 quarters of EPS
-            trailing_eps = sum(
-                eps["value"] for eps in financials["basic_earnings_per_share"][:4]
-            )
-            latest_eps_date = financials["basic_earnings_per_share"][0]["date"]
+    return {
+        "trailing_revenue": trailing_revenue,
+        "latest_revenue_date": financials.dates[revenue],
+        "trailing_eps": trailing_eps,
+        "latest_eps_date": financials.dates[eps],
+    }
 
-            revenue_eps_str += f"Annual Revenue (Trailing 12 mo): ${trailing_revenue:,.2f} as of {latest_revenue_date}"
-            revenue_eps_str += f"\nAnnual EPS (Trailing 12 mo): ${trailing_eps:,.2f} as of {latest_eps_date}"
 
-        # add live price and historical data to relevant_info
-        relevant_info["live_price"] = live_price
-        relevant_info["todays_change"] = snapshot.todays_change if snapshot else None
-        relevant_info["todays_change_percent"] = (
-            snapshot.todays_change_percent if snapshot else None
-        )
-        relevant_info["historical_changes"] = historical_data
+def format_number(value, template: str):
+    if isinstance(value, (int, float)):
+        return template.format(value)
+    return "not available"
+
 
-        text_version = f"""
+def render_fundamentals_text(relevant_info: dict, trailing: dict):
+    revenue_eps_str = ""
+    if trailing:
+        revenue_eps_str += f"Annual Revenue (Trailing 12 mo): ${trailing['trailing_revenue']:,.2f} as of {trailing['latest_revenue_date']}"
+        revenue_eps_str += f"\nAnnual EPS (Trailing 12 mo): ${trailing['trailing_eps']:,.2f} as of {trailing['latest_eps_date']}"
+
+    text_version = f"""
 Company: {relevant_info['name']} ({relevant_info['ticker']})
 Description: {relevant_info['description']}
 Address: {relevant_info['address']['address1']}, {relevant_info['address']['city']}, {relevant_info['address']['state']} {relevant_info['address']['postal_code']}
 Website: {relevant_info['homepage_url']}
 List Date: {relevant_info['list_date']}
 Locale: {relevant_info['locale']}
-Market Cap: {f"${relevant_info['market_cap']:,.2f}" if isinstance(relevant_info['market_cap'], (int, float)) else 'not available'}
+Market Cap: {format_number(relevant_info['market_cap'], "${:,.2f}")}
 Primary Exchange: {relevant_info['primary_exchange']}
 Industry: {relevant_info['sic_description']}
-Total Employees: {f"{relevant_info['total_employees']:,}" if isinstance(relevant_info['total_employees'], (int, float)) else 'not available'}
-Share Class Shares Outstanding: {f"{relevant_info['share_class_shares_outstanding']:,}" if isinstance(relevant_info['share_class_shares_outstanding'], (int, float)) else 'not available'}
-Weighted Shares Outstanding: {f"{relevant_info['weighted_shares_outstanding']:,}" if isinstance(relevant_info['weighted_shares_outstanding'], (int, float)) else 'not available'}
+Total Employees: {format_number(relevant_info['total_employees'], "{:,}")}
+Share Class Shares Outstanding: {format_number(relevant_info['share_class_shares_outstanding'], "{:,}")}
+Weighted Shares Outstanding: {format_number(relevant_info['weighted_shares_outstanding'], "{:,}")}
 {revenue_eps_str}
 
-Live Price: about ${live_price:.3f} (delayed by 15 min, see live price on screen)
-Today's Change: ${relevant_info['todays_change']:.2f} ({relevant_info['todays_change_percent']:.2f}%) (delayed by 15 min, see live price on screen)
+Live Price: {format_number(relevant_info['live_price'], "about ${:.3f}")} (delayed by 15 min, see live price on screen)
+Today's Change: {format_number(relevant_info['todays_change'], "${:.2f}")} ({format_number(relevant_info['todays_change_percent'], "{:.2f}%")}) (delayed by 15 min, see live price on screen)
 
 Historical Changes:
 """
-        for period, data in historical_data.items():
-            text_version += f"Change in last {period} ({data['start_date']} to {data['end_date']}): {data['change']}%\n"
+    for period, data in relevant_info["historical_changes"].items():
+        text_version += f"Change in last {period} ({data['start_date']} to {data['end_date']}): {data['change']}%\n"
+
+    return text_version
+
+
+# fields left out of the fundamentals text when the stock context is over budget;
+# the widgets show these on screen and they rarely matter to the spoken answer
+COMPACT_OMITTED_FIELDS = {
+    "Address",
+    "Website",
+    "List Date",
+    "Locale",
+    "Share Class Shares Outstanding",
+    "Weighted Shares Outstanding",
+}
+COMPACT_DESCRIPTION_SENTENCES = 2
+
+
+def compact_fundamentals_text(text_version: str):
+    lines = []
+    for line in text_version.splitlines():
+        field, _, value = line.partition(": ")
+        if field in COMPACT_OMITTED_FIELDS:
+            continue
+        if field == "Description":
+            sentences = re.split(r"(?<=[.!?])\s+", value)
+            line = f"{field}: {' '.join(sentences[:COMPACT_DESCRIPTION_SENTENCES])}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+# cache layers behind get_stock_fundamentals: name -> (TTL, fetch(ticker, client))
+FUNDAMENTALS_LAYERS = {
+    "profile": (PROFILE_CACHE_TTL, fetch_profile),
+    "snapshot": (SNAPSHOT_CACHE_TTL, fetch_snapshot),
+    "history": (HISTORY_CACHE_TTL, get_historical_data),
+    "trailing_financials": (FINANCIALS_CACHE_TTL, fetch_trailing_financials),
+}
+
+
+def layer_key(layer: str, ticker: str):
+    return f"stock_{layer}_{ticker}"
+
+
+async def get_layer_entry(layer: str, ticker: str, client: RESTClient):
+    cache_duration, fetch = FUNDAMENTALS_LAYERS[layer]
+    with span(f"layer.{layer}"):
+        return await get_or_fetch_entry(
+            layer_key(layer, ticker),
+            cache_duration,
+            partial(fetch, ticker, client),
+            layer,
+        )
 
-        json_version = json.dumps(relevant_info, indent=2)
 
-        set_cached_data(cache_key_text, text_version, 1200)
-        set_cached_data(cache_key_json, json_version, 1200)
+async def get_stock_fundamentals(ticker: str, client: RESTClient):
+    # each layer is cached for as long as its data stays valid, so a refresh only
+    # re-fetches the layers that expired and both views are assembled on read
+    try:
+        with span("fundamentals"):
+            entries = await asyncio.gather(
+                *(
+                    get_layer_entry(layer, ticker, client)
+                    for layer in FUNDAMENTALS_LAYERS
+                )
+            )
+        entries = dict(zip(FUNDAMENTALS_LAYERS, entries))
+        profile = entries["profile"]["data"]
+        snapshot = entries["snapshot"]["data"]
+        trailing = entries["trailing_financials"]["data"]
 
-        return text_version, json_version
+        # add live price and historical data to relevant_info
+        relevant_info = dict(profile)
+        relevant_info["live_price"] = snapshot["live_price"] if snapshot else None
+        relevant_info["todays_change"] = snapshot["todays_change"] if snapshot else None
+        relevant_info["todays_change_percent"] = (
+            snapshot["todays_change_percent"] if snapshot else None
+        )
+        relevant_info["historical_changes"] = entries["history"]["data"] or {}
 
-    except Exception as e:
-        logging.error(f"Error fetching fundamental data for {ticker}: {str(e)}")
-        return f"Error: Unable to fetch fundamental data for {ticker}", "{}"
-
-
-def process_financials(financials):
-    data = {}
-    for item in financials:
-        date = item.end_date
-
-        # process balance sheet
-        if item.financials.balance_sheet:
-            for key, datapoint in item.financials.balance_sheet.items():
-                if key not in data:
-                    data[key] = []
-                data[key].append({"date": date, "value": datapoint.value})
-
-        # process income statement
-        if item.financials.income_statement:
-            for key, value in item.financials.income_statement.__dict__.items():
-                if hasattr(value, "value"):
-                    if key not in data:
-                        data[key] = []
-                    data[key].append({"date": date, "value": value.value})
-
-        # process cash flow statement
-        if (
-            item.financials.cash_flow_statement
-            and item.financials.cash_flow_statement.net_cash_flow
-        ):
-            if "net_cash_flow" not in data:
-                data["net_cash_flow"] = []
-            data["net_cash_flow"].append(
-                {
-                    "date": date,
-                    "value": item.financials.cash_flow_statement.net_cash_flow.value,
-                }
-            )
+        # layers may be served past their TTL while they refresh, so say how old they are
+        now = time.time()
+        relevant_info["data_age_seconds"] = {
+            layer: round(now - entry["fetched_at"]) for layer, entry in entries.items()
+        }
+        relevant_info["stale"] = any(
+            now - entries[layer]["fetched_at"] > cache_duration
+            for layer, (cache_duration, _) in FUNDAMENTALS_LAYERS.items()
+        )
 
-        if (
-            item.financials.cash_flow_statement
-            and item.financials.cash_flow_statement.net_cash_flow_from_financing_activities
-        ):
-            if "net_cash_flow_from_financing_activities" not in data:
-                data["net_cash_flow_from_financing_activities"] = []
-            data["net_cash_flow_from_financing_activities"].append(
-                {
-                    "date": date,
-                    "value": item.financials.cash_flow_statement.net_cash_flow_from_financing_activities.value,
-                }
-            )
+        # the structured view is returned as is; callers that send it on encode it once
+        text_version = render_fundamentals_text(relevant_info, trailing)
 
-    return data
+        return text_version, relevant_info
+
+    except Exception as e:
+        logging.error(f"Error fetching fundamental data for {ticker}: {str(e)}")
+        return f"Error: Unable to fetch fundamental data for {ticker}", {}
 
 
-def get_stock_financials(ticker: str, client: RESTClient):
+async def get_stock_financials(ticker: str, client: RESTClient):
     try:
-        # fetch fundamentals
-        financials = client.vx.list_stock_financials(ticker, timeframe="quarterly")
-        processed_financials = process_financials(financials)
+        # fetch fundamentals, only the filings newer than the store hit Polygon
+        filings = await get_quarterly_filings(ticker, client)
+        processed_financials = QuarterlyFinancials.from_filings(filings)
 
         return processed_financials
     except Exception as e:
         logging.error(f"Error fetching fundamental data for {ticker}: {str(e)}")
 
+
+async def fetch_financials(ticker: str, client: RESTClient):
+    financials = await get_stock_financials(ticker, client)
+    # cached in the columns' own binary form rather than as a dict per filing
+    return financials.to_bytes() if financials is not None else None
+
+
+async def get_cached_financials(ticker: str, client: RESTClient):
+    """Processed quarterly financials, shared by the TTM figures and the
+    spreadsheet widgets; None if they can't be fetched"""
+    raw = await get_or_fetch(
+        layer_key("financials", ticker),
+        FINANCIALS_CACHE_TTL,
+        partial(fetch_financials, ticker, client),
+        "financials",
+    )
+    return QuarterlyFinancials.from_bytes(raw) if raw else None
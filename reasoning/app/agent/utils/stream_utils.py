@@ -0,0 +1,201 @@
+import re
+import json
+import asyncio
+import logging
+
+from .json_utils import validate_widget
+
+# a sentence ends at . ! or ? followed by whitespace; shorter pieces are merged so
+# text-to-speech isn't started on fragments like "Sure."
+SENTENCE_END = re.compile(r"[.!?]['\")\]]*\s$")
+MIN_SENTENCE_LENGTH = 20
+
+# periods that usually don't end a sentence, e.g. "U.S." or "Apple Inc."
+ABBREVIATION = re.compile(
+    r"(?:\b(?:[A-Za-z]\.)+|\b(?:Inc|Corp|Co|Ltd|Mr|Mrs|Ms|Dr|Jr|Sr|St|vs|etc)\.)\s$"
+)
+
+ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class BufferedStream:
+    """Reads a stream of text chunks in the background and keeps them, so a
+    reader that starts late gets what has come so far and then the rest as it
+    arrives. `task` is the reading task, to track or cancel.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self.read(chunks))
+
+    async def read(self, chunks):
+        try:
+            async for chunk in chunks:
+                self.chunks.append(chunk)
+                self.changed.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self.changed.set()
+
+    async def wait_started(self):
+        """Wait for the first chunk or the end; False if nothing came but an error"""
+        while not self.chunks and not self.done:
+            self.changed.clear()
+            await self.changed.wait()
+        return bool(self.chunks) or self.error is None
+
+    async def replay(self):
+        position = 0
+        while True:
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                # keep what came, like an interrupted stream; the JSON repair
+                # step closes a truncated output
+                if self.error is not None:
+                    logging.error(f"Buffered stream interrupted: {str(self.error)}")
+                return
+            self.changed.clear()
+            await self.changed.wait()
+
+
+class ResponseStreamParser:
+    """Incrementally parses the main agent's JSON output as it streams in.
+
+    `feed` returns ("widget", dict) events as soon as each object in the
+    top-level "widgets" array closes, for the widgets that pass validation,
+    and ("response", str) events for every complete sentence of the top-level
+    "response" string.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.depth = 0
+        self.in_string = False
+        self.escape = None  # None, "" after a backslash, or the \u digits so far
+        self.string_start = 0
+        self.string_is_key = False
+        self.expect_key = False
+        self.last_key = None
+        self.top_key = None
+        self.widgets_array = False
+        self.widget_start = None
+        self.in_response = False
+        self.sentence = ""
+
+    def feed(self, chunk: str):
+        events = []
+        offset = len(self.text)
+        self.text += chunk
+        for index, char in enumerate(chunk, offset):
+            if self.in_string:
+                self.feed_string_char(char, index, events)
+            else:
+                self.feed_structure_char(char, index, events)
+        return events
+
+    def finish(self):
+        """Flush any response text that did not end with a sentence boundary"""
+        events = []
+        self.flush_sentence(events)
+        return events
+
+    def feed_structure_char(self, char: str, index: int, events: list):
+        if char == '"':
+            self.in_string = True
+            self.string_start = index
+            self.string_is_key = self.depth == 1 and self.expect_key
+            self.in_response = (
+                self.depth == 1 and not self.string_is_key and self.top_key == "response"
+            )
+        elif char in "{[":
+            self.depth += 1
+            if self.depth == 1:
+                self.expect_key = True
+            elif self.depth == 2 and self.top_key == "widgets":
+                self.widgets_array = char == "["
+            elif self.depth == 3 and self.widgets_array and char == "{":
+                self.widget_start = index
+        elif char in "}]":
+            if self.depth == 3 and self.widget_start is not None and char == "}":
+                self.emit_widget(self.text[self.widget_start : index + 1], events)
+                self.widget_start = None
+            self.depth -= 1
+        elif self.depth == 1 and char == ":":
+            self.expect_key = False
+            self.top_key = self.last_key
+        elif self.depth == 1 and char == ",":
+            self.expect_key = True
+
+    def feed_string_char(self, char: str, index: int, events: list):
+        if self.escape is not None:
+            self.feed_escape_char(char, events)
+        elif char == "\\":
+            self.escape = ""
+        elif char == '"':
+            self.in_string = False
+            if self.string_is_key:
+                self.last_key = json.loads(self.text[self.string_start : index + 1])
+            elif self.in_response:
+                self.in_response = False
+                self.flush_sentence(events)
+        elif self.in_response:
+            self.add_response_text(char, events)
+
+    def feed_escape_char(self, char: str, events: list):
+        if self.escape == "" and char != "u":
+            self.escape = None
+            if self.in_response:
+                self.add_response_text(ESCAPES.get(char, char), events)
+            return
+
+        self.escape += char
+        if len(self.escape) == 5:  # "u" and four hex digits
+            digits, self.escape = self.escape[1:], None
+            if self.in_response:
+                try:
+                    self.add_response_text(chr(int(digits, 16)), events)
+                except ValueError:
+                    pass
+
+    def add_response_text(self, text: str, events: list):
+        self.sentence += text
+        if (
+            len(self.sentence) >= MIN_SENTENCE_LENGTH
+            and SENTENCE_END.search(self.sentence)
+            and not ABBREVIATION.search(self.sentence)
+        ):
+            self.flush_sentence(events)
+
+    def flush_sentence(self, events: list):
+        sentence = self.sentence.strip()
+        self.sentence = ""
+        if sentence:
+            events.append(("response", sentence))
+
+    def emit_widget(self, text: str, events: list):
+        try:
+            widget = validate_widget(json.loads(text))
+        except json.JSONDecodeError as e:
+            logging.error(f"Could not parse streamed widget {text}: {str(e)}")
+            return
+        # an unusable widget is left to the validation of the whole response
+        if widget is None:
+            logging.warning(f"Skipping invalid streamed widget {text}")
+            return
+        events.append(("widget", widget))
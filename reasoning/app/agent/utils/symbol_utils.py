@@ -0,0 +1,219 @@
+import os
+import re
+import csv
+import logging
+
+# ticker list with the names people use for each company; an alias starting with
+# "~" is also an ordinary word, so hearing it is left for the LLM to interpret
+SYMBOL_LIST_PATH = os.getenv(
+    "SYMBOL_LIST_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "data", "tickers.csv"),
+)
+
+TOKEN_PATTERN = re.compile(r"\$?[A-Za-z0-9][A-Za-z0-9.&'’\-]*")
+
+# words that point back at earlier turns, which only the LLM can resolve
+REFERENCE_WORDS = {
+    "it",
+    "its",
+    "they",
+    "them",
+    "their",
+    "that",
+    "those",
+    "these",
+    "both",
+    "same",
+    "other",
+    "others",
+    "former",
+    "latter",
+}
+
+# words that set one stock against another; with fewer than two stocks named the
+# other one is usually from an earlier turn ("compare with Microsoft"), which only
+# the LLM can resolve
+COMPARISON_WORDS = {
+    "against",
+    "between",
+    "compare",
+    "compared",
+    "comparing",
+    "comparison",
+    "relative",
+    "versus",
+    "vs",
+    "with",
+}
+
+# upper-case words that are not tickers in speech-to-text output
+COMMON_UPPERCASE_WORDS = {
+    "AI",
+    "AM",
+    "AN",
+    "AND",
+    "AT",
+    "BE",
+    "BY",
+    "CEO",
+    "CFO",
+    "DCF",
+    "EPS",
+    "ETF",
+    "GDP",
+    "GO",
+    "IPO",
+    "IS",
+    "IT",
+    "ME",
+    "MY",
+    "NOW",
+    "OF",
+    "OK",
+    "ON",
+    "OR",
+    "PE",
+    "SO",
+    "THE",
+    "TO",
+    "TTM",
+    "UP",
+    "US",
+    "USA",
+    "USD",
+    "WE",
+    "YOY",
+}
+
+# words a stock question is made of besides its subjects. Every other word of an
+# utterance must be a known company or ticker for it to skip the LLM, so "Amazon
+# and Etsy" or "gold and Apple" aren't answered for only the subject we know
+QUESTION_WORDS = set(
+    """
+a about after against all also am an and any are as at be been before
+between but by can could current currently did do does doing done for from
+get give had has have hello hey hi how i i'd i'm in inc is just latest let
+like look looking looks me more much my of on one or over please right see
+should show so some tell than thanks the then there to today too up
+us versus vs want was we what when which who whose why will with
+would you your
+""".split()
+)
+# what is asked about a stock
+STOCK_TERMS = set(
+    """
+analysis balance cash cap capitalization change chart charts company
+companies compare comparison day days details dividend dividends down
+earnings eps financial financials flow graph growth history income info
+information last market month months movement news overview past per
+performance performing price prices profile quote ratio revenue sales share
+shares sheet stock stocks statement ticker trading trend value week weeks
+year years ytd
+""".split()
+)
+STOP_WORDS = (
+    QUESTION_WORDS
+    | STOCK_TERMS
+    | COMPARISON_WORDS
+    | {word.lower() for word in COMMON_UPPERCASE_WORDS}
+)
+
+MATCH_END = object()
+
+
+def normalize_utterance(text: str):
+    return " ".join(token.lower() for token in tokenize(text))
+
+
+def tokenize(text: str):
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text):
+        token = token.rstrip(".-")
+        for suffix in ("'s", "’s"):
+            if token.lower().endswith(suffix):
+                token = token[: -len(suffix)]
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+class SymbolMatcher:
+    """Finds unambiguous company names and ticker symbols in an utterance.
+
+    Aliases are stored in a word-level trie so every mention is found in one
+    left-to-right pass, preferring the longest alias at each position.
+    """
+
+    def __init__(self, entries):
+        self.symbols = set()
+        self.trie = {}
+        for symbol, aliases in entries:
+            self.symbols.add(symbol)
+            for alias in aliases:
+                ambiguous = alias.startswith("~")
+                node = self.trie
+                for token in tokenize(alias.lstrip("~").lower()):
+                    node = node.setdefault(token, {})
+                node[MATCH_END] = (symbol, ambiguous)
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        return cls(
+            (row["symbol"].strip(), row["aliases"].split("|")) for row in rows
+        )
+
+    def longest_alias(self, tokens, start: int):
+        node, match, end = self.trie, None, start
+        for index in range(start, len(tokens)):
+            node = node.get(tokens[index])
+            if node is None:
+                break
+            if MATCH_END in node:
+                match, end = node[MATCH_END], index + 1
+        return match, end
+
+    def match(self, text: str):
+        """Symbols mentioned in `text`, or None when the LLM has to decide.
+
+        Only utterances made entirely of known companies, tickers and stop words
+        are resolved here; any other word may name a subject the LLM would find.
+        """
+        raw_tokens = tokenize(text)
+        tokens = [token.lower() for token in raw_tokens]
+        if REFERENCE_WORDS.intersection(tokens):
+            return None
+
+        found = []
+        index = 0
+        while index < len(tokens):
+            match, end = self.longest_alias(tokens, index)
+            if match:
+                symbol, ambiguous = match
+                if ambiguous:
+                    return None
+                found.append(symbol)
+                index = end
+                continue
+
+            raw = raw_tokens[index].lstrip("$")
+            if raw.isupper() and len(raw) >= 2 and raw in self.symbols:
+                found.append(raw)
+            elif tokens[index] not in STOP_WORDS and not raw.isdigit():
+                # an unknown ticker, company or other subject
+                return None
+            index += 1
+
+        found = list(dict.fromkeys(found))
+        if len(found) < 2 and COMPARISON_WORDS.intersection(tokens):
+            return None
+        return found or None
+
+
+def load_symbol_matcher():
+    try:
+        return SymbolMatcher.from_file(SYMBOL_LIST_PATH)
+    except Exception as e:
+        logging.error(f"Error loading symbol list {SYMBOL_LIST_PATH}: {str(e)}")
+        return SymbolMatcher([])
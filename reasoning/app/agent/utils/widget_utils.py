@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from typing import List
+from polygon import RESTClient
+
+from .stock_utils import get_cached_financials
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s:%(message)s")
+
+
+class WidgetHydrator:
+    """Fills in the data of widgets the frontend can't fetch by itself.
+
+    A showSpreadsheet widget gets the series of its metric. Hydration starts as
+    soon as a widget is added, and each symbol's financials are fetched once per
+    turn however many spreadsheets ask for them.
+    """
+
+    def __init__(self, client: RESTClient):
+        self.client = client
+        self.fetches = {}  # symbol -> task fetching its financials
+        self.pending = {}  # id(widget) -> task filling in its data
+
+    def add(self, widget: dict):
+        if widget.get("type") != "showSpreadsheet":
+            return
+        symbol = widget.get("parameters", {}).get("symbol")
+        if not symbol:
+            widget["data"] = []
+            return
+        if symbol not in self.fetches:
+            self.fetches[symbol] = asyncio.ensure_future(
+                get_cached_financials(symbol, self.client)
+            )
+        self.pending[id(widget)] = asyncio.ensure_future(
+            self.fill(widget, self.fetches[symbol])
+        )
+
+    async def fill(self, widget: dict, fetch: asyncio.Future):
+        metric = widget.get("parameters", {}).get("metric")
+        try:
+            financials = await fetch
+        except Exception as e:
+            logging.error(f"Error hydrating {widget}: {str(e)}")
+            financials = None
+        # the frontend maps over the data, so a missing metric is an empty table
+        widget["data"] = financials.series(metric) if financials else []
+
+    def ready(self, widgets: List[dict]):
+        """The widgets whose data is in, in their original order"""
+        return [
+            widget
+            for widget in widgets
+            if id(widget) not in self.pending or self.pending[id(widget)].done()
+        ]
+
+    async def wait(self):
+        await asyncio.gather(*self.pending.values())
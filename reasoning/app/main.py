@@ -1,8 +1,29 @@
-from xrx_agent_framework.xrx_agent_framework import xrx_reasoning, initialize_async_llm_client
-from agent.executor import run_agent
+import asyncio
 
-# The rest of the code remains the same
-llm_client = initialize_async_llm_client()
+from xrx_agent_framework.xrx_agent_framework import xrx_reasoning
+from agent.executor import run_agent, polygon_client
+from agent.metrics import metrics
+from agent.utils.prewarm_utils import run_prewarmer
 
 
 app = xrx_reasoning(run_agent=run_agent)()
+
+background_tasks = set()
+
+
+async def start_prewarmer():
+    task = asyncio.create_task(run_prewarmer(polygon_client))
+    background_tasks.add(task)
+
+
+async def stop_prewarmer():
+    # lets the prewarmer hand its leader key over instead of holding it until it
+    # expires
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+
+app.add_event_handler("startup", start_prewarmer)
+app.add_event_handler("shutdown", stop_prewarmer)
+app.add_route("/metrics", metrics)
@@ -0,0 +1,70 @@
+"""Compare cold fetch, warm fetch and incremental refresh of the daily-bar store
+against the fake Polygon client.
+
+    python bar_store_benchmark.py --tickers 20 --stale-days 30
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from fakes import FakePolygonClient, setup_reasoning_path
+
+setup_reasoning_path()
+os.environ["BAR_STORE_DIR"] = tempfile.mkdtemp(prefix="bar-store-bench-")
+
+from agent.utils import bar_store, polygon_utils  # noqa: E402
+from agent.utils.bar_utils import history_start  # noqa: E402
+
+# unlimited, so the numbers measure the store rather than the Polygon plan
+polygon_utils.POLYGON_CALLS_PER_MINUTE = 0
+
+
+def truncate(ticker: str, days: int):
+    """Drop the newest bars of a stored ticker, as if it was last refreshed days ago"""
+    bars = bar_store.load_bars(ticker)
+    keep = max(0, len(bars) - days * 5 // 7)
+    with open(bar_store.bar_path(ticker), "r+b") as f:
+        f.truncate(keep * bar_store.RECORD.size)
+
+
+async def timed_fetch(tickers, client):
+    end = datetime.now()
+    start = time.perf_counter()
+    for ticker in tickers:
+        await bar_store.get_daily_bars(ticker, client, history_start(end), end)
+    return (time.perf_counter() - start) / len(tickers)
+
+
+async def run(args):
+    tickers = [f"T{i:03d}" for i in range(args.tickers)]
+    client = FakePolygonClient(latency=args.latency, bar_latency=args.bar_latency)
+
+    results = {}
+    results["cold"] = await timed_fetch(tickers, client)
+    results["warm"] = await timed_fetch(tickers, client)
+    for ticker in tickers:
+        truncate(ticker, args.stale_days)
+    results[f"incremental ({args.stale_days}d stale)"] = await timed_fetch(
+        tickers, client
+    )
+
+    for name, seconds in results.items():
+        print(f"{name:>24}: {seconds * 1000:8.2f} ms per ticker")
+    print(f"{'get_aggs calls':>24}: {client.calls['get_aggs']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, default=20)
+    parser.add_argument("--stale-days", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.03)
+    parser.add_argument("--bar-latency", type=float, default=0.0002)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from fakes import FakePolygonClient, setup_reasoning_path
+
+setup_reasoning_path()
+
+from agent.utils import bar_store  # noqa: E402
+from agent.utils.bar_utils import history_start  # noqa: E402
+
+
+class TestBarStore(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        bar_store.BAR_STORE_DIR = tempfile.mkdtemp(prefix="bar-store-test-")
+        bar_store.ticker_locks.clear()
+        self.end = datetime.now()
+        self.start = history_start(self.end)
+
+    async def test_refresh_only_asks_for_new_bars(self):
+        client = FakePolygonClient(latency=0)
+        first = await bar_store.get_daily_bars("AAPL", client, self.start, self.end)
+        second = await bar_store.get_daily_bars("AAPL", client, self.start, self.end)
+
+        self.assertEqual(second.timestamps, first.timestamps)
+        _, refresh_from, _ = client.aggs_requests[-1]
+        self.assertGreater(refresh_from, self.end - timedelta(days=5))
+
+    async def test_ticker_listed_inside_the_window_is_refreshed_incrementally(self):
+        listed = datetime(self.end.year, self.end.month, self.end.day) - timedelta(days=90)
+        client = FakePolygonClient(latency=0, listings={"NEWCO": listed})
+        first = await bar_store.get_daily_bars("NEWCO", client, self.start, self.end)
+        self.assertGreaterEqual(first.timestamps[0], int(listed.timestamp() * 1000))
+
+        # a later call, with the window moved on, still trusts the store
+        later_start = self.start + timedelta(days=1)
+        second = await bar_store.get_daily_bars("NEWCO", client, later_start, self.end)
+
+        self.assertEqual(second.timestamps, first.timestamps)
+        _, refresh_from, _ = client.aggs_requests[-1]
+        self.assertGreater(refresh_from, self.end - timedelta(days=5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Microbenchmark of the three stock cache read paths: in-process L1 hit,
+Redis hit and Polygon miss.
+
+    python cache_benchmark.py --iterations 2000 --redis-latency 0.0005
+"""
+
+import argparse
+import asyncio
+import time
+
+from fakes import FakePolygonClient, FakeRedis, setup_reasoning_path
+
+setup_reasoning_path()
+
+from agent.utils import cache_utils, polygon_utils  # noqa: E402
+from agent.utils import stock_utils  # noqa: E402
+
+# unlimited, so the numbers measure the cache rather than the Polygon plan
+polygon_utils.POLYGON_CALLS_PER_MINUTE = 0
+
+
+async def timed(label, iterations, func):
+    start = time.perf_counter()
+    for i in range(iterations):
+        await func(i)
+    elapsed = (time.perf_counter() - start) / iterations
+    print(f"{label:>12}: {elapsed * 1e6:10.1f} us per read")
+
+
+async def run(args):
+    cache_utils.redis_client = FakeRedis(latency=args.redis_latency)
+    client = FakePolygonClient(latency=args.polygon_latency)
+    profile = await stock_utils.fetch_profile("AAPL", client)
+    await cache_utils.set_cached_data("bench_profile", profile, 3600)
+
+    await timed(
+        "L1 hit",
+        args.iterations,
+        lambda i: cache_utils.get_cached_data("bench_profile"),
+    )
+
+    async def redis_hit(i):
+        cache_utils.local_cache.clear()
+        await cache_utils.get_cached_data("bench_profile")
+
+    await timed("Redis hit", args.iterations, redis_hit)
+
+    await timed(
+        "Polygon miss",
+        max(1, args.iterations // 100),
+        lambda i: cache_utils.get_or_fetch(
+            f"bench_miss_{i}", 3600, lambda: stock_utils.fetch_profile("AAPL", client)
+        ),
+    )
+    print(f"L1 stats: {cache_utils.local_cache.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--redis-latency", type=float, default=0.0005)
+    parser.add_argument("--polygon-latency", type=float, default=0.05)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,172 @@
-import requests
+import asyncio
 import json
-import uuid
-import time
-from termcolor import colored
-from rich import print as rprint
-import threading
-
-# Define the URLs
-run_url = "http://127.0.0.1:8003/run-reasoning-agent"
-cancel_url = "http://127.0.0.1:8003/cancel-reasoning-agent/"
-
-# Define the headers
-headers = {
-    "Content-Type": "application/json",
-    "Accept": "text/event-stream",
-}
-
-# Single turn test
-body = {
-    'session': {
-        'id': 1234,
-    },
-    'messages': [
-        {
-            "role": "user",
-            "content": "how much is a medium pizza?"
-        },
-    ]
-}
-
-def cancel_request(task_id):
-    time.sleep(2)
-    rprint(f"Canceling request with task ID: {task_id}")
-    cancel_response = requests.post(cancel_url + task_id)
-    rprint(f"Cancel response: {cancel_response.json()}")
-
-# Send the POST request
-response = requests.post(run_url, headers=headers, data=json.dumps(body), stream=True)
-
-try:
-    # Get the task ID from the response headers
-    task_id = response.headers.get('X-Task-ID')
-    if task_id:
-        # Start a thread to cancel the request after 2 seconds
-        threading.Thread(target=cancel_request, args=(task_id,)).start()
-
-    # Stream the response
-    for line in response.iter_lines(decode_unicode=True):
-        if line.startswith('data: '):
-            rprint('\n\n-----------------')
-            data = json.loads(line[6:])
-            rprint(data)
-except KeyboardInterrupt:
-    print("\nScript interrupted by user")
-finally:
-    response.close()
-    print("Connection closed")
+import math
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from fakes import FakeAsyncLLMClient, FakePolygonClient, FakeRedis, setup_reasoning_path
+
+setup_reasoning_path()
+os.environ.setdefault("BAR_STORE_DIR", tempfile.mkdtemp(prefix="cancel-bars-"))
+os.environ.setdefault(
+    "FINANCIALS_STORE_DIR", tempfile.mkdtemp(prefix="cancel-financials-")
+)
+
+from agent import executor  # noqa: E402
+from agent.utils import cache_utils, cancel_utils, polygon_utils  # noqa: E402
+
+
+class TestCancellation(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        cache_utils.redis_client = self.redis
+        cache_utils.local_cache.clear()
+        cache_utils.invalidation_listener = None
+        cache_utils.in_flight.clear()
+        cancel_utils.cancel_listener = None
+        cancel_utils.keyspace_events = False
+        cancel_utils.tokens.clear()
+        self.llm = FakeAsyncLLMClient(latency=0.05, chunk_latency=0.02)
+        self.polygon = FakePolygonClient(latency=0.01)
+        executor.client = self.llm
+        executor.polygon_client = self.polygon
+
+    async def asyncTearDown(self):
+        cancel_utils.cancel_listener.cancel()
+
+    async def run_turn(self, question: str, task_id: str, cancel_after=None, cancel=None):
+        """Outputs of a turn, cancelling it after `cancel_after` outputs or seconds"""
+        outputs = []
+
+        async def consume():
+            async for output in executor.run_agent(
+                {
+                    "messages": [{"role": "user", "content": question}],
+                    "session": {"guid": task_id},
+                    "task_id": task_id,
+                }
+            ):
+                outputs.append(json.loads(output))
+                if len(outputs) == cancel_after:
+                    await cancel(task_id)
+
+        with self.assertLogs(level="INFO") as logs:
+            turn = asyncio.ensure_future(consume())
+            if isinstance(cancel_after, float):
+                await asyncio.sleep(cancel_after)
+                await cancel(task_id)
+            await asyncio.wait_for(turn, 5)
+
+        timings = [
+            json.loads(line.split("Turn timings: ", 1)[1])
+            for line in logs.output
+            if "Turn timings: " in line
+        ]
+        return outputs, timings[-1]
+
+    async def mark_cancelled(self, task_id: str):
+        # what the cancel endpoint does
+        await self.redis.set(f"task-{task_id}", "cancelled")
+
+    async def publish_cancel(self, task_id: str):
+        await self.redis.publish(cancel_utils.CANCEL_CHANNEL, task_id)
+
+    def full_response_chunks(self, symbol: str):
+        response = json.dumps(
+            {
+                "widgets": [{"type": "showStockPrice", "parameters": {"symbol": symbol}}],
+                "response": f"Here is what I found for {symbol}.",
+            }
+        )
+        return math.ceil(len(response) / 8)
+
+    async def test_cancel_mid_stream_stops_generation(self):
+        # a server with keyspace notifications on pushes the SET to the listener
+        self.redis = FakeRedis(keyspace_events="K$")
+        cache_utils.redis_client = self.redis
+        outputs, timings = await self.run_turn(
+            "What is the price of AAPL?", "mid-stream", 1, self.mark_cancelled
+        )
+
+        self.assertEqual(len(outputs), 1)
+        self.assertEqual(outputs[0]["node"], "Widget")
+        self.assertEqual(timings["cancel"]["streams_aborted"], 1)
+        self.assertEqual(timings["cancel"]["stages_skipped"], ["response", "widgets"])
+        self.assertLess(self.llm.chunks_streamed, self.full_response_chunks("AAPL"))
+        self.assertTrue(cancel_utils.keyspace_events)
+
+    async def test_cancel_without_keyspace_events_is_polled(self):
+        # keyspace notifications off, or CONFIG denied so they can't be seen
+        for redis in (FakeRedis(), FakeRedis(config_denied=True)):
+            with self.subTest(config_denied=redis.config_denied):
+                self.redis = redis
+                cache_utils.redis_client = redis
+                cancel_utils.cancel_listener = None
+                self.llm.chunks_streamed = 0
+                with mock.patch.object(cancel_utils, "CANCEL_POLL_CHUNKS", 2):
+                    outputs, timings = await self.run_turn(
+                        "What is the price of AAPL?", "polled", 1, self.mark_cancelled
+                    )
+                cancel_utils.cancel_listener.cancel()
+
+                self.assertFalse(cancel_utils.keyspace_events)
+                # the server's config is left as it was
+                self.assertEqual(redis.config["notify-keyspace-events"], "")
+                self.assertEqual([output["node"] for output in outputs], ["Widget"])
+                self.assertEqual(timings["cancel"]["streams_aborted"], 1)
+                self.assertLess(
+                    self.llm.chunks_streamed, self.full_response_chunks("AAPL")
+                )
+
+    async def test_cancel_during_fetch_skips_the_llm(self):
+        self.polygon.latency = 0.5
+        outputs, timings = await self.run_turn(
+            "What is the price of AAPL?", "during-fetch", 0.1, self.publish_cancel
+        )
+
+        self.assertEqual(outputs, [])
+        self.assertEqual(self.llm.calls, 0)
+        self.assertEqual(timings["cancel"]["tasks_cancelled"], {"polygon_fetch": 1})
+        self.assertEqual(
+            timings["cancel"]["stages_skipped"], ["context", "response", "widgets"]
+        )
+
+    async def test_cancel_during_a_cache_miss_stops_its_polygon_requests(self):
+        # the profile request fails and is retried 0.3s later, after the cancel
+        self.polygon.failures["get_ticker_details"] = [503]
+        with mock.patch.multiple(
+            polygon_utils, POLYGON_RETRY_BASE=0.3, POLYGON_CALLS_PER_MINUTE=0
+        ), mock.patch.object(polygon_utils.random, "uniform", lambda low, high: high):
+            await self.run_turn(
+                "What is the price of AAPL?", "during-miss", 0.1, self.publish_cancel
+            )
+            await asyncio.sleep(0.5)
+
+        self.assertEqual(self.polygon.calls["get_ticker_details"], 1)
+        self.assertEqual(cache_utils.in_flight, {})
+
+    async def test_cancel_during_symbol_extraction(self):
+        self.llm.latency = 0.5
+        outputs, timings = await self.run_turn(
+            "Tell me about the company that makes the iPhone",
+            "during-extraction",
+            0.1,
+            self.mark_cancelled,
+        )
+
+        self.assertEqual(outputs, [])
+        self.assertEqual(self.llm.calls, 1)
+        self.assertEqual(timings["cancel"]["tasks_cancelled"], {"llm_call": 1})
+
+    async def test_task_cancelled_before_it_starts_does_nothing(self):
+        await self.mark_cancelled("early")
+        outputs, timings = await self.run_turn("What is the price of AAPL?", "early")
+
+        self.assertEqual(outputs, [])
+        self.assertEqual(self.llm.calls + sum(self.polygon.calls.values()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
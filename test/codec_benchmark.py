@@ -0,0 +1,83 @@
+"""Compare pickle with the cache codec's formats and compressions on the values
+the stock cache holds: encode and decode time and stored size.
+
+Formats and compressions whose library isn't installed are skipped.
+
+    python codec_benchmark.py --iterations 500 --years 30
+"""
+
+import argparse
+import asyncio
+import pickle
+import random
+import time
+
+from fakes import FakePolygonClient, FakeRedis, setup_reasoning_path
+
+setup_reasoning_path()
+
+from agent.utils import cache_utils, codec_utils  # noqa: E402
+from agent.utils import stock_utils  # noqa: E402
+
+
+def envelope(data):
+    return {"fetched_at": time.time(), "data": data}
+
+
+async def payloads(years: int):
+    cache_utils.redis_client = FakeRedis(latency=0)
+    client = FakePolygonClient(latency=0, years_of_filings=years)
+    _, fundamentals = await stock_utils.get_stock_fundamentals("AAPL", client)
+    financials = await stock_utils.get_stock_financials("AAPL", client)
+    start, day = 1262304000000, 24 * 60 * 60 * 1000
+    bars = {
+        "timestamps": [start + i * day for i in range(years * 252)],
+        "closes": [round(random.uniform(50, 250), 2) for _ in range(years * 252)],
+    }
+    return {
+        "fundamentals": envelope(fundamentals),
+        "financials": envelope(financials.to_bytes()),
+        "bars": envelope(bars),
+    }
+
+
+def timed(iterations, func):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = func()
+    return (time.perf_counter() - start) / iterations * 1e6, result
+
+
+def report(label, iterations, encode, decode):
+    encode_us, raw = timed(iterations, encode)
+    decode_us, _ = timed(iterations, lambda: decode(raw))
+    print(f"  {label:>16}: {encode_us:8.1f} us encode {decode_us:8.1f} us decode {len(raw):8d} bytes")
+
+
+def run(args):
+    codec_utils.CACHE_COMPRESS_MIN_BYTES = 0
+    json_library = "orjson" if codec_utils.orjson is not None else "stdlib json"
+    print(f"json format uses {json_library}")
+
+    for name, value in asyncio.run(payloads(args.years)).items():
+        print(name)
+        report("pickle", args.iterations, lambda: pickle.dumps(value), pickle.loads)
+        for codec in codec_utils.FORMATS:
+            for compression in codec_utils.COMPRESSIONS:
+                report(
+                    f"{codec}+{compression}",
+                    args.iterations,
+                    lambda: codec_utils.encode_value(value, codec, compression),
+                    codec_utils.decode_value,
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--years", type=int, default=30)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import pickle
+import unittest
+
+from fakes import FakeRedis, setup_reasoning_path
+
+setup_reasoning_path()
+
+from agent.utils import cache_utils, codec_utils  # noqa: E402
+from agent.utils.codec_utils import decode_value, encode_value  # noqa: E402
+
+ENTRY = {
+    "fetched_at": 1700000000.5,
+    "data": {"ticker": "AAPL", "live_price": 189.25, "tags": ("a", "b"), "logo": None},
+}
+
+
+class TestCacheCodec(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        cache_utils.redis_client = FakeRedis()
+        cache_utils.local_cache.clear()
+        cache_utils.invalidation_listener = None
+
+    def test_round_trip_in_every_available_format(self):
+        value = {"fetched_at": 1.0, "data": [b"\x00QFIN1", {"nested": b"raw"}, b""]}
+        for codec in codec_utils.FORMATS:
+            for compression in codec_utils.COMPRESSIONS:
+                raw = encode_value(value, codec, compression)
+                self.assertEqual(decode_value(raw), value, (codec, compression))
+
+    def test_tuples_come_back_as_lists(self):
+        decoded = decode_value(encode_value(ENTRY))
+        self.assertEqual(decoded["data"]["tags"], ["a", "b"])
+
+    def test_small_values_are_not_compressed(self):
+        raw = encode_value(ENTRY, "json", "zlib")
+        self.assertEqual(raw[3], codec_utils.COMPRESSION_IDS["none"])
+
+    def test_foreign_values_are_rejected(self):
+        with self.assertRaises(ValueError):
+            decode_value(pickle.dumps(ENTRY))
+
+    async def test_pickled_redis_value_is_a_miss(self):
+        await cache_utils.redis_client.set("stock_profile_AAPL", pickle.dumps(ENTRY))
+        self.assertIsNone(await cache_utils.get_cached_data("stock_profile_AAPL"))
+
+    async def test_redis_round_trip(self):
+        await cache_utils.set_cached_data("stock_profile_AAPL", ENTRY, 60)
+        cache_utils.local_cache.clear()
+        entry = await cache_utils.get_cached_data("stock_profile_AAPL")
+        self.assertEqual(entry["data"]["live_price"], 189.25)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""Drive N simultaneous sessions through the reasoning agent against stubbed
+LLM, Polygon and Redis backends and report turn latency.
+
+"before" emulates the old synchronous pipeline (LLM and Polygon calls block the
+event loop), "after" runs the async pipeline as shipped.
+
+    python concurrency_benchmark.py --sessions 20 --turns 3
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+from fakes import (
+    FakeAsyncLLMClient,
+    FakePolygonClient,
+    FakeRedis,
+    percentile,
+    setup_reasoning_path,
+)
+
+setup_reasoning_path()
+
+from agent import executor  # noqa: E402
+from agent.utils import (  # noqa: E402
+    bar_store,
+    cache_utils,
+    cancel_utils,
+    financials_store,
+    polygon_utils,
+    snapshot_utils,
+)
+
+# unlimited, so the numbers measure the service rather than the Polygon plan
+polygon_utils.POLYGON_CALLS_PER_MINUTE = 0
+
+PROMPTS = [
+    "What is the price of AAPL?",
+    "Compare MSFT and GOOGL",
+    "Show me NVDA news",
+]
+
+_to_thread = asyncio.to_thread
+
+
+async def _inline(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+async def run_session(session_id: int, turns: int, latencies: list):
+    messages = []
+    for turn in range(turns):
+        messages.append({"role": "user", "content": PROMPTS[turn % len(PROMPTS)]})
+        start = time.perf_counter()
+        async for _ in executor.run_agent(
+            {
+                "messages": list(messages),
+                "session": {"guid": f"bench-{session_id}"},
+                "task_id": f"bench-{session_id}-{turn}",
+            }
+        ):
+            pass
+        latencies.append(time.perf_counter() - start)
+
+
+def reset_state():
+    """Start a mode from cold stores and caches, so it doesn't benefit from the
+    data the previous mode fetched"""
+    bar_store.BAR_STORE_DIR = tempfile.mkdtemp(prefix="concurrency-bench-bars-")
+    financials_store.FINANCIALS_STORE_DIR = tempfile.mkdtemp(
+        prefix="concurrency-bench-financials-"
+    )
+    # the locks belong to the previous mode's event loop
+    bar_store.ticker_locks.clear()
+    financials_store.ticker_locks.clear()
+    cache_utils.redis_client = FakeRedis()
+    cache_utils.local_cache.clear()
+    cache_utils.in_flight.clear()
+    cache_utils.invalidation_listener = None
+    cancel_utils.tokens.clear()
+    cancel_utils.cancel_listener = None
+    snapshot_utils.decoded.update(fetched_at=None, table=None)
+
+
+async def run_mode(blocking: bool, args):
+    reset_state()
+    executor.client = FakeAsyncLLMClient(latency=args.llm_latency, blocking=blocking)
+    executor.polygon_client = FakePolygonClient(latency=args.polygon_latency)
+    # the old pipeline ran Polygon calls on the event loop thread
+    asyncio.to_thread = _inline if blocking else _to_thread
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(run_session(i, args.turns, latencies) for i in range(args.sessions))
+    )
+    wall = time.perf_counter() - start
+    return latencies, wall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--polygon-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    for name, blocking in (("before", True), ("after", False)):
+        latencies, wall = asyncio.run(run_mode(blocking, args))
+        print(
+            f"{name:>6}: {len(latencies)} turns in {wall:.2f}s | "
+            f"p50 {percentile(latencies, 50) * 1000:.0f} ms | "
+            f"p99 {percentile(latencies, 99) * 1000:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
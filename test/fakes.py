@@ -0,0 +1,547 @@
+"""In-process stand-ins for the LLM, Polygon and Redis backends used by the
+reasoning agent, so the benchmarks in this folder can drive the real executor
+without network access or API keys."""
+
+import asyncio
+import fnmatch
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def setup_reasoning_path():
+    """Make the reasoning app importable and give it dummy credentials"""
+    for path in (
+        os.path.join(ROOT_DIR, "reasoning", "app"),
+        os.path.join(ROOT_DIR, "xrx-core"),
+    ):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    os.environ.setdefault("LLM_API_KEY", "fake")
+    os.environ.setdefault("LLM_BASE_URL", "http://127.0.0.1:9/v1")
+    os.environ.setdefault("LLM_MODEL_ID", "fake-model")
+    os.environ.setdefault("POLYGON_API_KEY", "fake")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# ---------------------------------------------------------------------------
+# LLM
+# ---------------------------------------------------------------------------
+
+TICKER_PATTERN = re.compile(r"\b[A-Z]{2,5}\b")
+
+
+class FakeAsyncLLMClient:
+    """Mimics the subset of the async OpenAI client the executor uses.
+
+    The context agent gets back every upper-case ticker in the latest user
+    message that has any, and the main agent gets a showStockPrice widget per
+    ticker (or the market overview when there are none). With stream=True the
+    content comes back in small chunks. With blocking=True the latency is
+    spent in time.sleep, which is what a synchronous client call does to the
+    event loop.
+    """
+
+    def __init__(
+        self, latency: float = 0.2, blocking: bool = False, chunk_latency: float = 0.0
+    ):
+        self.latency = latency
+        self.blocking = blocking
+        self.chunk_latency = chunk_latency
+        self.calls = 0
+        self.chunks_streamed = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, **kwargs):
+        self.calls += 1
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+
+        # like a real model, follow-ups without tickers refer to the last ones named
+        tickers = []
+        for message in reversed(messages):
+            if message["role"] == "user":
+                tickers = TICKER_PATTERN.findall(message["content"])
+                if tickers:
+                    break
+        if '"symbols"' in messages[0]["content"][:2000]:
+            content = json.dumps({"symbols": tickers})
+        else:
+            content = json.dumps(
+                {
+                    "widgets": [
+                        {"type": "showStockPrice", "parameters": {"symbol": t}}
+                        for t in tickers
+                    ]
+                    or [{"type": "showMarketOverview", "parameters": {}}],
+                    "response": f"Here is what I found for {', '.join(tickers) or 'the market'}.",
+                }
+            )
+        if kwargs.get("stream"):
+            return self.stream(content)
+        message = SimpleNamespace(content=content, role="assistant")
+        usage = SimpleNamespace(
+            prompt_tokens=sum(len(m["content"]) for m in messages) // 4,
+            completion_tokens=len(content) // 4,
+        )
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+    async def stream(self, content: str, chunk_size: int = 8):
+        for start in range(0, len(content), chunk_size):
+            if self.chunk_latency:
+                await asyncio.sleep(self.chunk_latency)
+            self.chunks_streamed += 1
+            delta = SimpleNamespace(content=content[start : start + chunk_size])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+# ---------------------------------------------------------------------------
+# Polygon
+# ---------------------------------------------------------------------------
+
+
+class FakeHTTPError(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+def _point(value):
+    return SimpleNamespace(value=value)
+
+
+class FakePolygonClient:
+    """Mimics the synchronous polygon RESTClient with a fixed per-call latency.
+
+    Every call is counted per endpoint in `calls` so tests can assert how many
+    upstream requests a code path made. Daily bars are a deterministic function
+    of the date, so repeated fetches agree with each other. Statuses queued in
+    `failures[endpoint]` make the next calls to it fail with FakeHTTPError, and
+    queued exceptions are raised as they are.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        years_of_filings: int = 10,
+        bar_latency: float = 0.0,
+        market_size: int = 100,
+        listings: dict = None,
+    ):
+        self.latency = latency
+        self.bar_latency = bar_latency
+        self.years_of_filings = years_of_filings
+        self.market_size = market_size
+        # ticker -> first trading day, for tickers that listed recently
+        self.listings = listings or {}
+        self.aggs_requests = []
+        self.calls = defaultdict(int)
+        self.filings_served = 0
+        self.failures = defaultdict(list)
+        self.vx = SimpleNamespace(list_stock_financials=self.list_stock_financials)
+
+    def _hit(self, endpoint: str):
+        self.calls[endpoint] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failures[endpoint]:
+            failure = self.failures[endpoint].pop(0)
+            raise failure if isinstance(failure, Exception) else FakeHTTPError(failure)
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def get_ticker_details(self, ticker):
+        self._hit("get_ticker_details")
+        return SimpleNamespace(
+            address=SimpleNamespace(
+                address1="1 MAIN ST",
+                address2=None,
+                city="SPRINGFIELD",
+                state="CA",
+                country=None,
+                postal_code="90000",
+            ),
+            cik="0000000001",
+            currency_name="usd",
+            description=f"{ticker} is a company used for benchmarking.",
+            homepage_url=f"https://{ticker.lower()}.example.com",
+            list_date="1990-01-02",
+            locale="us",
+            market_cap=1_000_000_000.0,
+            name=f"{ticker} Inc.",
+            primary_exchange="XNAS",
+            share_class_shares_outstanding=10_000_000,
+            sic_description="SERVICES-PREPACKAGED SOFTWARE",
+            ticker=ticker,
+            total_employees=1000,
+            weighted_shares_outstanding=10_000_000,
+        )
+
+    def get_snapshot_ticker(self, market_type, ticker):
+        self._hit("get_snapshot_ticker")
+        return SimpleNamespace(
+            day=SimpleNamespace(close=101.5),
+            todays_change=1.5,
+            todays_change_percent=1.5,
+        )
+
+    def get_snapshot_all(self, market_type, tickers=None, **kwargs):
+        self._hit("get_snapshot_all")
+        # a synthetic market of `market_size` tickers plus the well known ones;
+        # every other ticker is up, the rest down
+        symbols = tickers or [f"T{index:04d}" for index in range(self.market_size)] + [
+            "AAPL",
+            "MSFT",
+            "SPY",
+        ]
+        snapshots = []
+        for index, symbol in enumerate(symbols):
+            change = (index % 7 + 1) * (1 if index % 2 == 0 else -1) / 2
+            snapshots.append(
+                SimpleNamespace(
+                    ticker=symbol,
+                    day=SimpleNamespace(close=100.0 + index, volume=2_000_000 + index),
+                    todays_change=change,
+                    todays_change_percent=change,
+                )
+            )
+        return snapshots
+
+    def get_aggs(self, ticker, multiplier, timespan, from_, to, **kwargs):
+        self._hit("get_aggs")
+        start, end = _as_datetime(from_), _as_datetime(to)
+        self.aggs_requests.append((ticker, start, end))
+        start = max(start, self.listings.get(ticker, start))
+        bars = []
+        day = datetime(start.year, start.month, start.day)
+        if day < start:
+            day += timedelta(days=1)
+        while day <= end:
+            if day.weekday() < 5:
+                days = (day - datetime(2000, 1, 1)).days
+                bars.append(
+                    SimpleNamespace(
+                        timestamp=int(day.timestamp() * 1000),
+                        close=100.0 + (days % 97) / 10,
+                    )
+                )
+            day += timedelta(days=1)
+        # emulate transfer time growing with the size of the response
+        if self.bar_latency:
+            time.sleep(self.bar_latency * len(bars))
+        return bars
+
+    def list_stock_financials(self, ticker, timeframe="quarterly", **kwargs):
+        # like the real client, every page of `limit` filings is a request
+        limit = kwargs.get("limit") or 10
+        after = kwargs.get("period_of_report_date_gt")
+        end = datetime.now()
+        served = 0
+        for quarter in range(self.years_of_filings * 4):
+            period_end = end - timedelta(days=91 * (quarter + 1))
+            end_date = period_end.strftime("%Y-%m-%d")
+            if after and end_date <= after:
+                break
+            if served % limit == 0:
+                self._hit("list_stock_financials")
+            served += 1
+            self.filings_served += 1
+            base = 1_000_000.0 * (self.years_of_filings * 4 - quarter)
+            yield SimpleNamespace(
+                end_date=end_date,
+                financials=SimpleNamespace(
+                    balance_sheet={
+                        "assets": _point(base * 10),
+                        "liabilities": _point(base * 6),
+                        "equity": _point(base * 4),
+                    },
+                    income_statement=SimpleNamespace(
+                        revenues=_point(base),
+                        cost_of_revenue=_point(base * 0.6),
+                        gross_profit=_point(base * 0.4),
+                        basic_earnings_per_share=_point(base / 1e7),
+                    ),
+                    cash_flow_statement=SimpleNamespace(
+                        net_cash_flow=_point(base * 0.1),
+                        net_cash_flow_from_financing_activities=_point(base * -0.05),
+                    ),
+                ),
+            )
+        if not served:
+            # an empty result is still one request
+            self._hit("list_stock_financials")
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000)
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d")
+
+
+# ---------------------------------------------------------------------------
+# Redis
+# ---------------------------------------------------------------------------
+
+
+class FakeRedis:
+    """Async in-memory replacement for the redis.asyncio client"""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        config_denied: bool = False,
+        keyspace_events: str = "",
+    ):
+        self.latency = latency
+        # like a managed Redis that doesn't allow CONFIG
+        self.config_denied = config_denied
+        self.store = {}
+        self.expiry = {}
+        self.subscribers = defaultdict(list)
+        self.pattern_subscribers = defaultdict(list)
+        self.config = {"notify-keyspace-events": keyspace_events}
+        self.pipelines_executed = 0
+        # Lua source -> Python function run in its place, called with this
+        # client, the keys and the args
+        self.scripts = {}
+
+    async def _tick(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _alive(self, key):
+        deadline = self.expiry.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.store.pop(key, None)
+            self.expiry.pop(key, None)
+        return key in self.store
+
+    async def get(self, key):
+        await self._tick()
+        return self.store.get(key) if self._alive(key) else None
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        await self._tick()
+        if nx and self._alive(key):
+            return None
+        self.store[key] = value if isinstance(value, bytes) else str(value).encode()
+        self.expiry.pop(key, None)
+        if ex is not None:
+            self.expiry[key] = time.monotonic() + ex
+        if px is not None:
+            self.expiry[key] = time.monotonic() + px / 1000
+        if "K" in self.config["notify-keyspace-events"]:
+            self._notify(f"__keyspace@0__:{key}", b"set")
+        return True
+
+    async def setex(self, key, seconds, value):
+        return await self.set(key, value, ex=seconds)
+
+    async def delete(self, *keys):
+        await self._tick()
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                removed += 1
+            self.store.pop(key, None)
+            self.expiry.pop(key, None)
+        return removed
+
+    def _zset(self, key):
+        if not self._alive(key):
+            self.store[key] = {}
+        return self.store[key]
+
+    async def zincrby(self, key, amount, member):
+        await self._tick()
+        zset = self._zset(key)
+        member = member.encode() if isinstance(member, str) else member
+        zset[member] = zset.get(member, 0) + amount
+        return zset[member]
+
+    async def zrevrange(self, key, start, end):
+        await self._tick()
+        ranked = sorted(self._zset(key).items(), key=lambda item: -item[1])
+        return [member for member, _ in ranked[start : end + 1 if end >= 0 else None]]
+
+    async def zunionstore(self, dest, keys):
+        await self._tick()
+        union = {}
+        for key, weight in keys.items():
+            for member, score in self._zset(key).items():
+                union[member] = union.get(member, 0) + score * weight
+        self.store[dest] = union
+        return len(union)
+
+    async def zremrangebyscore(self, key, low, high):
+        await self._tick()
+        zset = self._zset(key)
+        doomed = [member for member, score in zset.items() if low <= score <= high]
+        for member in doomed:
+            del zset[member]
+        return len(doomed)
+
+    async def expire(self, key, seconds):
+        await self._tick()
+        if not self._alive(key):
+            return False
+        self.expiry[key] = time.monotonic() + seconds
+        return True
+
+    def _hash(self, key):
+        if not self._alive(key):
+            self.store[key] = {}
+        return self.store[key]
+
+    async def hincrby(self, key, field, amount=1):
+        await self._tick()
+        fields = self._hash(key)
+        field = field.encode() if isinstance(field, str) else field
+        fields[field] = int(fields.get(field, b"0")) + amount
+        fields[field] = str(fields[field]).encode()
+        return int(fields[field])
+
+    async def hset(self, key, field, value):
+        await self._tick()
+        fields = self._hash(key)
+        field = field.encode() if isinstance(field, str) else field
+        added = field not in fields
+        fields[field] = value.encode() if isinstance(value, str) else value
+        return int(added)
+
+    async def hdel(self, key, *fields):
+        await self._tick()
+        if not self._alive(key):
+            return 0
+        stored = self.store[key]
+        doomed = [f.encode() if isinstance(f, str) else f for f in fields]
+        return sum(stored.pop(field, None) is not None for field in doomed)
+
+    async def hgetall(self, key):
+        await self._tick()
+        return dict(self._hash(key))
+
+    async def publish(self, channel, message):
+        await self._tick()
+        if isinstance(message, str):
+            message = message.encode()
+        return self._notify(channel, message)
+
+    def _notify(self, channel, message):
+        for queue in self.subscribers[channel]:
+            queue.put_nowait({"type": "message", "channel": channel, "data": message})
+        matched = 0
+        for pattern, queues in self.pattern_subscribers.items():
+            if fnmatch.fnmatchcase(channel, pattern):
+                for queue in queues:
+                    queue.put_nowait(
+                        {
+                            "type": "pmessage",
+                            "pattern": pattern,
+                            "channel": channel,
+                            "data": message,
+                        }
+                    )
+                matched += len(queues)
+        return len(self.subscribers[channel]) + matched
+
+    async def config_get(self, name):
+        if self.config_denied:
+            raise PermissionError("unknown command 'CONFIG'")
+        return {name: self.config.get(name, "")}
+
+    def register_script(self, source):
+        if source not in self.scripts:
+            raise NotImplementedError("script not supported by FakeRedis")
+        run = self.scripts[source]
+
+        async def script(keys=(), args=()):
+            await self._tick()
+            return run(self, keys, args)
+
+        return script
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    def pipeline(self, transaction: bool = True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Queues commands and sends them to the FakeRedis in one round trip"""
+
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return queue
+
+    async def execute(self):
+        self.redis.pipelines_executed += 1
+        await self.redis._tick()
+        latency, self.redis.latency = self.redis.latency, 0.0
+        try:
+            return [
+                await getattr(self.redis, name)(*args, **kwargs)
+                for name, args, kwargs in self.commands
+            ]
+        finally:
+            self.redis.latency = latency
+            self.commands = []
+
+
+class FakePubSub:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.queue = asyncio.Queue()
+        self.channels = []
+
+    async def subscribe(self, *channels):
+        for channel in channels:
+            self.redis.subscribers[channel].append(self.queue)
+            self.channels.append(channel)
+
+    async def psubscribe(self, *patterns):
+        for pattern in patterns:
+            self.redis.pattern_subscribers[pattern].append(self.queue)
+
+    async def unsubscribe(self, *channels):
+        for channel in channels or list(self.channels):
+            if self.queue in self.redis.subscribers[channel]:
+                self.redis.subscribers[channel].remove(self.queue)
+            if channel in self.channels:
+                self.channels.remove(channel)
+
+    async def listen(self):
+        while True:
+            yield await self.queue.get()
+
+    async def aclose(self):
+        await self.unsubscribe()
@@ -0,0 +1,91 @@
+"""Compare fetching quarterly financials by paging through every filing (the old
+path) with the incremental financials store, against the fake Polygon client
+serving many years of filings.
+
+    python financials_store_benchmark.py --tickers 20 --years 30 --new-quarters 1
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from fakes import FakePolygonClient, setup_reasoning_path
+
+setup_reasoning_path()
+os.environ["FINANCIALS_STORE_DIR"] = tempfile.mkdtemp(prefix="financials-bench-")
+
+from agent.utils import financials_store, polygon_utils  # noqa: E402
+from agent.utils.financials_utils import QuarterlyFinancials  # noqa: E402
+
+# unlimited, so the numbers measure the store rather than the Polygon plan
+polygon_utils.POLYGON_CALLS_PER_MINUTE = 0
+
+
+def full_fetch(ticker: str, client: FakePolygonClient):
+    # what get_stock_financials did before the store: every page of every filing
+    filings = {}
+    for item in client.vx.list_stock_financials(ticker, timeframe="quarterly"):
+        filings.setdefault(item.end_date, financials_store.filing_metrics(item))
+    return QuarterlyFinancials.from_filings(dict(sorted(filings.items(), reverse=True)))
+
+
+def drop_newest(ticker: str, quarters: int):
+    """Forget the newest filings of a stored ticker and mark it due for a check"""
+    filings, _ = financials_store.load_filings(ticker)
+    kept = dict(list(filings.items())[quarters:])
+    financials_store.save_filings(ticker, kept, 0.0)
+
+
+async def timed(tickers, fetch):
+    start = time.perf_counter()
+    for ticker in tickers:
+        await fetch(ticker)
+    return (time.perf_counter() - start) / len(tickers)
+
+
+async def run(args):
+    tickers = [f"T{i:03d}" for i in range(args.tickers)]
+    client = FakePolygonClient(latency=args.latency, years_of_filings=args.years)
+
+    async def store_fetch(ticker):
+        filings = await financials_store.get_quarterly_filings(ticker, client)
+        return QuarterlyFinancials.from_filings(filings)
+
+    async def old_fetch(ticker):
+        return await asyncio.to_thread(full_fetch, ticker, client)
+
+    phases = [
+        ("full paging (before)", old_fetch, None),
+        ("store cold", store_fetch, None),
+        ("store warm", store_fetch, None),
+        (f"store +{args.new_quarters} quarter(s)", store_fetch, args.new_quarters),
+    ]
+    for name, fetch, new_quarters in phases:
+        if new_quarters is not None:
+            for ticker in tickers:
+                drop_newest(ticker, new_quarters)
+        pages, filings = client.calls["list_stock_financials"], client.filings_served
+        seconds = await timed(tickers, fetch)
+        print(
+            f"{name:>22}: {seconds * 1000:8.2f} ms per ticker | "
+            f"{(client.calls['list_stock_financials'] - pages) / len(tickers):5.1f} requests, "
+            f"{(client.filings_served - filings) / len(tickers):6.1f} filings per ticker"
+        )
+
+    path = financials_store.financials_path(tickers[0])
+    print(f"{'store file size':>22}: {os.path.getsize(path)} bytes for {args.years * 4} quarters")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, default=20)
+    parser.add_argument("--years", type=int, default=30)
+    parser.add_argument("--new-quarters", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.03)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
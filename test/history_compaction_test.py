@@ -0,0 +1,81 @@
+import json
+import unittest
+from unittest import mock
+
+from fakes import setup_reasoning_path
+
+setup_reasoning_path()
+
+from agent.utils import history_utils  # noqa: E402
+from agent.utils.history_utils import compact_history, estimate_tokens  # noqa: E402
+
+
+def conversation(turns: int):
+    messages = []
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"Question {turn} about AAPL? " * 10})
+        messages.append(
+            {
+                "role": "assistant",
+                "content": json.dumps(
+                    {
+                        "widgets": [
+                            {"type": "showStockPrice", "parameters": {"symbol": "AAPL"}}
+                        ]
+                        * 5,
+                        "response": f"Answer {turn}.",
+                    }
+                ),
+            }
+        )
+    return messages
+
+
+@mock.patch.object(history_utils, "HISTORY_KEEP_TURNS", 2)
+class TestCompactHistory(unittest.TestCase):
+    def test_short_history_is_unchanged(self):
+        messages = conversation(3)
+        with mock.patch.object(history_utils, "HISTORY_TOKEN_BUDGET", 100_000):
+            self.assertIs(compact_history(messages)[0], messages)
+
+    def test_recent_turns_are_kept_verbatim_and_older_ones_summarized(self):
+        messages = conversation(10)
+        with mock.patch.object(history_utils, "HISTORY_TOKEN_BUDGET", 800):
+            history, state = compact_history(messages)
+
+        self.assertEqual(history[1:], messages[-4:])
+        self.assertEqual(history[0]["role"], "system")
+        self.assertIn("Answer 7. (showed showStockPrice AAPL", history[0]["content"])
+        self.assertNotIn('"widgets"', history[0]["content"])
+        self.assertLessEqual(
+            sum(estimate_tokens(message["content"]) for message in history), 800 + 10
+        )
+        # the oldest summaries are the ones dropped
+        self.assertNotIn("Answer 0.", history[0]["content"])
+        self.assertEqual(state["turns"], 8)
+
+    def test_summaries_are_reused_on_the_next_turn(self):
+        messages = conversation(10)
+        with mock.patch.object(history_utils, "HISTORY_TOKEN_BUDGET", 800):
+            _, state = compact_history(messages)
+            with mock.patch.object(
+                history_utils, "summarize_turn", wraps=history_utils.summarize_turn
+            ) as summarize_turn:
+                history, state = compact_history(messages + conversation(1), state)
+
+        self.assertEqual(summarize_turn.call_count, 1)
+        self.assertEqual(state["turns"], 9)
+        self.assertIn("Answer 8.", history[0]["content"])
+
+    def test_edited_history_is_summarized_again(self):
+        messages = conversation(10)
+        with mock.patch.object(history_utils, "HISTORY_TOKEN_BUDGET", 800):
+            _, state = compact_history(messages)
+            messages[14]["content"] = "Something else entirely"
+            history, _ = compact_history(messages, state)
+
+        self.assertIn("Something else entirely", history[0]["content"])
+
+
+if __name__ == "__main__":
+    unittest.main()
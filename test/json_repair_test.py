@@ -0,0 +1,66 @@
+import json
+import unittest
+
+from fakes import setup_reasoning_path
+
+setup_reasoning_path()
+
+from agent.utils.json_utils import repair_json, validate_agent_response  # noqa: E402
+
+VALID = {
+    "widgets": [{"type": "showStockPrice", "parameters": {"symbol": "AAPL"}}],
+    "response": "Here is the price of Apple, {see below}.",
+}
+
+
+class TestRepairJson(unittest.TestCase):
+    def test_valid_json_is_unchanged(self):
+        self.assertEqual(repair_json(json.dumps(VALID)), VALID)
+
+    def test_prose_and_code_fences_are_stripped(self):
+        text = f"Sure! Here you go:\n```json\n{json.dumps(VALID)}\n```\nAnything else?"
+        self.assertEqual(repair_json(text), VALID)
+
+    def test_trailing_commas_are_removed(self):
+        text = '{"widgets": [{"type": "showStockPrice", "parameters": {"symbol": "AAPL",},},], "response": "Hi, there",}'
+        self.assertEqual(repair_json(text)["widgets"][0]["parameters"], {"symbol": "AAPL"})
+        self.assertEqual(repair_json(text)["response"], "Hi, there")
+
+    def test_truncated_output_is_closed(self):
+        text = json.dumps(VALID)
+        for cut in (len(text) - 1, len(text) - 10, text.index('"response"') + 12):
+            repaired = repair_json(text[:cut])
+            self.assertIsNotNone(repaired, text[:cut])
+            self.assertEqual(repaired["widgets"], VALID["widgets"])
+
+    def test_unrecoverable_text_returns_none(self):
+        self.assertIsNone(repair_json("I could not find that stock."))
+
+
+class TestValidateAgentResponse(unittest.TestCase):
+    def test_valid_response_has_no_problems(self):
+        parsed, problems = validate_agent_response(json.loads(json.dumps(VALID)))
+        self.assertEqual(problems, [])
+        self.assertEqual(parsed, VALID)
+
+    def test_widget_object_form_is_normalized(self):
+        parsed, problems = validate_agent_response(
+            {
+                "widgets": {"showStockPrice": {"parameters": {"symbol": "AAPL"}}},
+                "response": "Here you go.",
+            }
+        )
+        self.assertEqual(problems, [])
+        self.assertEqual(parsed["widgets"], VALID["widgets"])
+
+    def test_invalid_parts_are_reported(self):
+        parsed, problems = validate_agent_response(
+            {"widgets": [{"parameters": {}}, VALID["widgets"][0]]}
+        )
+        self.assertEqual(len(problems), 2)
+        self.assertEqual(parsed["widgets"], VALID["widgets"])
+        self.assertEqual(validate_agent_response([])[0], None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,254 @@
+"""Replay recorded multi-turn stock conversations through the reasoning agent
+against in-process fakes of the LLM endpoint, Polygon and Redis, and write a
+JSON report to compare across versions.
+
+The report has throughput, turn latency and time to first widget percentiles,
+and the upstream (Polygon and LLM) calls per turn, taken from each turn's
+"Turn timings" record. With --baseline, the change against an earlier report
+is printed as well. Sessions cycle through the conversations, so once every
+conversation has been replayed the later sessions run against warm caches; use
+--sessions equal to the number of conversations for a cold run only.
+
+    python load_benchmark.py --sessions 60 --concurrency 20 --output after.json
+    python load_benchmark.py --baseline after.json --output candidate.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+from fakes import (
+    FakeAsyncLLMClient,
+    FakePolygonClient,
+    FakeRedis,
+    percentile,
+    setup_reasoning_path,
+)
+
+setup_reasoning_path()
+os.environ["BAR_STORE_DIR"] = tempfile.mkdtemp(prefix="load-bench-bars-")
+os.environ["FINANCIALS_STORE_DIR"] = tempfile.mkdtemp(prefix="load-bench-financials-")
+
+from agent import executor  # noqa: E402
+from agent.utils import cache_utils, polygon_utils  # noqa: E402
+
+CONVERSATIONS_PATH = os.path.join(os.path.dirname(__file__), "conversations.json")
+# characters per streamed chunk of the fake LLM, about two tokens
+CHUNK_CHARS = 8
+
+
+class TurnRecords(logging.Handler):
+    """Collects the structured record each turn logs, by task id"""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.records = {}
+
+    def emit(self, record: logging.LogRecord):
+        message = record.getMessage()
+        if message.startswith("Turn timings: "):
+            turn = json.loads(message[len("Turn timings: ") :])
+            self.records[turn["task_id"]] = turn
+
+
+def git_version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def run_session(session_id: int, conversation: list, turns: list):
+    messages = []
+    for index, question in enumerate(conversation):
+        messages.append({"role": "user", "content": question})
+        task_id = f"bench-{session_id}-{index}"
+        start = time.perf_counter()
+        first_widget = None
+        async for output in executor.run_agent(
+            {
+                "messages": list(messages),
+                "session": {"guid": f"bench-{session_id}"},
+                "task_id": task_id,
+            }
+        ):
+            output = json.loads(output)
+            if (
+                first_widget is None
+                and output["node"] == "Widget"
+                and json.loads(output["output"]["details"])
+            ):
+                first_widget = time.perf_counter() - start
+            # the reply becomes part of the history for the next question
+            reply = output["messages"][-1]
+        messages.append({"role": "assistant", "content": reply["content"]})
+        turns.append(
+            {
+                "task_id": task_id,
+                "latency": time.perf_counter() - start,
+                "first_widget": first_widget,
+            }
+        )
+
+
+async def run(args, conversations: list):
+    llm = FakeAsyncLLMClient(
+        latency=args.llm_first_token,
+        chunk_latency=(CHUNK_CHARS / 4) / args.llm_tokens_per_second,
+    )
+    polygon = FakePolygonClient(latency=args.polygon_latency)
+    executor.client = llm
+    executor.polygon_client = polygon
+    cache_utils.redis_client = FakeRedis(latency=args.redis_latency)
+    cache_utils.local_cache.clear()
+    cache_utils.invalidation_listener = None
+    # unlimited by default, so the numbers measure the service rather than the plan
+    polygon_utils.POLYGON_CALLS_PER_MINUTE = args.polygon_calls_per_minute
+    polygon_utils.local_bucket = polygon_utils.TokenBucket(
+        args.polygon_calls_per_minute / 60, polygon_utils.POLYGON_BURST
+    )
+
+    turns = []
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def session(session_id: int):
+        async with slots:
+            conversation = conversations[session_id % len(conversations)]
+            await run_session(session_id, conversation, turns)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(args.sessions)))
+    wall = time.perf_counter() - start
+    return turns, wall, llm, polygon
+
+
+def distribution(values: list):
+    if not values:
+        return None
+    return {
+        "mean": round(sum(values) / len(values), 2),
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def build_report(args, turns: list, wall: float, llm, polygon, records: dict):
+    turn_records = [records.get(turn["task_id"], {}) for turn in turns]
+    polygon_per_turn = [
+        sum(record.get("upstream_calls", {}).values()) for record in turn_records
+    ]
+    by_endpoint = Counter()
+    cache_reads = defaultdict(Counter)
+    for record in turn_records:
+        by_endpoint.update(record.get("upstream_calls", {}))
+        for cache, outcomes in record.get("cache", {}).items():
+            cache_reads[cache].update(outcomes)
+    first_widgets = [turn["first_widget"] for turn in turns if turn["first_widget"] is not None]
+
+    return {
+        "version": git_version(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": vars(args),
+        "sessions": args.sessions,
+        "turns": len(turns),
+        "wall_seconds": round(wall, 3),
+        "throughput_turns_per_second": round(len(turns) / wall, 2),
+        "turn_latency_ms": distribution([turn["latency"] * 1000 for turn in turns]),
+        "first_widget_ms": distribution([seconds * 1000 for seconds in first_widgets]),
+        "turns_with_widgets": len(first_widgets),
+        "upstream_calls_per_turn": {
+            "polygon": distribution(polygon_per_turn),
+            "polygon_by_endpoint": {
+                endpoint: round(count / len(turns), 2)
+                for endpoint, count in sorted(by_endpoint.items())
+            },
+            "llm": round(llm.calls / len(turns), 2),
+        },
+        # every call the fake served, including refreshes no turn waited on
+        "polygon_calls_total": dict(polygon.calls),
+        "cache_reads": {cache: dict(outcomes) for cache, outcomes in cache_reads.items()},
+        "outcomes": dict(Counter(record.get("outcome", "unknown") for record in turn_records)),
+    }
+
+
+def compare(report: dict, baseline: dict):
+    """Relative change of the headline numbers against a baseline report"""
+    rows = [
+        ("throughput_turns_per_second",),
+        ("turn_latency_ms", "p50"),
+        ("turn_latency_ms", "p95"),
+        ("turn_latency_ms", "p99"),
+        ("first_widget_ms", "p50"),
+        ("first_widget_ms", "p95"),
+        ("upstream_calls_per_turn", "polygon", "mean"),
+        ("upstream_calls_per_turn", "llm"),
+    ]
+    print(f"against {baseline.get('version') or 'baseline'}:")
+    for path in rows:
+        now, before = report, baseline
+        for key in path:
+            now = (now or {}).get(key)
+            before = (before or {}).get(key)
+        if now is None or before is None:
+            continue
+        change = f"{(now - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"  {'.'.join(path):<40} {before:>10} -> {now:<10} {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", default=CONVERSATIONS_PATH)
+    parser.add_argument("--sessions", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--llm-first-token", type=float, default=0.2)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=400)
+    parser.add_argument("--polygon-latency", type=float, default=0.05)
+    parser.add_argument("--redis-latency", type=float, default=0.001)
+    parser.add_argument("--polygon-calls-per-minute", type=float, default=0)
+    parser.add_argument("--output", default="load_benchmark.json")
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    with open(args.conversations) as f:
+        conversations = json.load(f)
+
+    # only the turn records are wanted from the agent's logging
+    logging.getLogger().setLevel(logging.INFO)
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(logging.WARNING)
+    records = TurnRecords()
+    logging.getLogger().addHandler(records)
+
+    turns, wall, llm, polygon = asyncio.run(run(args, conversations))
+    report = build_report(args, turns, wall, llm, polygon, records.records)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    latency = report["turn_latency_ms"]
+    print(
+        f"{report['turns']} turns in {report['wall_seconds']:.2f}s "
+        f"({report['throughput_turns_per_second']} turns/s) | "
+        f"p50 {latency['p50']:.0f} ms | p95 {latency['p95']:.0f} ms | "
+        f"p99 {latency['p99']:.0f} ms | report in {args.output}"
+    )
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from fakes import FakeRedis, setup_reasoning_path
+
+setup_reasoning_path()
+
+from agent.utils import cache_utils  # noqa: E402
+from agent.utils import market_cache_utils  # noqa: E402
+from agent.utils.market_cache_utils import (  # noqa: E402
+    find_market_response,
+    market_response_hits,
+    store_market_response,
+)
+
+OVERVIEW = {
+    "widgets": [{"type": "showMarketOverview", "parameters": {}}],
+    "response": "Here is an overview of the market today.",
+}
+
+
+class TestMarketResponseCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        cache_utils.redis_client = FakeRedis()
+        cache_utils.local_cache.clear()
+        cache_utils.invalidation_listener = None
+
+    async def test_similar_question_is_served_from_the_cache(self):
+        await store_market_response("How's the market doing today?", [], OVERVIEW)
+
+        self.assertEqual(
+            await find_market_response("hey Alice, how is the market doing today", []),
+            OVERVIEW,
+        )
+        self.assertIsNone(await find_market_response("how's Apple doing today", []))
+        self.assertEqual(list((await market_response_hits()).values()), [1])
+
+    async def test_follow_ups_only_match_after_the_same_reply(self):
+        heatmap = {
+            "widgets": [{"type": "showMarketHeatmap", "parameters": {}}],
+            "response": "Here is the heatmap.",
+        }
+        await store_market_response("yes", [], heatmap, "Want to see the heatmap?")
+
+        self.assertIsNone(
+            await find_market_response("yes", [], "Want to see trending stocks?")
+        )
+        self.assertIsNone(await find_market_response("yes", []))
+        self.assertEqual(
+            await find_market_response("yes", [], "Want to see the heatmap?"), heatmap
+        )
+
+    async def test_other_widgets_on_screen_miss(self):
+        await store_market_response("show me the heatmap", [], OVERVIEW)
+        self.assertIsNone(
+            await find_market_response("show me the heatmap", ["showStockPrice"])
+        )
+
+    async def test_only_market_wide_answers_are_stored(self):
+        answer = {
+            "widgets": [{"type": "showStockPrice", "parameters": {"symbol": "AAPL"}}],
+            "response": "Here is Apple.",
+        }
+        await store_market_response("show me the market", [], answer)
+        self.assertIsNone(await find_market_response("show me the market", []))
+
+    async def test_concurrent_stores_keep_every_answer(self):
+        # replicas storing at the same time, each reading before the others write
+        cache_utils.redis_client = FakeRedis(latency=0.01)
+        questions = ["trending stocks", "show me the heatmap", "market overview"]
+        await asyncio.gather(
+            *(store_market_response(question, [], OVERVIEW) for question in questions)
+        )
+
+        for question in questions:
+            with self.subTest(question=question):
+                self.assertEqual(await find_market_response(question, []), OVERVIEW)
+
+    async def test_oldest_entries_are_dropped(self):
+        with mock.patch.object(market_cache_utils, "MARKET_RESPONSE_MAX_ENTRIES", 2):
+            for question in ["trending stocks", "show me the heatmap", "market overview"]:
+                await store_market_response(question, [], OVERVIEW)
+
+        self.assertIsNone(await find_market_response("trending stocks", []))
+        self.assertEqual(await find_market_response("market overview", []), OVERVIEW)
+
+    async def test_entries_expire(self):
+        await store_market_response("trending stocks", [], OVERVIEW)
+        with mock.patch.object(market_cache_utils, "MARKET_RESPONSE_TTL", 0.0001):
+            self.assertIsNone(await find_market_response("trending stocks", []))
+
+
+if __name__ == "__main__":
+    unittest.main()
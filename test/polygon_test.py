@@ -0,0 +1,132 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from fakes import FakeHTTPError, FakePolygonClient, FakeRedis, setup_reasoning_path
+
+setup_reasoning_path()
+
+from agent.utils import cache_utils, polygon_utils  # noqa: E402
+from agent.utils.polygon_utils import (  # noqa: E402
+    BACKGROUND,
+    TokenBucket,
+    polygon_lane,
+    polygon_request,
+    polygon_stats,
+)
+from agent.utils.stock_utils import fetch_profile  # noqa: E402
+
+
+class TestPolygonRequests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        cache_utils.redis_client = FakeRedis()
+        polygon_stats.clear()
+        polygon_utils.rate_limit_stats.update(shared=0, local=0, fallbacks=0)
+        polygon_utils.shared_limit_lost_at = None
+        self.client = FakePolygonClient(latency=0)
+        patcher = mock.patch.multiple(
+            polygon_utils, POLYGON_RETRY_BASE=0.001, POLYGON_CALLS_PER_MINUTE=0
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_throttled_and_server_errors_are_retried(self):
+        self.client.failures["get_ticker_details"] = [429, 503]
+        profile = await fetch_profile("AAPL", self.client)
+
+        self.assertEqual(profile["ticker"], "AAPL")
+        self.assertEqual(self.client.calls["get_ticker_details"], 3)
+        self.assertEqual(
+            polygon_stats["get_ticker_details"],
+            {"calls": 3, "throttled": 0, "retried": 2, "failed": 0},
+        )
+
+    async def test_dropped_connections_and_timeouts_are_retried(self):
+        self.client.failures["get_ticker_details"] = [
+            ConnectionResetError("Connection reset by peer"),
+            TimeoutError("Read timed out"),
+        ]
+        profile = await fetch_profile("AAPL", self.client)
+
+        self.assertEqual(profile["ticker"], "AAPL")
+        self.assertEqual(self.client.calls["get_ticker_details"], 3)
+        self.assertEqual(polygon_stats["get_ticker_details"]["retried"], 2)
+
+    async def test_client_errors_are_not_retried(self):
+        self.client.failures["get_ticker_details"] = [404]
+        with self.assertRaises(FakeHTTPError):
+            await fetch_profile("AAPL", self.client)
+        self.assertEqual(polygon_stats["get_ticker_details"]["failed"], 1)
+        self.assertEqual(self.client.calls["get_ticker_details"], 1)
+
+    async def test_gives_up_after_max_retries(self):
+        self.client.failures["get_ticker_details"] = [500] * 10
+        with self.assertRaises(FakeHTTPError):
+            await fetch_profile("AAPL", self.client)
+        self.assertEqual(
+            self.client.calls["get_ticker_details"], polygon_utils.POLYGON_MAX_RETRIES + 1
+        )
+        self.assertEqual(polygon_stats["get_ticker_details"]["failed"], 1)
+
+    async def test_live_calls_go_before_background_calls(self):
+        order = []
+
+        async def call(lane: str, index: int):
+            polygon_lane.set(lane)
+            await polygon_request("test", order.append, f"{lane}-{index}")
+
+        # an empty bucket refilling at ten calls a second, so every call waits
+        bucket = TokenBucket(10, 1)
+        bucket.tokens = 0
+        with mock.patch.multiple(
+            polygon_utils,
+            POLYGON_CALLS_PER_MINUTE=600,
+            POLYGON_BURST=1,
+            local_bucket=bucket,
+        ):
+            await asyncio.gather(
+                *(call(BACKGROUND, i) for i in range(3)),
+                *(call("live", i) for i in range(3)),
+            )
+
+        lanes = [name.split("-")[0] for name in order]
+        self.assertEqual(lanes, ["live"] * 3 + [BACKGROUND] * 3)
+        self.assertEqual(polygon_stats["test"]["throttled"], 6)
+
+    async def test_shared_bucket_script_is_registered_once(self):
+        script = mock.AsyncMock(return_value=b"0")
+        cache_utils.redis_client.register_script = mock.Mock(return_value=script)
+        with mock.patch.object(polygon_utils, "POLYGON_CALLS_PER_MINUTE", 600):
+            for _ in range(3):
+                await polygon_request("test", lambda: None)
+
+        cache_utils.redis_client.register_script.assert_called_once_with(
+            polygon_utils.TAKE_TOKEN_SCRIPT
+        )
+        self.assertEqual(script.await_count, 3)
+        script.assert_awaited_with(
+            keys=[polygon_utils.RATE_LIMIT_KEY],
+            args=[10, polygon_utils.POLYGON_BURST, 0],
+        )
+
+    async def test_losing_the_shared_bucket_is_reported_once(self):
+        # FakeRedis can't run scripts, like a Redis that is down
+        with mock.patch.object(polygon_utils, "POLYGON_CALLS_PER_MINUTE", 600):
+            with self.assertLogs(level="WARNING") as logs:
+                for _ in range(3):
+                    await polygon_request("test", lambda: None)
+            self.assertEqual(len(logs.records), 1)
+            self.assertEqual(
+                polygon_utils.rate_limit_stats, {"shared": 0, "local": 3, "fallbacks": 1}
+            )
+
+            script = mock.AsyncMock(return_value=b"0")
+            cache_utils.redis_client.register_script = mock.Mock(return_value=script)
+            await polygon_request("test", lambda: None)
+
+        self.assertIsNone(polygon_utils.shared_limit_lost_at)
+        self.assertEqual(polygon_utils.rate_limit_stats["shared"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from fakes import FakePolygonClient, FakeRedis, setup_reasoning_path
+
+setup_reasoning_path()
+os.environ.setdefault("BAR_STORE_DIR", tempfile.mkdtemp(prefix="prewarm-bars-"))
+os.environ.setdefault(
+    "FINANCIALS_STORE_DIR", tempfile.mkdtemp(prefix="prewarm-financials-")
+)
+
+from agent.utils import cache_utils, prewarm_utils  # noqa: E402
+from agent.utils.prewarm_utils import (  # noqa: E402
+    POPULARITY_KEY,
+    PREWARM_LEADER_KEY,
+    claim_leadership,
+    prewarm_cycle,
+    record_ticker_requests,
+    release_leadership,
+    run_prewarmer,
+)
+from agent.utils.polygon_utils import BACKGROUND, polygon_lane  # noqa: E402
+from agent.utils.stock_utils import layer_key  # noqa: E402
+
+
+def holds(redis, key, owner):
+    return redis._alive(key) and redis.store[key] == owner.encode()
+
+
+def renew_leader(redis, keys, args):
+    if not holds(redis, keys[0], args[0]):
+        return 0
+    redis.expiry[keys[0]] = prewarm_utils.time.monotonic() + args[1]
+    return 1
+
+
+def release_leader(redis, keys, args):
+    if not holds(redis, keys[0], args[0]):
+        return 0
+    redis.store.pop(keys[0])
+    redis.expiry.pop(keys[0], None)
+    return 1
+
+
+class TestPrewarm(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.redis.scripts[prewarm_utils.RENEW_LEADER_SCRIPT] = renew_leader
+        self.redis.scripts[prewarm_utils.RELEASE_LEADER_SCRIPT] = release_leader
+        cache_utils.redis_client = self.redis
+        cache_utils.local_cache.clear()
+        cache_utils.invalidation_listener = None
+        cache_utils.in_flight.clear()
+        self.client = FakePolygonClient(latency=0)
+        patcher = mock.patch.multiple(
+            prewarm_utils, PREWARM_MAX_CALLS_PER_MINUTE=6000, BULK_SNAPSHOT_TTL=0
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_requests_are_counted_in_one_round_trip(self):
+        await record_ticker_requests(["AAPL", "MSFT", "AAPL"])
+
+        self.assertEqual(self.redis.pipelines_executed, 1)
+        self.assertEqual(
+            await self.redis.zrevrange(POPULARITY_KEY, 0, -1), [b"AAPL", b"MSFT"]
+        )
+
+    async def test_cycle_refreshes_the_financials_too(self):
+        await record_ticker_requests(["AAPL"])
+        await prewarm_cycle(self.client)
+        for flight in list(cache_utils.in_flight.values()):
+            await flight
+
+        for layer in prewarm_utils.PREWARM_LAYERS:
+            with self.subTest(layer=layer):
+                entry = await cache_utils.get_cached_data(layer_key(layer, "AAPL"))
+                self.assertIsNotNone(entry)
+        # nothing is due right after a cycle
+        self.assertEqual(await prewarm_utils.layers_due("AAPL"), [])
+
+    async def test_budget_is_charged_per_polygon_call(self):
+        await record_ticker_requests(["AAPL", "MSFT", "NVDA", "TSLA"])
+        lane = polygon_lane.set(BACKGROUND)
+        self.addCleanup(polygon_lane.reset, lane)
+        # 6000 calls a minute for 0.05s: a budget of 5 calls
+        with mock.patch.object(prewarm_utils, "PREWARM_INTERVAL", 0.05):
+            refreshed, calls = await prewarm_cycle(self.client)
+
+        # the cycle stops once its calls, not its layers, reach the budget
+        self.assertEqual(calls, self.client.total_calls)
+        self.assertGreaterEqual(calls, 5)
+        self.assertLess(refreshed, 4 * len(prewarm_utils.PREWARM_LAYERS))
+
+    async def test_leader_renews_its_key_and_releases_it(self):
+        self.assertTrue(await claim_leadership())
+        self.redis.expiry[PREWARM_LEADER_KEY] -= 1
+        self.assertTrue(await claim_leadership())
+        self.assertAlmostEqual(
+            self.redis.expiry[PREWARM_LEADER_KEY] - prewarm_utils.time.monotonic(),
+            prewarm_utils.PREWARM_LEADER_TTL,
+            places=1,
+        )
+
+        # another replica neither takes nor releases the key
+        with mock.patch.object(cache_utils, "instance_id", "other"):
+            self.assertFalse(await claim_leadership())
+            await release_leadership()
+        self.assertIsNotNone(await self.redis.get(PREWARM_LEADER_KEY))
+
+        await release_leadership()
+        self.assertIsNone(await self.redis.get(PREWARM_LEADER_KEY))
+        with mock.patch.object(cache_utils, "instance_id", "other"):
+            self.assertTrue(await claim_leadership())
+
+    async def test_stopped_prewarmer_hands_leadership_over(self):
+        task = asyncio.ensure_future(run_prewarmer(self.client))
+        await asyncio.sleep(0.05)
+        self.assertEqual(
+            await self.redis.get(PREWARM_LEADER_KEY), cache_utils.instance_id.encode()
+        )
+
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertIsNone(await self.redis.get(PREWARM_LEADER_KEY))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import math
+import unittest
+from unittest import mock
+
+from fakes import FakePolygonClient, setup_reasoning_path
+
+setup_reasoning_path()
+
+from agent.utils.financials_store import filing_metrics  # noqa: E402
+from agent.utils.financials_utils import QuarterlyFinancials  # noqa: E402
+from agent.utils.stock_utils import fetch_trailing_financials  # noqa: E402
+
+FILINGS = {
+    "2024-06-30": {"revenues": 50.0, "eps": 1.5},
+    "2024-03-31": {"revenues": 40.0},
+    "2023-12-31": {"revenues": 30.0, "eps": 1.0},
+    "2023-09-30": {"revenues": 20.0, "eps": None},
+    "2023-06-30": {"revenues": 10.0, "eps": 0.5},
+}
+
+
+
+
+def process_financials(items):
+    """The filings processed the way the app did before the financials store,
+    as the reference the columns are checked against"""
+    filings = {}
+    for item in items:
+        filings.setdefault(item.end_date, filing_metrics(item))
+    return QuarterlyFinancials.from_filings(dict(sorted(filings.items(), reverse=True)))
+
+
+class TestQuarterlyFinancials(unittest.TestCase):
+    def setUp(self):
+        self.financials = QuarterlyFinancials.from_filings(FILINGS)
+
+    def test_series_skips_missing_values(self):
+        self.assertEqual(
+            self.financials.series("eps"),
+            [
+                {"date": "2024-06-30", "value": 1.5},
+                {"date": "2023-12-31", "value": 1.0},
+                {"date": "2023-06-30", "value": 0.5},
+            ],
+        )
+        self.assertEqual(self.financials.series("missing"), [])
+
+    def test_trailing_sums(self):
+        trailing = self.financials.trailing("revenues")
+        # the oldest quarters sum the fewer values there are
+        self.assertEqual(list(trailing), [140.0, 100.0, 60.0, 30.0, 10.0])
+
+    def test_trailing_sums_skip_filings_without_the_metric(self):
+        trailing = self.financials.trailing("eps")
+        # the latest four values filed, as the TTM figures summed before
+        self.assertEqual(trailing[0], 3.0)
+        self.assertEqual(trailing[2], 1.5)
+        self.assertTrue(math.isnan(trailing[1]))
+        self.assertTrue(math.isnan(trailing[3]))
+
+    def test_changes(self):
+        self.assertEqual(self.financials.year_over_year("revenues")[0], 4.0)
+        self.assertEqual(self.financials.quarter_over_quarter("revenues")[0], 0.25)
+        self.assertTrue(math.isnan(self.financials.quarter_over_quarter("eps")[0]))
+
+    def test_bytes_round_trip(self):
+        restored = QuarterlyFinancials.from_bytes(self.financials.to_bytes())
+        self.assertEqual(restored.dates, self.financials.dates)
+        self.assertEqual(restored.to_dict(), self.financials.to_dict())
+
+    def test_polygon_filings_produce_the_widget_payload(self):
+        client = FakePolygonClient(latency=0, years_of_filings=3)
+        items = list(client.vx.list_stock_financials("AAPL"))
+        financials = process_financials(items)
+
+        revenues = financials.series("revenues")
+        self.assertEqual(len(revenues), 12)
+        self.assertEqual(revenues[0]["date"], items[0].end_date)
+        self.assertEqual(revenues[0]["value"], items[0].financials.income_statement.revenues.value)
+        self.assertIn("net_cash_flow_from_financing_activities", financials.to_dict())
+
+
+class TestTrailingFinancials(unittest.IsolatedAsyncioTestCase):
+    async def test_a_quarter_without_eps_keeps_the_ttm_figures(self):
+        financials = QuarterlyFinancials.from_filings(
+            {
+                date: {
+                    "revenues": metrics["revenues"],
+                    "basic_earnings_per_share": metrics.get("eps"),
+                }
+                for date, metrics in FILINGS.items()
+            }
+        )
+        with mock.patch(
+            "agent.utils.stock_utils.get_cached_financials",
+            mock.AsyncMock(return_value=financials),
+        ):
+            trailing = await fetch_trailing_financials("AAPL", None)
+
+        self.assertEqual(
+            trailing,
+            {
+                "trailing_revenue": 140.0,
+                "latest_revenue_date": "2024-06-30",
+                "trailing_eps": 3.0,
+                "latest_eps_date": "2024-06-30",
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from fakes import FakePolygonClient, FakeRedis, setup_reasoning_path
+
+setup_reasoning_path()
+os.environ.setdefault("BAR_STORE_DIR", tempfile.mkdtemp(prefix="single-flight-"))
+os.environ.setdefault(
+    "FINANCIALS_STORE_DIR", tempfile.mkdtemp(prefix="single-flight-financials-")
+)
+
+from agent.utils import bar_store, cache_utils, financials_store  # noqa: E402
+from agent.utils import stock_utils  # noqa: E402
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+
+    CONCURRENCY = 100
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        cache_utils.redis_client = self.redis
+        cache_utils.local_cache.clear()
+        cache_utils.invalidation_listener = None
+        cache_utils.in_flight.clear()
+        # every test starts from empty stores, whatever ran before it
+        bar_store.BAR_STORE_DIR = tempfile.mkdtemp(prefix="single-flight-")
+        financials_store.FINANCIALS_STORE_DIR = tempfile.mkdtemp(
+            prefix="single-flight-financials-"
+        )
+        self.client = FakePolygonClient(latency=0.05)
+
+    async def test_concurrent_requests_share_one_fetch(self):
+        results = await asyncio.gather(
+            *(
+                stock_utils.get_stock_fundamentals("AAPL", self.client)
+                for _ in range(self.CONCURRENCY)
+            )
+        )
+
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertNotIn("Error", results[0][0])
+        for endpoint in (
+            "get_ticker_details",
+            "get_snapshot_ticker",
+            "get_aggs",
+            "list_stock_financials",
+        ):
+            self.assertEqual(self.client.calls[endpoint], 1, endpoint)
+
+    async def test_waits_for_fetch_running_on_another_replica(self):
+        fetches = 0
+
+        async def fetch():
+            nonlocal fetches
+            fetches += 1
+            return "ours"
+
+        # another replica holds the lock and publishes its result a bit later
+        await self.redis.set("layer_lock", "other-replica", px=5000)
+
+        async def other_replica():
+            await asyncio.sleep(0.2)
+            await cache_utils.store_entry("layer", "theirs", 60)
+            await self.redis.delete("layer_lock")
+
+        results = await asyncio.gather(
+            other_replica(),
+            *(
+                cache_utils.get_or_fetch("layer", 60, fetch)
+                for _ in range(self.CONCURRENCY)
+            ),
+        )
+
+        self.assertEqual(fetches, 0)
+        self.assertEqual(set(results[1:]), {"theirs"})
+
+    async def test_fetch_outlives_waiters_that_give_up_while_others_wait(self):
+        fetches = 0
+
+        async def fetch():
+            nonlocal fetches
+            fetches += 1
+            await asyncio.sleep(0.1)
+            return "ours"
+
+        first = asyncio.ensure_future(cache_utils.get_or_fetch("layer", 60, fetch))
+        second = asyncio.ensure_future(cache_utils.get_or_fetch("layer", 60, fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        self.assertEqual(await second, "ours")
+        self.assertEqual(fetches, 1)
+
+        # with nobody left waiting on it, the fetch is stopped
+        alone = asyncio.ensure_future(cache_utils.get_or_fetch("other", 60, fetch))
+        await asyncio.sleep(0.01)
+        alone.cancel()
+        await asyncio.sleep(0.01)
+        self.assertNotIn("other", cache_utils.in_flight)
+        self.assertIsNone(await self.redis.get("other_lock"))
+
+    async def test_lock_released_without_result_lets_a_waiter_fetch(self):
+        fetches = 0
+
+        async def fetch():
+            nonlocal fetches
+            fetches += 1
+            return "ours"
+
+        await self.redis.set("layer_lock", "other-replica", px=100)
+
+        results = await asyncio.gather(
+            *(
+                cache_utils.get_or_fetch("layer", 60, fetch)
+                for _ in range(self.CONCURRENCY)
+            )
+        )
+
+        self.assertEqual(fetches, 1)
+        self.assertEqual(set(results), {"ours"})
+
+
+class TestStaleWhileRevalidate(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        cache_utils.redis_client = FakeRedis()
+        cache_utils.local_cache.clear()
+        cache_utils.invalidation_listener = None
+        cache_utils.in_flight.clear()
+
+    async def test_stale_entry_is_served_then_refreshed(self):
+        refreshed = asyncio.Event()
+
+        async def fetch():
+            await asyncio.sleep(0.1)
+            refreshed.set()
+            return "new"
+
+        entry = await cache_utils.store_entry("layer", "old", 60)
+        entry["fetched_at"] -= 120
+        await cache_utils.set_cached_data("layer", entry, 600)
+
+        stale = await cache_utils.get_or_fetch_entry("layer", 60, fetch)
+        self.assertEqual(stale["data"], "old")
+        self.assertFalse(refreshed.is_set())
+
+        await asyncio.wait_for(refreshed.wait(), 1)
+        await asyncio.sleep(0.05)
+        fresh = await cache_utils.get_or_fetch_entry("layer", 60, fetch)
+        self.assertEqual(fresh["data"], "new")
+        self.assertTrue(cache_utils.is_fresh(fresh, 60))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+from fakes import FakePolygonClient, FakeRedis, setup_reasoning_path
+
+setup_reasoning_path()
+
+from agent.utils import cache_utils, snapshot_utils  # noqa: E402
+from agent.utils.snapshot_utils import (  # noqa: E402
+    MARKET_SNAPSHOT_KEY,
+    SnapshotTable,
+    get_market_snapshot,
+    market_summary_text,
+)
+from agent.utils.stock_utils import fetch_snapshot  # noqa: E402
+
+
+class TestMarketSnapshot(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        cache_utils.redis_client = FakeRedis()
+        cache_utils.local_cache.clear()
+        cache_utils.invalidation_listener = None
+        cache_utils.in_flight.clear()
+        snapshot_utils.decoded.update(fetched_at=None, table=None)
+        self.client = FakePolygonClient(latency=0)
+
+    async def warm(self):
+        await get_market_snapshot(self.client)
+        await cache_utils.in_flight[MARKET_SNAPSHOT_KEY]
+
+    def test_table_round_trips(self):
+        table = SnapshotTable.from_snapshots(self.client.get_snapshot_all("stocks"))
+        restored = SnapshotTable.from_bytes(table.to_bytes())
+
+        self.assertEqual(restored.symbols, table.symbols)
+        self.assertEqual(restored.get("AAPL"), table.get("AAPL"))
+        self.assertIsNone(restored.get("NOPE"))
+        self.assertEqual(restored.breadth(), (52, 51))
+
+    async def test_snapshots_come_from_the_bulk_table_once_cached(self):
+        # the first request falls back to the ticker's own snapshot while the
+        # bulk table loads in the background
+        cold = await fetch_snapshot("AAPL", self.client)
+        await cache_utils.in_flight[MARKET_SNAPSHOT_KEY]
+        self.assertEqual(self.client.calls["get_snapshot_ticker"], 1)
+
+        for ticker in ("AAPL", "MSFT", "T0042"):
+            snapshot = await fetch_snapshot(ticker, self.client)
+            self.assertEqual(set(snapshot), set(cold))
+        self.assertEqual(self.client.calls["get_snapshot_ticker"], 1)
+        self.assertEqual(self.client.calls["get_snapshot_all"], 1)
+
+    async def test_market_summary(self):
+        self.assertEqual(await market_summary_text(self.client), "")
+        await self.warm()
+
+        summary = await market_summary_text(self.client)
+        self.assertTrue(summary.startswith("### Market Snapshot\n"))
+        self.assertIn("SPY: ", summary)
+        self.assertIn("Advancing: 52, declining: 51", summary)
+        self.assertIn("Top gainers: ", summary)
+        self.assertIn("Top losers: ", summary)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import unittest
+
+from fakes import FakePolygonClient, setup_reasoning_path
+
+setup_reasoning_path()
+
+from agent.utils.stream_utils import ResponseStreamParser  # noqa: E402
+from agent.utils.widget_utils import WidgetHydrator  # noqa: E402
+
+OUTPUT = json.dumps(
+    {
+        "widgets": [
+            {"type": "showStockPrice", "parameters": {"symbol": "AAPL"}},
+            {"type": "showStockChart", "parameters": {"symbol": "MS\"FT", "note": "a}b\\c"}},
+        ],
+        "response": 'Apple said "records" again. Café sales rose \\ 5% this year! Done',
+    }
+)
+
+
+def parse(chunks):
+    parser = ResponseStreamParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events + parser.finish()
+
+
+class TestResponseStreamParser(unittest.TestCase):
+    def test_any_chunking_gives_the_same_events(self):
+        expected = parse([OUTPUT])
+        self.assertEqual(
+            [value for kind, value in expected if kind == "widget"],
+            json.loads(OUTPUT)["widgets"],
+        )
+        self.assertEqual(
+            " ".join(value for kind, value in expected if kind == "response"),
+            json.loads(OUTPUT)["response"],
+        )
+        # chunk boundaries inside strings, escapes and \u sequences
+        for size in (1, 2, 3, 5, 7):
+            with self.subTest(size=size):
+                chunks = [OUTPUT[i : i + size] for i in range(0, len(OUTPUT), size)]
+                self.assertEqual(parse(chunks), expected)
+
+    def test_truncated_widget_is_not_emitted(self):
+        events = parse(['{"widgets": [{"type": "showStockPrice", "parameters": {"symbol": "AA'])
+        self.assertEqual(events, [])
+
+    def test_truncated_response_keeps_the_text_so_far(self):
+        events = parse(['{"widgets": [], "response": "Apple is up today. And'])
+        self.assertEqual(events, [("response", "Apple is up today. And")])
+
+    def test_malformed_widgets_are_skipped(self):
+        events = parse(
+            [
+                '{"widgets": [{"parameters": {"symbol": "AAPL"}}, '
+                '{"type": "showSpreadsheet", "parameters": "AAPL"}, '
+                '{"type": "showMarketOverview"}], "response": "Here you go."}'
+            ]
+        )
+        self.assertEqual(
+            events,
+            [
+                ("widget", {"type": "showMarketOverview", "parameters": {}}),
+                ("response", "Here you go."),
+            ],
+        )
+
+
+class TestWidgetHydrator(unittest.IsolatedAsyncioTestCase):
+    async def test_spreadsheet_without_parameters_gets_empty_data(self):
+        client = FakePolygonClient(latency=0)
+        hydrator = WidgetHydrator(client)
+        widget = {"type": "showSpreadsheet"}
+        hydrator.add(widget)
+        await asyncio.wait_for(hydrator.wait(), 1)
+
+        self.assertEqual(widget["data"], [])
+        self.assertEqual(client.total_calls, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
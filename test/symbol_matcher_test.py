@@ -0,0 +1,60 @@
+import unittest
+
+from fakes import setup_reasoning_path
+
+setup_reasoning_path()
+
+from agent.utils.symbol_utils import SymbolMatcher  # noqa: E402
+
+ENTRIES = [
+    ("AAPL", ["apple", "apple inc"]),
+    ("AMZN", ["amazon"]),
+    ("BAC", ["bank of america"]),
+    ("MSFT", ["microsoft"]),
+    ("TGT", ["~target"]),
+    ("TSLA", ["tesla"]),
+]
+
+# utterance -> symbols, or None when the LLM has to resolve it
+CASES = [
+    # single
+    ("What is the price of AAPL?", ["AAPL"]),
+    ("How is Apple doing today?", ["AAPL"]),
+    ("Show me a chart of Tesla stock over the last year", ["TSLA"]),
+    ("How is Bank of America performing?", ["BAC"]),
+    ("What's $MSFT trading at?", ["MSFT"]),
+    # multiple
+    ("Compare MSFT and AAPL", ["MSFT", "AAPL"]),
+    ("Microsoft vs Apple", ["MSFT", "AAPL"]),
+    ("Show me Amazon, Tesla and Microsoft", ["AMZN", "TSLA", "MSFT"]),
+    ("Apple and apple inc", ["AAPL"]),
+    # ambiguous
+    ("Show me Target", None),
+    ("How are they doing?", None),
+    ("Compare it with Tesla", None),
+    # comparisons with a stock from an earlier turn
+    ("Compare with Microsoft", None),
+    ("How does Tesla compare?", None),
+    ("Show me Amazon versus", None),
+    # unknown tickers and companies
+    ("What about XYZQ?", None),
+    ("Show me Etsy", None),
+    ("How is the market doing?", None),
+    # known and unknown mixed
+    ("Show me Amazon and Etsy", None),
+    ("Price of gold and Apple", None),
+    ("Compare Tesla to the Nasdaq", None),
+    ("Compare AAPL and XYZQ", None),
+]
+
+
+class TestSymbolMatcher(unittest.TestCase):
+    def test_cases(self):
+        matcher = SymbolMatcher(ENTRIES)
+        for utterance, symbols in CASES:
+            with self.subTest(utterance=utterance):
+                self.assertEqual(matcher.match(utterance), symbols)
+
+
+if __name__ == "__main__":
+    unittest.main()
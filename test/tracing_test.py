@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+import unittest
+
+from fakes import FakeAsyncLLMClient, FakePolygonClient, FakeRedis, setup_reasoning_path
+
+setup_reasoning_path()
+os.environ.setdefault("BAR_STORE_DIR", tempfile.mkdtemp(prefix="tracing-bars-"))
+os.environ.setdefault(
+    "FINANCIALS_STORE_DIR", tempfile.mkdtemp(prefix="tracing-financials-")
+)
+
+from prometheus_client import REGISTRY  # noqa: E402
+
+from agent import executor  # noqa: E402
+from agent.utils import cache_utils, cancel_utils, snapshot_utils  # noqa: E402
+
+
+class TestTurnTracing(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        cache_utils.redis_client = FakeRedis()
+        cache_utils.local_cache.clear()
+        cache_utils.invalidation_listener = None
+        cache_utils.in_flight.clear()
+        cancel_utils.cancel_listener = None
+        cancel_utils.tokens.clear()
+        # per-ticker snapshots, so each turn's Polygon calls are its own
+        snapshot_utils.BULK_SNAPSHOT_TTL = 0
+        self.addCleanup(setattr, snapshot_utils, "BULK_SNAPSHOT_TTL", 60)
+        self.llm = FakeAsyncLLMClient(latency=0.01)
+        self.polygon = FakePolygonClient(latency=0.01)
+        executor.client = self.llm
+        executor.polygon_client = self.polygon
+
+    async def asyncTearDown(self):
+        cancel_utils.cancel_listener.cancel()
+
+    async def run_turn(self, question: str, task_id: str, history=(), session=None):
+        """The structured record logged for the turn"""
+        with self.assertLogs(level="INFO") as logs:
+            async for _ in executor.run_agent(
+                {
+                    "messages": [*history, {"role": "user", "content": question}],
+                    "session": {"guid": task_id, **(session or {})},
+                    "task_id": task_id,
+                }
+            ):
+                pass
+        return [
+            json.loads(line.split("Turn timings: ", 1)[1])
+            for line in logs.output
+            if "Turn timings: " in line
+        ][-1]
+
+    async def test_turn_record_attributes_work_to_the_turn(self):
+        record = await self.run_turn("Tell me about the company NVDA", "first")
+
+        self.assertEqual(record["outcome"], "answered")
+        self.assertEqual(
+            record["upstream_calls"],
+            {
+                "get_ticker_details": 1,
+                "get_snapshot_ticker": 1,
+                "get_aggs": 1,
+                "list_stock_financials": 1,
+            },
+        )
+        self.assertEqual(record["cache"]["profile"], {"miss": 1})
+        for name in ("fundamentals", "layer.profile", "polygon.get_aggs", "widget_hydration"):
+            self.assertEqual(record["spans"][name]["count"], 1, name)
+        self.assertGreater(record["tokens"]["response"]["completion"], 0)
+
+        # the same question again is answered from the caches
+        record = await self.run_turn("Tell me about the company NVDA", "second")
+        self.assertEqual(record["upstream_calls"], {})
+        self.assertEqual(record["cache"]["profile"], {"hit": 1})
+        self.assertEqual(record["cache"]["response"], {"hit": 1})
+        self.assertNotIn("response", record["tokens"])
+
+    async def test_turns_are_exported_as_metrics(self):
+        before = REGISTRY.get_sample_value(
+            "reasoning_turns_total", {"outcome": "answered"}
+        ) or 0
+        await self.run_turn("What is the price of MSFT?", "metrics")
+
+        self.assertEqual(
+            REGISTRY.get_sample_value("reasoning_turns_total", {"outcome": "answered"}),
+            before + 1,
+        )
+        self.assertGreater(
+            REGISTRY.get_sample_value(
+                "reasoning_span_seconds_count", {"span": "polygon.get_ticker_details"}
+            ),
+            0,
+        )
+
+    async def test_speculative_hit_streams_before_generation_ends(self):
+        # the follow-up needs the LLM to resolve "it", which takes long enough for
+        # the speculative answer about the previous turn's stock to start streaming
+        self.llm.latency = 0.1
+        self.llm.chunk_latency = 0.02
+        history = [
+            {"role": "user", "content": "What is the price of AAPL?"},
+            {"role": "assistant", "content": "Here is what I found for AAPL."},
+        ]
+        record = await self.run_turn(
+            "How has it done this year?",
+            "speculation",
+            history,
+            {"stock-symbols": ["AAPL"]},
+        )
+
+        self.assertEqual(record["speculation"], "hit")
+        stages = record["stages_ms"]
+        self.assertLess(stages["first_widget"], stages["speculative_generation_end"])
+
+
+if __name__ == "__main__":
+    unittest.main()